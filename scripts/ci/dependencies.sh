@@ -1,4 +1,4 @@
 #!/usr/bin/env sh
 
-pip install -e . && pip install numpy torch torchvision
+pip install -e . && pip install numpy pytest torch torchvision
 docker pull lambci/lambda:provided
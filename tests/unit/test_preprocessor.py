@@ -0,0 +1,188 @@
+import pytest
+
+from torchlambda.implementation.utils.template import preprocessor
+
+
+def _resolve(source: str, names=("CACHE", "STREAMING", "BATCH", "TIMING")):
+    return preprocessor.resolve(source, names).splitlines()
+
+
+def test_nested_blocks_keep_taken_branches():
+    source = "\n".join(
+        [
+            "#define CACHE",
+            "#ifdef CACHE",
+            "cache();",
+            "#if defined(STREAMING)",
+            "streaming();",
+            "#else",
+            "dom();",
+            "#endif",
+            "#else",
+            "no_cache();",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == ["cache();", "dom();"]
+
+
+def test_elif_and_negation():
+    source = "\n".join(
+        [
+            "#define BATCH",
+            "#if defined(STREAMING) && defined(BATCH)",
+            "both();",
+            "#elif !defined(STREAMING)",
+            "batch_only();",
+            "#else",
+            "neither();",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == ["batch_only();"]
+
+
+def test_unknown_macros_are_left_intact():
+    source = "\n".join(
+        [
+            "#define CACHE",
+            "#if defined(__cpp_lib_to_chars)",
+            "#ifdef CACHE",
+            "to_chars();",
+            "#endif",
+            "#else",
+            "snprintf();",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == [
+        "#if defined(__cpp_lib_to_chars)",
+        "to_chars();",
+        "#else",
+        "snprintf();",
+        "#endif",
+    ]
+
+
+def test_unknown_block_inside_inactive_branch_is_removed():
+    source = "\n".join(
+        [
+            "#ifdef CACHE",
+            "#ifdef __linux__",
+            "linux();",
+            "#endif",
+            "#endif",
+            "always();",
+        ]
+    )
+    assert _resolve(source) == ["always();"]
+
+
+def test_defines_without_value_are_removed():
+    source = "\n".join(["#define CACHE", "#define BATCH 16", "#define OTHER", "x();"])
+    assert _resolve(source) == ["#define BATCH 16", "#define OTHER", "x();"]
+
+
+def test_empty_function_macro_statements_are_removed():
+    source = "\n".join(
+        [
+            "#define TIMING(name)",
+            "start();",
+            '  TIMING("parse");',
+            "end();",
+        ]
+    )
+    assert _resolve(source) == ["start();", "end();"]
+
+
+def test_function_macro_with_body_is_kept():
+    source = "\n".join(
+        ["#define TIMING(name) timer(name)", 'TIMING("parse");', "end();"]
+    )
+    assert _resolve(source) == [
+        "#define TIMING(name) timer(name)",
+        'TIMING("parse");',
+        "end();",
+    ]
+
+
+def test_empty_lines_are_collapsed():
+    source = "a();\n#ifdef CACHE\n\ncache();\n\n#endif\n\nb();\n"
+    assert preprocessor.resolve(source, ["CACHE"]) == "a();\n\nb();\n"
+
+
+def test_mixed_conditions_substitute_known_macros():
+    source = "\n".join(
+        [
+            "#define STREAMING",
+            "#define BATCH 16",
+            "#if defined(STREAMING) && __cpp_lib_to_chars",
+            "to_chars();",
+            "#elif BATCH == 16 || defined(__linux__)",
+            "batch();",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == [
+        "#define BATCH 16",
+        "#if 1 && __cpp_lib_to_chars",
+        "to_chars();",
+        "#elif 16 == 16 || defined(__linux__)",
+        "batch();",
+        "#endif",
+    ]
+
+
+def test_mixed_conditions_not_depending_on_unknown_macros_are_resolved():
+    source = "\n".join(
+        [
+            "#if defined(STREAMING) && __cpp_lib_to_chars",
+            "to_chars();",
+            "#endif",
+            "#if !(defined(CACHE) || defined(BATCH)) || __cpp_lib_to_chars",
+            "#if not defined(CACHE) and (TIMING == 0)",
+            "neither();",
+            "#endif",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == ["neither();"]
+
+
+def test_nested_unknown_and_known_conditions():
+    source = "\n".join(
+        [
+            "#define CACHE",
+            "#ifdef __linux__",
+            "#if defined(CACHE) && !defined(STREAMING)",
+            "#if __cpp_lib_to_chars || defined(STREAMING)",
+            "to_chars();",
+            "#endif",
+            "#endif",
+            "#endif",
+        ]
+    )
+    assert _resolve(source) == [
+        "#ifdef __linux__",
+        "#if __cpp_lib_to_chars || 0",
+        "to_chars();",
+        "#endif",
+        "#endif",
+    ]
+
+
+def test_only_timing_macros_expanding_to_nothing_are_removed():
+    source = "\n".join(
+        [
+            "#define INIT_TIMING(step)",
+            "#define UNUSED(value)",
+            "INIT_TIMING(model);",
+            "UNUSED(value);",
+        ]
+    )
+    assert _resolve(source) == ["#define UNUSED(value)", "UNUSED(value);"]
+
+
+def test_known_macro_without_value_cannot_be_used_as_value():
+    with pytest.raises(ValueError):
+        _resolve("#define CACHE\n#if CACHE && __cpp_lib_to_chars\n#endif")
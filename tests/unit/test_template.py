@@ -0,0 +1,809 @@
+import base64
+import copy
+import json
+import pathlib
+import re
+import types
+
+import pytest
+import yaml
+
+import torchlambda
+from torchlambda.implementation import template
+from torchlambda.implementation.utils.template import validator
+
+NORMALIZE = {"means": [0.485, 0.456, 0.406], "stddevs": [0.229, 0.224, 0.225]}
+
+INPUT = {
+    "name": "data",
+    "type": "base64",
+    "shape": [1, 3, "width", "height"],
+    "validate_shape": True,
+    "cast": "float",
+    "divide": 255,
+}
+
+RETURN = {
+    "output": {"type": "double", "name": "output"},
+    "result": {
+        "type": "int",
+        "name": "result",
+        "operations": "argmax",
+        "arguments": 1,
+        "item": True,
+    },
+}
+
+
+def _source(**fields):
+    """Create source of default settings updated with fields (None removes field)."""
+    settings = {"input": INPUT, "normalize": NORMALIZE, "return": RETURN}
+    settings.update(fields)
+    settings = copy.deepcopy(
+        {key: value for key, value in settings.items() if value is not None}
+    )
+    instance = validator.get()
+    assert instance.validate(settings), instance.errors
+    return template.create_source(validator.unify(instance.normalized(settings)))
+
+
+@pytest.mark.parametrize(
+    "fields",
+    [
+        {},
+        {"parser": "streaming"},
+        {"input": {**INPUT, "batch": True}},
+        {"cache": {}, "instrumentation": {}},
+        {"event": "apigateway", "compression": {"request": True}},
+    ],
+)
+def test_only_active_code_paths_are_left(fields):
+    source = _source(**fields)
+    # Every placeholder of templates was imputed (others are braced macros)
+    for name in re.findall(r"\{([A-Z_]+)\}", source):
+        assert "#define {} ".format(name) in source, name
+    # Feature switches are resolved, only compiler and platform checks are left
+    for condition in re.findall(
+        r"^\s*#\s*(?:if|ifdef|ifndef|elif)\b(.*)$", source, re.M
+    ):
+        assert all(
+            name.startswith("__") or name == "defined"
+            for name in re.findall(r"[A-Za-z_]\w*", condition)
+        ), condition
+    # Switches without value are removed, empty instrumentation with its calls
+    assert re.search(r"^#define STREAMING$", source, re.M) is None
+    assert "TIMING(" not in source or "#define TIMING(stage) " in source
+
+
+def test_helpers_are_emitted_only_when_used():
+    source = _source()
+    for helper in ("is_batch_of", "decode_batch", "with_bytes"):
+        assert helper not in source
+    assert "decode_batch(" in _source(input={**INPUT, "batch": True})
+    assert "with_bytes(" in _source(compression={"request": True})
+
+
+def test_batch_is_concatenated_into_single_forward():
+    source = _source(input={**INPUT, "batch": True})
+    # Every sample is checked and decoded with shape of single sample
+    assert 'is_batch_of(json_view.GetObject("data"),' in source
+    assert re.search(
+        r"decode_batch\(\s*json_view.GetObject\(\"data\"\),.*?"
+        r"reshape\(\{1, 3, json_view.GetInteger\(\"width\"\), "
+        r"json_view.GetInteger\(\"height\"\)\}\)",
+        source,
+        re.S,
+    )
+    assert "torch::cat(tensors)" in source
+    assert source.count("module->forward(") == 1
+    # Outputs and item results are returned per sample
+    assert 'response.NestedArray<double>("output", output);' in source
+    assert 'response.Array<int>("result", result.reshape({result.size(0)}));' in source
+
+
+def test_inputs_and_returns_follow_forward_signature():
+    source = _source(
+        input=None,
+        normalize=None,
+        inputs=[
+            {**INPUT, "normalize": NORMALIZE},
+            {"name": "features", "type": "float", "shape": [1, 16]},
+        ],
+        returns=[
+            {"index": 0, "output": {"type": "double", "name": "boxes"}},
+            {"key": "scores", "result": RETURN["result"]},
+        ],
+        **{"return": None}
+    )
+    # Inputs are decoded from their own fields and passed in order
+    assert 'decode(json_view.GetObject("data"), torch::kUInt8)' in source
+    assert re.search(
+        r"input_1 = decode<float>\(json_view.GetObject\(\"features\"\), "
+        r"torch::kFloat32, &JsonView::AsDouble\)\s*\.reshape\(\{1, 16\}\)",
+        source,
+    )
+    assert "inputs = {input_0, input_1};" in source
+    # Only input with normalize is preprocessed
+    assert "preprocess_0.Apply<uint8_t>(input_0)" in source
+    assert "preprocess_1" not in source
+    # Returns are taken from tuple element and dict key
+    assert "forwarded.toTuple()->elements()[0].toTensor()" in source
+    assert 'forwarded.toGenericDict().at(c10::IValue{"scores"}).toTensor()' in source
+    assert 'response.Array<double>("boxes", output);' in source
+
+
+def test_top_level_normalize_with_inputs_is_reported(tmp_path, capsys):
+    path = tmp_path / "torchlambda.yaml"
+    with open(path, "w") as file:
+        yaml.safe_dump(
+            {"inputs": [INPUT], "normalize": NORMALIZE, "return": RETURN}, file
+        )
+    with pytest.raises(SystemExit):
+        template.create_template(
+            types.SimpleNamespace(yaml=str(path), destination=str(tmp_path))
+        )
+    assert "must not be present with ''normalize''" in capsys.readouterr().err
+
+
+def test_streaming_parser_reads_payload_without_dom():
+    source = _source(parser="streaming", input={**INPUT, "type": "float"})
+    assert "using JsonView = stream::JsonView;" in source
+    assert "const JsonView json_view{request.payload};" in source
+    assert "Aws::Utils::Json::JsonValue" not in source
+    # Numbers are parsed straight into storage of tensor
+    assert "data.ParseInto(tensor.data_ptr<T>(), tensor.numel());" in source
+    assert "std::from_chars(first, last, value)" in source
+    dom = _source(input={**INPUT, "type": "float"})
+    assert "Aws::Utils::Json::JsonValue{request.payload}" in dom
+    assert "stream::" not in dom
+
+
+@pytest.mark.parametrize(
+    "dtype,scalar,element",
+    [
+        (None, "kUInt8", "uint8_t"),
+        ("short", "kInt16", "int16_t"),
+        ("half", "kFloat16", "c10::Half"),
+        ("float", "kFloat32", "float"),
+    ],
+)
+def test_base64_is_decoded_into_dtype(dtype, scalar, element):
+    source = _source(input={**INPUT, "dtype": dtype} if dtype else INPUT)
+    # Length of decoded bytes is checked against shape before decoding
+    assert (
+        'decoded_length(json_view.GetObject("data")) ==\n'
+        "          c10::elementSize(torch::{}) * 1 * 3 * "
+        'json_view.GetInteger("width") * json_view.GetInteger("height")'.format(scalar)
+        in source
+    )
+    assert 'decode(json_view.GetObject("data"), torch::{})'.format(scalar) in source
+    assert "preprocess_0.Apply<{}>(input_0)".format(element) in source
+    # Little-endian payload is swapped on big-endian hosts
+    assert "to_host_order(buffer);" in source
+
+
+def test_response_is_written_into_single_buffer():
+    source = _source(
+        **{
+            "return": {
+                "output": {"type": "float", "name": "y", "precision": 3},
+                "result": {**RETURN["result"], "type": "long"},
+            }
+        }
+    )
+    # Values are cast to their type and formatted with precision if specified
+    assert 'response.Array<float>("y", output, 3);' in source
+    assert 'response.Item<long>("result", result);' in source
+    assert "return response.Finish();" in source
+    assert "JsonValue response" not in source
+
+
+@pytest.mark.parametrize(
+    "output,call",
+    [
+        (
+            {"type": "float", "encoding": "base64"},
+            'response.Encoded<float>("y", output.toType(torch::kFloat32), "float32");',
+        ),
+        (
+            {"type": "float", "encoding": "base64", "dtype": "float16"},
+            'response.Encoded<c10::Half>("y", output.toType(torch::kFloat16), '
+            '"float16");',
+        ),
+        (
+            {"type": "double", "encoding": "base64", "dtype": "uint8"},
+            'response.Encoded<uint8_t>("y", output.toType(torch::kUInt8), "uint8");',
+        ),
+    ],
+)
+def test_encoded_output_is_cast_to_dtype(output, call):
+    source = _source(**{"return": {"output": {**output, "name": "y"}}})
+    assert call in source
+    assert "append_base64(buffer_, bytes, length);" in source
+
+
+def _affine(source, index=0):
+    """Return type, scale and shift of folded preprocessing of input."""
+    match = re.search(
+        r"static const Affine<(\w+)> preprocess_{}\{{\s*"
+        r"\{{([^}}]*)\}},\s*\{{([^}}]*)\}},".format(index),
+        source,
+    )
+    assert match is not None
+    return (
+        match.group(1),
+        [float(value) for value in match.group(2).split(",")],
+        [float(value) for value in match.group(3).split(",")],
+    )
+
+
+def test_divide_and_normalize_are_folded_into_affine():
+    element, scale, shift = _affine(_source())
+    assert element == "float"
+    # (x / divide - mean) / stddev == x * scale + shift
+    assert scale == pytest.approx(
+        [1 / (255 * stddev) for stddev in NORMALIZE["stddevs"]]
+    )
+    assert shift == pytest.approx(
+        [
+            -mean / stddev
+            for mean, stddev in zip(NORMALIZE["means"], NORMALIZE["stddevs"])
+        ]
+    )
+
+    element, scale, shift = _affine(
+        _source(normalize=None, input={**INPUT, "cast": "double"})
+    )
+    assert (element, scale, shift) == ("double", pytest.approx([1 / 255]), [0.0])
+
+
+def test_cast_only_is_not_folded():
+    source = _source(normalize=None, input={**INPUT, "divide": None, "cast": "double"})
+    assert "Affine<" not in source.split("REQUEST HANDLER")[1]
+    assert "input_0 = input_0.toType(torch::kFloat64);" in source
+
+
+def test_preallocated_buffers_are_reused():
+    source = _source(preallocate=True, input={**INPUT, "shape": [1, 3, 224, 224]})
+    # Storage of decoded and preprocessed input is allocated once in main()
+    assert re.search(
+        r"Buffers buffers\{\s*\{\s*/\* Input \"data\" \*/\s*"
+        r"torch::empty\(\{1, 3, 224, 224\}, torch::kUInt8\),\s*"
+        r"torch::empty\(\{1, 3, 224, 224\}, torch::kFloat32\),\s*\},",
+        source,
+    )
+    # Request is decoded and preprocessed straight into it
+    assert 'decode_into(json_view.GetObject("data"), buffers.inputs[0]);' in source
+    assert (
+        "preprocess_0.ApplyInto<uint8_t>(buffers.inputs[0], buffers.inputs[1]);"
+        in source
+    )
+    assert "torch::Tensor input_0 = buffers.inputs[1];" in source
+    assert "c10::elementSize(torch::kUInt8) * 1 * 3 * 224 * 224))" in source
+
+
+def test_preallocated_array_length_is_checked():
+    source = _source(
+        preallocate=True, input={**INPUT, "type": "float", "shape": [1, 3, 4, 4]}
+    )
+    assert (
+        'if (json_view.GetObject("data").AsArray().GetLength() != '
+        "static_cast<std::size_t>(1 * 3 * 4 * 4))" in source
+    )
+    assert (
+        'decode_into<float>(json_view.GetObject("data"), buffers.inputs[0], '
+        "&JsonView::AsDouble);" in source
+    )
+
+
+def _payloads(source):
+    """Return warm-up payloads embedded in source."""
+    return [
+        json.loads(payload)
+        for payload in re.findall(r"R\"torchlambda\((.*?)\)torchlambda\"", source)
+    ]
+
+
+def test_synthetic_warmup_payload_matches_input():
+    source = _source(warmup={"fields": {"width": 2, "height": 3}, "iterations": 4})
+    assert "#define WARMUP 4" in source
+    (payload,) = _payloads(source)
+    assert (payload["width"], payload["height"]) == (2, 3)
+    # Zeroed bytes of single sample with shape [1, 3, 2, 3]
+    assert base64.b64decode(payload["data"]) == bytes(1 * 3 * 2 * 3)
+    assert "const auto response = handler_fn(request);" in source
+
+
+def test_warmup_payloads_are_read_from_files(tmp_path):
+    with open(tmp_path / "request.json", "w") as file:
+        file.write('{\n  "data": "AAAA", "width": 1,\n  "height": 1\n}\n')
+    with open(tmp_path / "torchlambda.yaml", "w") as file:
+        yaml.safe_dump(
+            {
+                "input": INPUT,
+                "normalize": NORMALIZE,
+                "return": RETURN,
+                "warmup": {"payloads": ["request.json"]},
+            },
+            file,
+        )
+    template.create_template(
+        types.SimpleNamespace(
+            yaml=str(tmp_path / "torchlambda.yaml"), destination=str(tmp_path)
+        )
+    )
+    source = (tmp_path / "main.cpp").read_text()
+    assert 'R"torchlambda({"data":"AAAA","width":1,"height":1})torchlambda"' in source
+
+
+@pytest.mark.parametrize(
+    "threads,intra_op,inter_op",
+    [
+        ({"intra_op": "auto", "inter_op": 2}, "available_cpus()", "2"),
+        ({"intra_op": 3}, "3", "1"),
+    ],
+)
+def test_threads_are_set_before_model_is_loaded(threads, intra_op, inter_op):
+    source = _source(threads=threads)
+    assert "#define INTRA_OP_THREADS {}\n".format(intra_op) in source
+    assert "#define INTER_OP_THREADS {}\n".format(inter_op) in source
+    assert (
+        source.index("at::set_num_threads(INTRA_OP_THREADS);")
+        < source.index("at::set_num_interop_threads(INTER_OP_THREADS);")
+        < source.index("torch::jit::load(")
+    )
+
+
+def test_cache_key_covers_every_field_of_inputs():
+    source = _source(cache={"entries": 16, "bytes": 1000, "report": 5})
+    for define in ("CACHE 16", "CACHE_BYTES 1000", "CACHE_REPORT 5"):
+        assert "#define {}\n".format(define) in source
+    assert 'cache_key(json_view, {"data", "width", "height"});' in source
+    # Hit returns before inputs are created, miss is inserted after response
+    assert (
+        source.index("cache.Find(key)")
+        < source.index("create_inputs(json_view, inputs")
+        < source.index("cache.Insert(key, body);")
+    )
+    # Whole key is compared, colliding hash is a miss
+    assert "found->second->key == key" in source
+
+    source = _source(
+        cache={},
+        input=None,
+        normalize=None,
+        inputs=[
+            {**INPUT, "shape": [1, "n"]},
+            {"name": "ids", "type": "long", "shape": [1, "n", "k"]},
+        ],
+    )
+    assert 'cache_key(json_view, {"data", "ids", "n", "k"});' in source
+
+
+def test_stages_are_timed_in_order_of_handler():
+    source = _source(instrumentation={"namespace": "service/model"})
+    assert '#define INSTRUMENTATION "service/model"\n' in source
+    assert '{"parse", "decode", "preprocess",\n' in source
+    # Inputs are created (and response serialized) by functions before handler
+    stages = [
+        source.index("TIMING({});".format(stage))
+        for stage in ("parse", "decode", "preprocess", "serialize")
+    ]
+    assert stages == sorted(stages)
+    forward = source.index("module->forward(std::move(inputs));")
+    assert (
+        forward
+        < source.index("TIMING(forward);")
+        < source.index("create_response(forwarded", forward)
+        < source.index("timings.Emit();", forward)
+    )
+    assert "timings.Milliseconds()" not in source
+    assert "Timings::names, timings.Milliseconds()" in _source(
+        instrumentation={"response": True}
+    )
+    # Hot path has no instrumentation at all without it
+    assert "TIMING(" not in _source()
+
+
+def test_initialization_steps_are_timed_in_order():
+    source = _source(
+        instrumentation={},
+        threads={"intra_op": 2},
+        preallocate=True,
+        input={**INPUT, "shape": [1, 3, 2, 2]},
+        warmup={},
+    )
+    steps = [
+        source.index("INIT_TIMING({});".format(step))
+        for step in (
+            "aws_init",
+            "threads",
+            "graph_executor",
+            "load",
+            "eval",
+            "buffers",
+            "warmup",
+        )
+    ]
+    assert steps == sorted(steps)
+    assert steps[3] > source.index("torch::jit::load(")
+    # Breakdown is only printed (and runtime not entered) when run locally
+    assert re.search(
+        r"if \(std::getenv\(\"AWS_LAMBDA_RUNTIME_API\"\) == nullptr\)\s*"
+        r"init_timings.Print\(\);\s*else \{\s*init_timings.Emit\(\);\s*"
+        r"aws::lambda_runtime::run_handler\(invoke\);",
+        source,
+    )
+    assert "INIT_TIMING(threads);" not in _source(instrumentation={})
+    assert "InitTimings" not in _source()
+
+
+def test_custom_template_times_initialization():
+    with open(
+        pathlib.Path(torchlambda.__file__).parent / "templates/custom/main.cpp"
+    ) as file:
+        source = file.read()
+    steps = [
+        source.index('init_timings.Mark("{}");'.format(step))
+        for step in ("graph_executor", "load", "eval", "aws_init")
+    ]
+    assert steps == sorted(steps)
+    assert source.index("init_timings.Finish();") > steps[-1]
+
+
+def test_sampled_forward_is_profiled():
+    source = _source(profiling={"sample": 0.25, "top": 5})
+    assert "#define PROFILING 0.25\n" in source
+    assert "#define PROFILING_TOP 5\n" in source
+    assert "return distribution(generator) < PROFILING;" in source
+    assert "std::min<std::size_t>(operators.size(), PROFILING_TOP)" in source
+    assert "profiled([&] { return module->forward(std::move(inputs)); });" in source
+    assert "PROFILING_TRACE" not in source
+
+    source = _source(profiling={"output": "trace", "directory": "/tmp/traces"})
+    assert '#define PROFILING_TRACE "/tmp/traces"\n' in source
+    assert "torch::autograd::profiler::RecordProfile guard{path};" in source
+    assert "PROFILING_TOP" not in source
+
+
+def test_pipeline_has_no_redundant_copies():
+    source = _source()
+    # Base64 is decoded straight into storage owned by tensor
+    assert "torch::from_blob" not in source
+    assert "Aws::Utils::Base64" not in source
+    assert "decode_into(text, tensor);" in source
+    # Outputs are serialized and results computed from returned tensor
+    assert "const auto result = torch::argmax(output,1);" in source
+    assert "toType" not in source.split("create_response")[1]
+    # Streaming parser reads base64 text in place from payload
+    streaming = _source(parser="streaming")
+    assert "static std::string_view base64_text(const stream::JsonView &data)" in (
+        streaming
+    )
+    assert "AsString()" not in streaming.split("base64_text")[1].split("}")[0]
+    # Encoded returns of matching type are not converted
+    preallocated = _source(
+        preallocate=True,
+        input={**INPUT, "shape": [1, 3, 2, 2]},
+        **{"return": {"output": {"type": "float", "encoding": "base64"}}}
+    )
+    assert "if (tensor.scalar_type() == type)\n    return tensor;" in preallocated
+
+
+def test_predictions_rank_top_classes():
+    source = _source(
+        **{
+            "return": {
+                "predictions": {
+                    "labels": "/opt/labels.txt",
+                    "softmax": 1,
+                    "top": 3,
+                    "threshold": 0.2,
+                    "precision": 4,
+                }
+            }
+        }
+    )
+    assert 'static const Labels labels_0{"/opt/labels.txt"};' in source
+    assert (
+        "const auto scores = torch::softmax("
+        "output.reshape({1, -1}).to(torch::kFloat32), 1);" in source
+    )
+    assert "torch::topk(scores, std::min<int64_t>(3, scores.size(1)), 1);" in source
+    assert (
+        'response.Predictions("predictions", std::get<0>(ranked), '
+        "std::get<1>(ranked), &labels_0, 0.2, 4);" in source
+    )
+
+
+def test_batched_predictions_of_every_class():
+    source = _source(
+        input={**INPUT, "batch": True},
+        **{"return": {"predictions": {"name": "classes", "softmax": 2}}}
+    )
+    # Temperature divides scores, all classes are sorted without threshold
+    assert (
+        "torch::softmax(output.reshape({output.size(0), -1})"
+        ".to(torch::kFloat32) / 2.0, 1);" in source
+    )
+    assert "const auto ranked = torch::sort(scores, 1, true);" in source
+    assert (
+        'response.NestedPredictions("classes", std::get<0>(ranked), '
+        "std::get<1>(ranked), nullptr, "
+        "-std::numeric_limits<double>::infinity());" in source
+    )
+    assert "labels_0" not in source
+
+
+def test_proxy_event_body_is_request():
+    source = _source(event="apigateway", input={**INPUT, "name": "image"})
+    # Binary body becomes data of base64 input, shape fields come from query
+    assert '#define APIGATEWAY_BINARY "image"\n' in source
+    assert 'request.Insert(APIGATEWAY_BINARY, event.GetObject("body"));' in source
+    assert source.index('event.GetObject("queryStringParameters")') < source.index(
+        'event.GetObject("headers")'
+    )
+    assert (
+        'const auto binary = event.GetObject("isBase64Encoded").Raw() == "true";'
+        in source
+    )
+    # Every response (failures with status 400) is wrapped into proxy response
+    assert "return proxy(handler_fn(request));" in source
+    assert '"{\\"statusCode\\":400"' in source
+    assert "APIGATEWAY" not in _source()
+
+
+def test_records_are_forwarded_together_with_partial_failures():
+    source = _source(event="sqs", input={**INPUT, "batch": True}, records_batch=8)
+    assert "#define RECORDS 8\n" in source
+    assert 'identifiers[index] = record.GetObject("messageId").Raw();' in source
+    assert 'const auto payload = record.GetObject("body").AsString();' in source
+    # Stackable records are concatenated (up to RECORDS), outputs split per record
+    assert "(batch.size() == RECORDS || !stackable(batch.front().second, inputs)))" in (
+        source
+    )
+    assert "stacked.push_back(torch::cat(tensors));" in source
+    assert "create_response(forwarded, first, samples" in source
+    # Invalid records are reported, only they are retried
+    assert 'body.append("{\\"batchItemFailures\\":[");' in source
+    assert 'body.append("{\\"itemIdentifier\\":");' in source
+    assert re.search(
+        r"if \(!created.is_success\(\)\) \{\s*failed\[index\] = true;", source
+    )
+
+
+def test_kinesis_records_are_decoded():
+    source = _source(event="kinesis", input={**INPUT, "batch": True})
+    assert "#define RECORDS 64\n" in source
+    assert 'GetObject("kinesis").AsObject();' in source
+    assert 'identifiers[index] = record.GetObject("sequenceNumber").Raw();' in source
+    assert 'const auto payload = decode_text(record.GetObject("data"));' in source
+
+
+def test_compressed_request_is_decompressed_into_input_shape():
+    source = _source(compression={"request": True})
+    assert re.search(
+        r"input_0 = decompress\(\s*json_view.GetObject\(\"data\"\),\s*"
+        r"\{1, 3, json_view.GetInteger\(\"width\"\), "
+        r"json_view.GetInteger\(\"height\"\)\}, torch::kUInt8\);",
+        source,
+    )
+    # Decompressed length has to match input shape exactly
+    assert "return status == Z_STREAM_END && stream.avail_out == 0;" in source
+    assert "inflateInit2(&stream, 15 + 32)" in source
+    # Length of compressed data says nothing about input shape
+    assert 'decoded_length(json_view.GetObject("data"))' not in source
+    assert "ZSTD_" not in source
+    assert "written == capacity" in _source(compression={"request": True, "zstd": True})
+
+
+@pytest.mark.parametrize(
+    "codec,call",
+    [
+        ("gzip", "deflateInit2(&stream"),
+        ("deflate", "deflateInit2(&stream"),
+        ("zstd", "ZSTD_compress("),
+    ],
+)
+def test_response_is_compressed(codec, call):
+    source = _source(
+        compression={"response": codec, "zstd": codec == "zstd"},
+    )
+    assert '#define RESPONSE_COMPRESSION "{}"\n'.format(codec) in source
+    assert call in source
+    assert "body = compress_response(body);" in source
+
+
+def test_image_is_decoded_resized_and_cropped():
+    image = {**INPUT, "type": "image", "shape": [1, 3, 224, 224]}
+    source = _source(input={**image, "resize": 256})
+    assert re.search(
+        r"input_0 = decode_image\(\s*json_view.GetObject\(\"data\"\),\s*"
+        r"\{1, 3, 224, 224\}, 256, Interpolation::bilinear\);",
+        source,
+    )
+    # Decoder is limited to JPEG and PNG and compiled into deployment
+    assert source.index("#define STBI_ONLY_JPEG") < source.index(
+        "#include <stb_image.h>"
+    )
+    assert "#define STB_IMAGE_IMPLEMENTATION" in source
+    # Decoded pixels are mapped via lookup table of folded preprocessing
+    assert "preprocess_0.Apply<uint8_t>(input_0);" in source
+    # Without resize image only covers crop
+    assert re.search(
+        r"\{1, 3, 224, 224\}, 0, Interpolation::nearest\);",
+        _source(input={**image, "interpolation": "nearest"}),
+    )
+    assert "stb_image" not in _source()
+
+
+@pytest.mark.parametrize("format", ["msgpack", "cbor"])
+def test_binary_format_replaces_json_view(format):
+    source = _source(event="apigateway", format=format)
+    assert '#define FORMAT "{}"\n'.format(format) in source
+    assert "using JsonView = binary::View;" in source
+    # Proxy body is base64 decoded before it is parsed
+    assert re.search(
+        r"const auto payload = event.GetObject\(\"isBase64Encoded\"\).Raw\(\) == "
+        r"\"true\"\s*\? decode_text\(event_body\)",
+        source,
+    )
+
+
+def test_npy_header_is_matched_against_input():
+    source = _source(
+        event="apigateway", format="npy", input={**INPUT, "dtype": "float"}
+    )
+    assert '#define NPY "data"\n' in source
+    # Dimensions of array become shape fields of input
+    assert 'static const char *const names[]{"", "", "width", "height"};' in source
+    searched = re.findall(r"header.find\(\"('[^\"]*)\"", source)
+    assert searched == ["'descr':", "'<f4'", "'fortran_order': False", "'shape':"]
+    assert "'|u1'" in _source(event="apigateway", format="npy")
+
+
+def test_npy_header_written_by_numpy_is_accepted():
+    numpy = pytest.importorskip("numpy")
+    source = _source(
+        event="apigateway", format="npy", input={**INPUT, "dtype": "float"}
+    )
+    searched = re.findall(r"header.find\(\"('[^\"]*)\"", source)
+    header = repr(
+        numpy.lib.format.header_data_from_array_1_0(
+            numpy.zeros((1, 3, 2, 2), numpy.float32)
+        )
+    )
+    assert all(value in header for value in searched)
+
+
+MODELS = [
+    {
+        "name": "classifier",
+        "path": "/opt/classifier.ptc",
+        "input": INPUT,
+        "normalize": NORMALIZE,
+        "return": RETURN,
+    },
+    {
+        "name": "regressor",
+        "path": "/opt/regressor.ptc",
+        "inputs": [{"name": "data", "type": "float", "shape": [1, 16]}],
+        "returns": [{"index": 0, "output": {"type": "float", "name": "y"}}],
+    },
+]
+
+
+def test_models_are_routed_by_request_field():
+    source = _source(
+        input=None,
+        normalize=None,
+        models=MODELS,
+        routing={"field": "name", "bytes": 1000},
+        **{"return": None}
+    )
+    assert '#define MODELS "name"\n' in source
+    assert "#define MODELS_BYTES 1000\n" in source
+    # Code of each model is generated in it's own namespace
+    assert (
+        'static const Route routes[]{{"classifier", "/opt/classifier.ptc", '
+        "&model_0::create_inputs, &model_0::create_response}, "
+        '{"regressor", "/opt/regressor.ptc", '
+        "&model_1::create_inputs, &model_1::create_response}};" in source
+    )
+    model_0, model_1 = re.findall(
+        r"namespace (model_\d) \{(.*?)\} // namespace \1", source, re.S
+    )
+    assert "preprocess_0.Apply<uint8_t>(input_0);" in model_0[1]
+    assert "Affine" not in model_1[1]
+    assert "forwarded.toTuple()->elements()[0].toTensor()" in model_1[1]
+    # Model is loaded only for valid request, others are evicted before it
+    assert source.index("create_inputs(json_view, inputs") < source.index(
+        "models.Load(*route);"
+    )
+    assert re.search(
+        r"Evict\(file_bytes\(route.path\)\);\s*auto module = "
+        r"Aws::MakeShared<torch::jit::script::Module>\(\s*\"TORCHSCRIPT_MODEL\", "
+        r"torch::jit::load\(route.path",
+        source,
+    )
+
+
+def test_top_level_normalize_with_models_is_reported(tmp_path, capsys):
+    path = tmp_path / "torchlambda.yaml"
+    with open(path, "w") as file:
+        yaml.safe_dump({"models": MODELS[:1], "normalize": NORMALIZE}, file)
+    with pytest.raises(SystemExit):
+        template.create_template(
+            types.SimpleNamespace(yaml=str(path), destination=str(tmp_path))
+        )
+    assert "must not be present with ''normalize''" in capsys.readouterr().err
+
+
+CASCADE = {
+    "stages": [
+        {"model": "/opt/tiny.ptc", "threshold": 0.95},
+        {"model": "/opt/small.ptc", "confidence": "margin", "threshold": 0.5},
+    ]
+}
+
+
+def test_cascade_stages_answer_confident_requests():
+    source = _source(cascade={**CASCADE, "field": "answered"})
+    assert "#define CASCADE 2\n" in source
+    assert (
+        'static const Stage stages[]{{"/opt/tiny.ptc", Confidence::probability, '
+        '0.95}, {"/opt/small.ptc", Confidence::margin, 0.5}};' in source
+    )
+    # First stage confident enough answers, the model otherwise
+    assert re.search(
+        r"if \(confidence\(forwarded, stages\[stage\].confidence\) >=\s*"
+        r"stages\[stage\].threshold\)\s*return forwarded;\s*\}\s*"
+        r"return module.forward\(std::move\(inputs\)\);",
+        source,
+    )
+    assert "cascade.Forward(*module, std::move(inputs), stage);" in source
+    # Stage which answered is reported in response
+    assert '#define CASCADE_FIELD "answered"\n' in source
+    assert "response.Integer(CASCADE_FIELD, stage);" in source
+    assert "CASCADE_FIELD" not in _source(cascade={**CASCADE, "field": None})
+
+
+def test_cascade_confidence_of_tuple_element():
+    source = _source(
+        input={**INPUT, "batch": True},
+        returns=[
+            {"index": 0, "output": {"type": "double", "name": "boxes"}},
+            {"index": 1, "output": {"type": "double", "name": "scores"}},
+        ],
+        cascade={**CASCADE, "index": 1},
+        **{"return": None}
+    )
+    assert (
+        "const auto logits = forwarded.toTuple()->elements()[1].toTensor();" in source
+    )
+
+
+def test_session_state_is_passed_between_requests():
+    fields = {
+        "input": {**INPUT, "type": "float", "shape": [1, "frames", 40]},
+        "normalize": None,
+        "returns": [{"index": 0, "output": {"type": "float", "name": "logits"}}],
+        "return": None,
+    }
+    source = _source(
+        session={"field": "stream", "entries": 64, "ttl": 60, "index": 1}, **fields
+    )
+    for define in ("SESSION 64", 'SESSION_FIELD "stream"', "SESSION_TTL 60"):
+        assert "#define {}\n".format(define) in source
+    # State is the last input of forward and element of returned tuple
+    assert re.search(
+        r"inputs.push_back\(sessions.Find\(session\)\);\s*"
+        r"const auto forwarded = module->forward\(std::move\(inputs\)\);\s*"
+        r"sessions.Insert\(session, forwarded.toTuple\(\)->elements\(\)\[1\]\);",
+        source,
+    )
+    assert "forwarded.toTuple()->elements()[0].toTensor()" in source
+    assert (
+        "sessions.Insert(session, forwarded.toTuple()->elements().back());"
+        in _source(session={}, **fields)
+    )
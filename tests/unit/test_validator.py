@@ -0,0 +1,326 @@
+import copy
+
+from torchlambda.implementation.utils.template import validator
+
+NORMALIZE = {"means": [0.485, 0.456, 0.406], "stddevs": [0.229, 0.224, 0.225]}
+
+INPUT = {
+    "name": "data",
+    "type": "base64",
+    "shape": [1, 3, "width", "height"],
+    "cast": "float",
+    "divide": 255,
+}
+
+RETURN = {
+    "output": {"type": "double", "name": "output"},
+    "result": {
+        "type": "int",
+        "name": "result",
+        "operations": "argmax",
+        "arguments": 1,
+        "item": True,
+    },
+}
+
+
+def _errors(**fields):
+    """Validate default settings updated with fields (None removes field)."""
+    settings = {"input": INPUT, "normalize": NORMALIZE, "return": RETURN}
+    settings.update(fields)
+    settings = copy.deepcopy(
+        {key: value for key, value in settings.items() if value is not None}
+    )
+    instance = validator.get()
+    if instance.validate(settings):
+        return ""
+    return str(instance.errors)
+
+
+def test_cache_cannot_return_timings():
+    assert _errors(cache={}, instrumentation={}) == ""
+    assert "cache cannot be used with instrumentation response" in _errors(
+        cache={"entries": 16}, instrumentation={"response": True}
+    )
+
+
+def test_inputs():
+    features = {"name": "features", "type": "float", "shape": [1, 16]}
+    assert _errors(input=None, normalize=None, inputs=[INPUT, features]) == ""
+    assert "either all or none of inputs have to be batched" in _errors(
+        input=None, normalize=None, inputs=[INPUT, {**features, "batch": True}]
+    )
+    assert "must not be present with 'normalize'" in _errors(
+        input=None, inputs=[INPUT, features]
+    )
+    assert "not broadcastable" in _errors(
+        input=None,
+        normalize=None,
+        inputs=[{**INPUT, "normalize": {"means": [0.5] * 4, "stddevs": [1]}}],
+    )
+
+
+def test_returns():
+    returns = [
+        {"index": 0, "output": {"type": "double", "name": "boxes"}},
+        {"key": "scores", "result": RETURN["result"]},
+    ]
+    assert _errors(returns=returns, **{"return": None}) == ""
+    assert "must not be present" in _errors(returns=returns)
+
+
+def test_dtype_requires_base64():
+    assert _errors(input={**INPUT, "dtype": "half"}) == ""
+    assert "dtype" in _errors(input={**INPUT, "type": "float", "dtype": "half"})
+    assert "unallowed value" in _errors(input={**INPUT, "dtype": "complex"})
+
+
+def test_precision_requires_floating_type():
+    output = {"type": "float", "name": "y", "precision": 3}
+    assert _errors(**{"return": {"output": output}}) == ""
+    assert "precision" in _errors(**{"return": {"output": {**output, "type": "int"}}})
+    assert "max value is 17" in _errors(
+        **{"return": {"output": {**output, "precision": 18}}}
+    )
+
+
+def test_only_arrays_can_be_encoded():
+    result = {**RETURN["result"], "encoding": "base64"}
+    assert "only arrays (item: False) can be encoded in base64" in _errors(
+        **{"return": {"result": result}}
+    )
+    assert _errors(**{"return": {"result": {**result, "item": False}}}) == ""
+    assert "dtype" in _errors(
+        **{"return": {"output": {"type": "float", "name": "y", "dtype": "int8"}}}
+    )
+
+
+def test_preallocate_requires_static_inputs():
+    static = {**INPUT, "shape": [1, 3, 224, 224]}
+    assert _errors(preallocate=True, input=static) == ""
+    message = "preallocate requires static (integer) shapes of all inputs without batch"
+    assert message in _errors(preallocate=True)
+    assert message in _errors(preallocate=True, input={**static, "batch": True})
+
+
+def test_synthetic_warmup_requires_shape_fields():
+    assert _errors(warmup={"fields": {"width": 2, "height": 2}}) == ""
+    assert _errors(warmup={"payloads": ["request.json"]}) == ""
+    assert "values of shape fields ['height'] have to be provided" in _errors(
+        warmup={"fields": {"width": 2}}
+    )
+
+
+def test_threads():
+    assert _errors(threads={"intra_op": "auto", "inter_op": 2}) == ""
+    assert "intra_op" in _errors(threads={"intra_op": "all"})
+    assert "inter_op" in _errors(threads={"inter_op": 0})
+
+
+def test_cache_is_per_request():
+    assert "cache cannot be used with sqs event" in _errors(
+        cache={}, event="sqs", input={**INPUT, "batch": True}
+    )
+    assert "min value is 1" in _errors(cache={"entries": 0})
+
+
+def test_instrumentation_namespace():
+    assert _errors(instrumentation={"namespace": "service/model"}) == ""
+    assert "namespace" in _errors(instrumentation={"namespace": 'a"b'})
+
+
+def test_profiling():
+    assert _errors(profiling={"sample": 0.1, "output": "trace"}) == ""
+    assert "max value is 1" in _errors(profiling={"sample": 2})
+    assert "unallowed value" in _errors(profiling={"output": "json"})
+
+
+def test_predictions():
+    predictions = {"softmax": 1, "top": 5, "threshold": 0.1, "labels": "l.txt"}
+    assert _errors(**{"return": {"predictions": predictions}}) == ""
+    assert "has to be positive" in _errors(
+        **{"return": {"predictions": {"softmax": 0}}}
+    )
+    assert "names of returned outputs, results and predictions have to be unique" in (
+        _errors(**{"return": {**RETURN, "predictions": {"name": "output"}}})
+    )
+
+
+def test_event():
+    assert _errors(event="apigateway") == ""
+    assert "unallowed value" in _errors(event="alb")
+
+
+def test_records_events_handle_many_requests():
+    batched = {**INPUT, "batch": True}
+    assert _errors(event="kinesis", input=batched, records_batch=8) == ""
+    assert "preallocate cannot be used with sqs event" in _errors(
+        event="sqs", preallocate=True, input={**INPUT, "shape": [1, 3, 2, 2]}
+    )
+    assert "min value is 1" in _errors(event="sqs", input=batched, records_batch=0)
+
+
+def test_compression():
+    assert _errors(compression={"request": True, "response": "gzip"}) == ""
+    assert "compressed request requires base64 input" in _errors(
+        compression={"request": True}, input={**INPUT, "type": "float"}
+    )
+    assert "compressed response cannot be used with sqs event" in _errors(
+        compression={"response": "gzip"}, event="sqs", input={**INPUT, "batch": True}
+    )
+    assert "zstd response requires zstd: True" in _errors(
+        compression={"response": "zstd"}
+    )
+
+
+def test_image_requires_static_shape():
+    image = {**INPUT, "type": "image", "shape": [1, 3, 224, 224]}
+    assert _errors(input={**image, "resize": 256}) == ""
+    message = "image input requires static shape [1, channels (1 or 3), height, width]"
+    assert message in _errors(input={**image, "shape": [1, 3, "h", "w"]})
+    assert message in _errors(input={**image, "shape": [1, 4, 224, 224]})
+
+
+def test_binary_formats():
+    assert _errors(format="cbor", event="apigateway") == ""
+    assert "msgpack format cannot be used with direct event" in _errors(
+        format="msgpack"
+    )
+    assert "npy format requires single not batched base64 input" in _errors(
+        format="npy", event="apigateway", input={**INPUT, "batch": True}
+    )
+    assert "npy format cannot be used with compressed request" in _errors(
+        format="npy", event="apigateway", compression={"request": True}
+    )
+
+
+def _models(*names, **fields):
+    models = [
+        {"name": name, "path": "/opt/{}.ptc".format(name), "input": INPUT}
+        for name in names
+    ]
+    settings = {"input": None, "normalize": None, "return": None, "models": models}
+    for model in models:
+        model["return"] = RETURN
+    settings.update(fields)
+    return _errors(**settings)
+
+
+def test_models_are_routable():
+    assert _models("first", "second", routing={"field": "name"}) == ""
+    assert "names of models have to be unique" in _models("same", "same")
+    assert "routing field width cannot be data or shape field of input" in _models(
+        "first", routing={"field": "width"}
+    )
+    assert "multiple models cannot be used with sqs event" in _models(
+        "first", event="sqs"
+    )
+    assert "warmup cannot be used with multiple models" in _models(
+        "first", warmup={"payloads": ["request.json"]}
+    )
+    assert "must not be present with 'normalize'" in _models(
+        "first", normalize=NORMALIZE
+    )
+
+
+def test_unify_models():
+    instance = validator.get()
+    settings = {
+        "models": [
+            {
+                "name": "first",
+                "path": "/opt/first.ptc",
+                "input": INPUT,
+                "normalize": NORMALIZE,
+                "return": RETURN,
+            },
+            {
+                "name": "second",
+                "path": "/opt/second.ptc",
+                "inputs": [{"name": "features", "type": "float", "shape": [1, 16]}],
+                "returns": [{"index": 0, "output": {"type": "float", "name": "y"}}],
+            },
+        ]
+    }
+    assert instance.validate(settings), instance.errors
+    settings = validator.unify(instance.normalized(settings))
+    first, second = settings["models"]
+    assert first["inputs"][0]["normalize"] == NORMALIZE
+    assert "normalize" not in first
+    assert second["returns"][0]["index"] == 0
+    # Inputs and returns of all models are those of settings
+    assert [element["name"] for element in settings["inputs"]] == ["data", "features"]
+    assert len(settings["returns"]) == 2
+
+
+def test_unify_single_input_and_return():
+    instance = validator.get()
+    settings = validator.unify(
+        instance.normalized({"input": INPUT, "normalize": NORMALIZE, "return": RETURN})
+    )
+    assert not {"input", "return", "normalize"} & set(settings)
+    assert settings["models"] is None
+    # Top level normalize belongs to single input, whole tensor is returned
+    (element,) = settings["inputs"]
+    assert element["normalize"] == NORMALIZE
+    (returned,) = settings["returns"]
+    assert (returned["index"], returned["key"]) == (None, None)
+    assert returned["output"]["name"] == "output"
+    assert returned["predictions"] is None
+
+
+def test_unify_inputs_and_returns():
+    instance = validator.get()
+    settings = {
+        "inputs": [
+            {**INPUT, "batch": True, "normalize": NORMALIZE},
+            {"name": "features", "type": "float", "shape": [1, 16], "batch": True},
+        ],
+        "returns": [
+            {"index": 0, "output": {"type": "double", "name": "boxes"}},
+            {"key": "scores", "result": RETURN["result"]},
+        ],
+    }
+    settings = validator.unify(instance.normalized(settings))
+    assert [element["normalize"] for element in settings["inputs"]] == [
+        NORMALIZE,
+        None,
+    ]
+    assert [(element["index"], element["key"]) for element in settings["returns"]] == [
+        (0, None),
+        (None, "scores"),
+    ]
+    assert settings["returns"][0]["result"] is None
+
+
+def test_cascade():
+    cascade = {"stages": [{"model": "/opt/tiny.ptc", "threshold": 0.9}]}
+    assert _errors(cascade=cascade) == ""
+    assert "cascade cannot be used with multiple models" in _models(
+        "first", cascade=cascade
+    )
+    assert "cascade cannot be used with sqs event" in _errors(
+        cascade=cascade, event="sqs", input={**INPUT, "batch": True}
+    )
+    assert "reported stage result clashes with returned name" in _errors(
+        cascade={**cascade, "field": "result"}
+    )
+
+
+def test_session():
+    returns = [{"index": 0, "output": {"type": "float", "name": "y"}}]
+    stateful = {"returns": returns, "return": None, "session": {}}
+    assert _errors(**stateful) == ""
+    assert "session requires returns with index of tuple element for each" in (
+        _errors(session={})
+    )
+    assert "session cannot be used with cache" in _errors(cache={}, **stateful)
+    assert "session cannot be used with sqs event" in _errors(
+        event="sqs", input={**INPUT, "batch": True}, **stateful
+    )
+    assert "session field width cannot be data or shape field of input" in _errors(
+        **{**stateful, "session": {"field": "width"}}
+    )
+    assert "state (element 0) cannot be returned" in _errors(
+        **{**stateful, "session": {"index": 0}}
+    )
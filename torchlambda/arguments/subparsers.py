@@ -123,7 +123,7 @@ def build(subparsers) -> None:
         "-DUSE_NUMA=OFF\n"
         "-DUSE_MKLDNN=OFF\n"
         "-DUSE_GLOO=OFF\n"
-        "-DUSE_OPENMP=OFF\n"
+        "-DUSE_OPENMP=OFF (unless --parallel openmp specified)\n"
         "User can override defaults by providing multiple arguments WITHOUT -D, e.g. \n"
         "--pytorch USE_NUMPY=ON USE_OPENMP=ON\n"
         "Default additional command line options: None",
@@ -140,6 +140,30 @@ def build(subparsers) -> None:
         "Default: latest ",
     )
 
+    parser.add_argument(
+        "--parallel",
+        required=False,
+        default=None,
+        choices=["none", "openmp", "native"],
+        help="Intra-op parallel backend of libtorch.\n"
+        "openmp uses OpenMP (linked with deployment), native uses libtorch's own thread pool.\n"
+        "Number of threads can be specified by threads field in YAML settings.\n"
+        "Useful for Lambdas with more memory (and multiple vCPUs available).\n"
+        "If specified, custom image will be build from scratch.\n"
+        "Default: none (single threaded operations)",
+    )
+
+    parser.add_argument(
+        "--zstd",
+        required=False,
+        action="store_true",
+        help="Build zstd codec of compressed requests and responses into the image.\n"
+        "gzip and zlib (deflate) are always available, zstd is used\n"
+        "if compression->zstd is specified in YAML settings.\n"
+        "If specified, custom image will be build from scratch.\n"
+        "Default: False (zstd not available)",
+    )
+
     parser.add_argument(
         "--aws",
         nargs="+",
@@ -0,0 +1,27 @@
+#!/usr/bin/env bash
+
+# Single header JPEG & PNG decoder compiled into deployment (for image inputs)
+
+# Commit of nothings/stb (the repository has no releases) and sha256 of its stb_image.h
+STB_VERSION=$1
+STB_SHA256=$2
+
+echo "torchlambda:: Downloading stb_image (commit ${STB_VERSION})..."
+wget -q -O stb_image.h \
+  "https://raw.githubusercontent.com/nothings/stb/${STB_VERSION}/stb_image.h" || exit 1
+
+if [ -z "${STB_SHA256// /}" ]; then
+  echo "torchlambda:: No STB_SHA256 provided, sha256 of downloaded stb_image.h:"
+  sha256sum stb_image.h
+  echo "torchlambda:: Pass it with --build-arg STB_SHA256=<sha256> to verify the header."
+else
+  echo "${STB_SHA256}  stb_image.h" | sha256sum -c - || {
+    echo "torchlambda:: stb_image.h checksum mismatch, refusing to install it."
+    exit 1
+  }
+fi
+
+mkdir -p /usr/local/include &&
+  mv stb_image.h /usr/local/include/stb_image.h
+
+echo "torchlambda:: stb_image downloaded successfully."
@@ -1,7 +1,8 @@
 #!/usr/bin/env bash
 
 TORCH_VERSION=$1
-shift
+PARALLEL=$2
+shift 2
 
 OP_LIST="/home/app/model.yaml"
 
@@ -16,7 +17,21 @@ BUILD_ARGS+=("-DUSE_NCCL=OFF")
 BUILD_ARGS+=("-DUSE_NUMA=OFF")
 BUILD_ARGS+=("-DUSE_MKLDNN=ON")
 BUILD_ARGS+=("-DUSE_GLOO=OFF")
-BUILD_ARGS+=("-DUSE_OPENMP=OFF")
+
+# Intra-op parallel backend, OpenMP or native (pthreadpool based) thread pool
+case "${PARALLEL}" in
+openmp)
+  BUILD_ARGS+=("-DUSE_OPENMP=ON")
+  BUILD_ARGS+=("-DATEN_THREADING=OMP")
+  ;;
+native)
+  BUILD_ARGS+=("-DUSE_OPENMP=OFF")
+  BUILD_ARGS+=("-DATEN_THREADING=NATIVE")
+  ;;
+*)
+  BUILD_ARGS+=("-DUSE_OPENMP=OFF")
+  ;;
+esac
 
 BUILD_ARGS+=("$@")
 
@@ -48,4 +63,10 @@ sed -i 's/python\ /python3\ /g' /home/app/dependencies/pytorch/scripts/build_mob
 
 ./pytorch/scripts/build_mobile.sh "${BUILD_ARGS[@]}"
 
+# Mark OpenMP build so the deployment is linked against it
+if [ "${PARALLEL}" = "openmp" ]; then
+  mkdir -p pytorch/build_mobile/install/share/torchlambda
+  touch pytorch/build_mobile/install/share/torchlambda/openmp
+fi
+
 echo "torchlambda:: Libtorch built successfully."
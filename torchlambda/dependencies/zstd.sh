@@ -0,0 +1,45 @@
+#!/usr/bin/env bash
+
+# Optional zstd codec of compressed requests and responses (zlib comes with image)
+
+ZSTD=$1
+
+if [ "${ZSTD}" != "ON" ]; then
+  echo "torchlambda:: zstd will not be built."
+  exit 0
+fi
+
+if [ -z "$MAX_JOBS" ]; then
+  if [ "$(uname)" == 'Darwin' ]; then
+    MAX_JOBS=$(sysctl -n hw.ncpu)
+  else
+    MAX_JOBS=$(nproc)
+  fi
+else
+  MAX_JOBS=1
+fi
+
+CMAKE_ARGS=()
+
+if [ -x "$(command -v ninja)" ]; then
+  CMAKE_ARGS+=("-GNinja")
+fi
+
+# Only static library is linked into deployment
+CMAKE_ARGS+=("-DZSTD_BUILD_SHARED=OFF")
+CMAKE_ARGS+=("-DZSTD_BUILD_STATIC=ON")
+CMAKE_ARGS+=("-DZSTD_BUILD_PROGRAMS=OFF")
+CMAKE_ARGS+=("-DZSTD_BUILD_TESTS=OFF")
+
+echo "torchlambda:: zstd build arguments:"
+echo "${CMAKE_ARGS[@]}"
+
+echo "torchlambda:: Cloning and building zstd..."
+git clone https://github.com/facebook/zstd.git &&
+  cd zstd &&
+  mkdir -p build/cmake/build &&
+  cd build/cmake/build &&
+  cmake3 .. -DCMAKE_BUILD_TYPE=Release -DCMAKE_INSTALL_PREFIX=/usr/local "${CMAKE_ARGS[@]}" &&
+  cmake3 --build . --target install -- "-j${MAX_JOBS}"
+
+echo "torchlambda:: zstd built successfully."
@@ -35,6 +35,8 @@ def get_image(args) -> str:
             "aws_components",
             "docker_build",
             "pytorch_version",
+            "parallel",
+            "zstd",
         )
         # If any is not None or empty list
         return any(map(lambda flag: getattr(args, flag), flags))
@@ -81,11 +81,21 @@ def build(args) -> str:
             else " "
         )
 
+    def _parallel(backend: str):
+        return (
+            '--build-arg PARALLEL="{}" '.format(backend) if backend is not None else " "
+        )
+
+    def _zstd(enabled: bool):
+        return '--build-arg ZSTD="ON" ' if enabled else " "
+
     command = "docker {} build {} -t {} ".format(
         *general.parse_none(args.docker, args.docker_build, args.image)
     )
     command += _cmake_environment_variables("PYTORCH", args.pytorch)
     command += _pytorch_version(args.pytorch_version)
+    command += _parallel(args.parallel)
+    command += _zstd(args.zstd)
     command += _cmake_environment_variables(
         "AWS", _create_aws_components(args.aws_components) + args.aws
     )
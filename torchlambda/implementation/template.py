@@ -1,3 +1,4 @@
+import json
 import pathlib
 import sys
 import typing
@@ -52,98 +53,305 @@ def validate(validator, settings: typing.Dict) -> None:
         sys.exit(1)
 
 
+@general.message("reading warm-up payloads.")
+def read_payloads(settings: typing.Dict, args) -> typing.Dict:
+    """
+    Read JSON requests to embed in source for warm-up.
+
+    Paths are relative to directory containing YAML settings.
+    Requests are validated and stored in compact form.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict (after unification)
+    args : dict-like
+        User provided arguments parsed by argparse.ArgumentParser instance.
+
+    Returns
+    -------
+    typing.Dict:
+        Settings with warmup->payloads being contents of files
+    """
+    directory = pathlib.Path(args.yaml).absolute().parent
+    payloads = []
+    for path in settings["warmup"]["payloads"]:
+        with open(directory / path, "r") as file:
+            try:
+                payloads.append(json.dumps(json.load(file), separators=(",", ":")))
+            except json.JSONDecodeError as error:
+                print(
+                    "torchlambda:: Error during warm-up payload {} parsing:".format(
+                        path
+                    ),
+                    file=sys.stderr,
+                )
+                print(error, file=sys.stderr)
+                sys.exit(1)
+    return {**settings, "warmup": {**settings["warmup"], "payloads": payloads}}
+
+
+def _model_source(template: str, settings: typing.Dict) -> str:
+    """
+    Impute code handling inputs and returns of model into `model.cpp` template.
+
+    Parameters
+    ----------
+    template : str
+        Contents of `templates/settings/model.cpp`
+    settings : typing.Dict
+        YAML parsed to dict with `inputs` and `returns` of single model
+
+    Returns
+    -------
+    str:
+        Validation, creation of inputs and response of model as C++ code
+    """
+    return template.format(
+        FIELDS=utils.template.imputation.fields(settings),
+        VALIDATE_INPUTS=utils.template.imputation.validate_inputs(settings),
+        PREPROCESSING=utils.template.imputation.preprocessing(settings),
+        POSTPROCESSING=utils.template.imputation.postprocessing(settings),
+        VALIDATE_BYTES=utils.template.imputation.validate_bytes(settings),
+        CREATE_INPUTS=utils.template.imputation.create_inputs(settings),
+        FORWARD_INPUTS=utils.template.imputation.forward_inputs(settings),
+        CREATE_RETURNS=utils.template.imputation.create_returns(settings),
+    )
+
+
 @general.message("creating .cpp source from YAML template.")
 def create_source(settings: typing.Dict) -> str:
     """
     Create .cpp source code from template and settings
 
-    Values are imputed using `format` to `main.cpp`.
+    Values are imputed using `format` to `main.cpp`, code specific
+    to inputs and returns of model is imputed to `model.cpp` first
+    (once per model if multiple models specified, each in it's own
+    `model_<index>` namespace) and inserted as MODEL_CODE.
     Each field is either a header (#define NAME <value>, <value> optional)
     or is directly imputed into source code.
 
     First case and all needed processing is located in `utils.template.header`,
     second case and all needed processing is located in `utils.template.imputation`
 
+    Afterwards feature switches (header fields) are resolved, so only active
+    code paths (and includes they need) are left in the source,
+    see `utils.template.preprocessor.resolve`.
+
     `template/main.cpp` template file uses double curly brackets ({{}}) where normal
     C++ brackets are used in order to be compatible with `str.format`, see
     this: https://stackoverflow.com/questions/5466451/how-can-i-print-literal-curly-brace-characters-in-python-string-and-also-use-fo
     for some info.
 
+    Settings are expected in unified form (see `utils.template.validator.unify`),
+    where single `input` and `return` are special cases of `inputs` and `returns`.
+
     **DESCRIPTION OF HEADER FIELDS**:
 
         - STATIC - whether all shapes are static (e.g. no
         input dimension is dependent on value passed in request as field).
-        True if `input_shape` only has integers (fixed input shape).
+        True if `shape` of every input only has integers (fixed input shape).
 
-        - VALIDATE_INPUTS - whether fields provided in INPUT_SHAPE should be
-        checked for correctness (they exist and are of integer type).
+        - GRAD - whether PyTorch's gradient should be enabled.
+        Usually not as AWS Lambda is mainly used for inference
+        Default: False
+
+        - OPTIMIZE - whether TorchScript graph executor optimization
+        should be turned on.
+        Default: False
+
+        - VALIDATE_JSON - whether request should be checked for being correct JSON.
         Default: True
 
-        - NO_GRAD - whether PyTorch's gradient should be disabled.
-        Usually yes as AWS Lambda is mainly used for inference
+        - BASE64 - whether any input (or Kinesis record) is base64 encoded
+        (base64 decoder is needed).
+
+        - BATCH - whether `data` field of inputs is an array of samples which should
+        be decoded separately and passed through network as single batch.
+        Output and result are returned per sample.
+        Default: False
+
+        - STREAMING - whether request payload should be scanned directly
+        (top level fields indexed in single pass, numeric arrays parsed straight
+        into tensors) instead of being parsed into JSON DOM.
+        Default: False (parser: dom), always True for events other than direct
+
+        - VALIDATE_SHAPE - whether fields provided in `shape` of inputs should be
+        checked for correctness (they exist and are of integer type).
         Default: True
 
-        - CAST - to which type should the tensor be casted after creation from
-        base64 encoded data (by default it's unsigned char which is rarely useful).
-        Default: float
+        - PREALLOCATE - whether storage of inputs and returned tensors should be
+        allocated once in `main()` and reused by every request.
+        Only decoding, fused preprocessing (see `imputation.fused`) and base64
+        encoded returns use it; division or normalization which cannot be
+        fused, result operations (e.g. `torch::argmax(output, 1)`) and
+        the forward pass itself still allocate their outputs every request.
+        Default: False
+
+        - WARMUP - number of times each embedded payload is run through
+        handler during initialization (if warmup specified).
+
+        - INTRA_OP_THREADS - number of threads used within single operation,
+        either integer or `available_cpus()` if auto (if threads specified).
+
+        - INTER_OP_THREADS - number of threads used to run independent
+        operations in parallel (if threads specified).
+        Default: 1
+
+        - CACHE - maximum number of responses kept in LRU cache of
+        repeated requests (if cache specified).
+        Default: 1024
 
-        - NORMALIZE - whether normalize input using NORMALIZE_MEANS and NORMALIZE_STDDEVS
-        Used mainly for image inference.
+        - CACHE_BYTES - maximum total size of cached responses (if cache specified).
+        Default: 67108864 (64 MiB)
+
+        - CACHE_REPORT - number of lookups after which cache hits and
+        misses are logged, never if 0 (if cache specified).
+        Default: 100
+
+        - INSTRUMENTATION - CloudWatch namespace of per stage latency and
+        initialization breakdown metrics logged in Embedded Metric Format
+        (if instrumentation specified).
+        Default: "torchlambda"
+
+        - INSTRUMENTATION_RESPONSE - whether timings of stages should be
+        added to response.
         Default: False
 
-        - DIVIDER - value by which input tensor will be divided after casting
-        to CAST.
-        Default: 255 (to bring `unsigned char` to `[0,1]` range, useful for image inference)
+        - PROFILING - fraction of invocations which have forward run under
+        libtorch profiler (if profiling specified).
+        Default: 1
+
+        - PROFILING_TRACE - directory where Chrome traces of profiled
+        invocations are written (if output: trace specified).
+        Default: "/tmp"
 
-        - RETURN_OUTPUT - whether to return output as array.
-        Exclusive with RETURN_OUTPUT_ITEM
+        - PROFILING_TOP - number of operators taking most time logged
+        after profiled invocation (if output: table specified).
+        Default: 20
 
-        - RETURN_OUTPUT_ITEM - whether to return output as single item.
-        Exclusive with RETURN_OUTPUT
+        - PREDICTIONS - whether classes with highest scores are returned
+        for any of returns (if predictions specified).
+
+        - APIGATEWAY - whether payload is API Gateway or Function URL
+        proxy event and proxy response should be returned.
+        Default: False (event: direct)
+
+        - APIGATEWAY_BINARY - name of the only (base64, not batched) input
+        receiving binary body of proxy event (if event: apigateway specified).
+
+        - RECORDS - maximum number of SQS or Kinesis records forwarded
+        together (if event: sqs or event: kinesis specified).
+        Default: 64
+
+        - KINESIS - whether records are Kinesis records (base64 encoded data)
+        instead of SQS messages.
+
+        - REQUEST_COMPRESSION - whether data of base64 inputs is compressed
+        (gzip, zlib or zstd detected per sample) and decompressed straight
+        into tensors.
+        Default: False
+
+        - RESPONSE_COMPRESSION - encoding (gzip, deflate or zstd) of compressed
+        and base64 encoded response (if response of compression specified).
+
+        - ZSTD - whether zstd codec is available (image built with --zstd).
+        Default: False
 
-        - RETURN_RESULT - whether to return result as array.
-        Exclusive with RETURN_RESULT_ITEM
+        - IMAGE - whether any input is base64 encoded JPEG or PNG image
+        decoded, resized and center-cropped in handler.
 
-        - RETURN_RESULT_ITEM - whether to return output as single item.
-        Exclusive with RETURN_RESULT
+        - FORMAT - encoding of request (msgpack, cbor or npy) if other
+        than JSON, base64 inputs are carried as raw bytes.
+
+        - MSGPACK - whether request is MessagePack map.
+        Default: False
+
+        - CBOR - whether request is CBOR map.
+        Default: False
+
+        - NPY - name of the only input if request is NPY array.
+
+        - MODELS - field of request naming model serving it if multiple
+        models specified.
+
+        - MODELS_BYTES - Size of parameters and buffers of models kept loaded,
+        least recently used ones are evicted above it.
+        Default: 1073741824 (1 GiB)
+
+        - CASCADE - number of cheaper models forwarded (in order) before
+        the model, the first confident enough answers request.
+
+        - CASCADE_FIELD - response field with index of stage which answered
+        (if cascade specified).
+        Default: "stage"
+
+        - SESSION - maximal number of sessions whose state returned
+        by the model is forwarded with their next request.
+
+        - SESSION_FIELD - request field identifying session (if session specified).
+        Default: "session"
+
+        - SESSION_TTL - seconds since last request of session after which
+        it's state is dropped (if session specified).
+        Default: 300
 
     **DESCRIPTION OF DIRECTLY IMPUTED FIELDS**:
 
-        - DATA - Name of field providing data in request
+        - MODEL_CODE - `model.cpp` with fields below up to CREATE_RETURNS
+        imputed (for each model if multiple models specified)
+
+        - FIELDS - Names (if any) of provided non-static fields to validate
 
-        - FIELDS - Names (if any) of provided non-static fields
+        - CACHE_FIELDS - Names of fields (data of inputs and shape fields)
+        hashed into key of cached response (if cache specified)
 
-        - NORMALIZE_MEANS - Means to use for normalization (if any)
+        - VALIDATE_INPUTS - Code validating data field of each input (if validate
+        specified for it)
 
-        - NORMALIZE_STDDEVS - Standard deviations to use for normalization (if any)
+        - PREPROCESSING - Transformations (created once) folding cast, division
+        and normalization of inputs into single pass with per channel scale and shift
 
-        - INPUTS - Input shapes used for reshape of tensor (including batch dimension)
+        - POSTPROCESSING - Labels of classes read once from files (if labels
+        of predictions specified)
 
-        - IF RETURN_RESULT OR RETURN_RESULT_ITEM DEFINED:
+        - VALIDATE_BYTES - Code checking decoded length of each base64 input
+        (if validate specified for it) against it's shape and dtype
 
-            - OPERATIONS_AND_ARGUMENTS - Operations with arguments (if any) to apply over
-            outputted tensor to create result.
-            Mix of "operations" and "arguments" fields
+        - CREATE_INPUTS - Code creating tensor for each input (decoding
+        of data or image or decompressing, reshaping, casting, division and normalization)
 
-        - IF RETURN_OUTPUT OR RETURN_OUTPUT_ITEM DEFINED:
+        - FORWARD_INPUTS - Tensors passed to network in order of inputs
 
-            - AWS_OUTPUT_FUNCTION - Internal AWS SDK JsonValue function like WithInteger.
-            Based on RETURN_OUTPUT_TYPE
+        - CREATE_RETURNS - Code obtaining output (whole returned tensor
+        or it's tuple/dict element), result (via operations and arguments)
+        and predictions (top classes) for each return and adding them to JSON
+        response (as arrays or single items)
 
-        - IF RETURN_RESULT OR RETURN_RESULT_ITEM DEFINED:
+        - ALLOCATE_BUFFERS - Initializer of storage reused by every request
+        (if preallocate specified)
 
-            - AWS_RESULT_FUNCTION - Internal AWS SDK JsonValue function like WithInteger.
-            Based on RETURN_RESULT_TYPE
+        - WARMUP_PAYLOADS - Requests (from files or synthetic) embedded
+        as raw string literals (if warmup specified)
 
-        - IF RETURN_OUTPUT OR RETURN_OUTPUT_ITEM DEFINED:
+        - NPY_DESCR - NumPy type string of accepted arrays (if format: npy)
 
-            - OUTPUT_NAME - Key of returned JSON
-            - OUTPUT_TYPE - Type  of item of returned JSON
+        - NPY_DIMENSIONS - Names of dimensions of NPY input, empty for static
+        ones (if format: npy)
 
-        - IF RETURN_RESULT OR RETURN_RESULT_ITEM DEFINED:
+        - MODEL_PATH - Path to TorchScript compiled model
 
-            - RESULT_NAME - Key of returned JSON
-            - RESULT_TYPE - Type  of item of returned JSON
+        - ROUTES - Name, path and functions (namespace) of each model
+        (if multiple models specified)
+
+        - CASCADE_STAGES - Path, confidence criterion and threshold of each
+        stage (if cascade specified)
+
+        - CASCADE_LOGITS - Returned tensor (or it's tuple/dict element) whose
+        softmax judges confidence of stage (if cascade specified)
+
+        - SESSION_STATE - Element of returned tuple kept as state of session
+        (if session specified)
 
     Parameters
     ----------
@@ -155,72 +363,89 @@ def create_source(settings: typing.Dict) -> str:
     str:
         Source represented as string
     """
+    header = dict(
+        STATIC=utils.template.header.static(settings),
+        GRAD=utils.template.header.grad(settings),
+        OPTIMIZE=utils.template.header.optimize(settings),
+        VALIDATE_JSON=utils.template.header.validate_json(settings),
+        BASE64=utils.template.header.base64(settings),
+        BATCH=utils.template.header.batch(settings),
+        STREAMING=utils.template.header.streaming(settings),
+        VALIDATE_SHAPE=utils.template.header.validate_shape(settings),
+        PREALLOCATE=utils.template.header.preallocate(settings),
+        WARMUP=utils.template.header.warmup(settings),
+        INTRA_OP_THREADS=utils.template.header.intra_op_threads(settings),
+        INTER_OP_THREADS=utils.template.header.inter_op_threads(settings),
+        CACHE=utils.template.header.cache(settings),
+        CACHE_BYTES=utils.template.header.cache_bytes(settings),
+        CACHE_REPORT=utils.template.header.cache_report(settings),
+        INSTRUMENTATION=utils.template.header.instrumentation(settings),
+        INSTRUMENTATION_RESPONSE=utils.template.header.instrumentation_response(
+            settings
+        ),
+        PROFILING=utils.template.header.profiling(settings),
+        PROFILING_TRACE=utils.template.header.profiling_trace(settings),
+        PROFILING_TOP=utils.template.header.profiling_top(settings),
+        PREDICTIONS=utils.template.header.predictions(settings),
+        APIGATEWAY=utils.template.header.apigateway(settings),
+        APIGATEWAY_BINARY=utils.template.header.apigateway_binary(settings),
+        RECORDS=utils.template.header.records(settings),
+        KINESIS=utils.template.header.kinesis(settings),
+        REQUEST_COMPRESSION=utils.template.header.request_compression(settings),
+        RESPONSE_COMPRESSION=utils.template.header.response_compression(settings),
+        ZSTD=utils.template.header.zstd(settings),
+        IMAGE=utils.template.header.image(settings),
+        FORMAT=utils.template.header.format(settings),
+        MSGPACK=utils.template.header.msgpack(settings),
+        CBOR=utils.template.header.cbor(settings),
+        NPY=utils.template.header.npy(settings),
+        MODELS=utils.template.header.models(settings),
+        MODELS_BYTES=utils.template.header.models_bytes(settings),
+        CASCADE=utils.template.header.cascade(settings),
+        CASCADE_FIELD=utils.template.header.cascade_field(settings),
+        SESSION=utils.template.header.session(settings),
+        SESSION_FIELD=utils.template.header.session_field(settings),
+        SESSION_TTL=utils.template.header.session_ttl(settings),
+    )
     cwd = pathlib.Path(__file__).absolute().parent.parent
+    with open(cwd / "templates/settings/model.cpp") as file:
+        template = file.read()
+    if settings["models"] is None:
+        model_code = _model_source(template, settings)
+    else:
+        model_code = "\n".join(
+            "namespace model_{index} {{\n{code}}} // namespace model_{index}\n".format(
+                index=index,
+                code=_model_source(
+                    template,
+                    {
+                        **settings,
+                        "inputs": model["inputs"],
+                        "returns": model["returns"],
+                    },
+                ),
+            )
+            for index, model in enumerate(settings["models"])
+        )
     with open(cwd / "templates/settings/main.cpp") as file:
-        return file.read().format(
+        source = file.read().format(
             # Top level defines
-            STATIC=utils.template.header.static(settings),
-            GRAD=utils.template.header.grad(settings),
-            OPTIMIZE=utils.template.header.optimize(settings),
-            VALIDATE_JSON=utils.template.header.validate_json(settings),
-            BASE64=utils.template.header.base64(settings),
-            VALIDATE_FIELD=utils.template.header.validate_field(settings),
-            VALIDATE_SHAPE=utils.template.header.validate_shape(settings),
-            NORMALIZE=utils.template.header.normalize(settings),
-            CAST=utils.template.header.cast(settings),
-            DIVIDE=utils.template.header.divide(settings),
-            RETURN_OUTPUT=utils.template.header.return_output(settings),
-            RETURN_OUTPUT_ITEM=utils.template.header.return_output_item(settings),
-            RETURN_RESULT=utils.template.header.return_result(settings),
-            RETURN_RESULT_ITEM=utils.template.header.return_result_item(settings),
+            **header,
             # Direct insertions
-            DATA=utils.template.imputation.data(settings),
-            FIELDS=utils.template.imputation.fields(settings),
-            DATA_TYPE=utils.template.imputation.data_type(settings),
-            DATA_FUNC=utils.template.imputation.data_func(settings),
-            NORMALIZE_MEANS=utils.template.imputation.normalize(settings, key="means"),
-            NORMALIZE_STDDEVS=utils.template.imputation.normalize(
-                settings, key="stddevs"
-            ),
-            TORCH_DATA_TYPE=utils.template.imputation.torch_data_type(settings),
-            INPUTS=utils.template.imputation.inputs(settings),
-            OUTPUT_CAST=utils.template.imputation.aws_to_torch(settings, "output"),
-            RESULT_CAST=utils.template.imputation.aws_to_torch(settings, "result"),
-            OPERATIONS_AND_ARGUMENTS=utils.template.imputation.operations_and_arguments(
-                settings
-            ),
-            AWS_OUTPUT_FUNCTION=utils.template.imputation.aws_function(
-                settings, key="output", array=True,
-            ),
-            AWS_RESULT_FUNCTION=utils.template.imputation.aws_function(
-                settings, key="result", array=True,
-            ),
-            AWS_OUTPUT_ITEM_FUNCTION=utils.template.imputation.aws_function(
-                settings, key="output", array=False
-            ),
-            AWS_RESULT_ITEM_FUNCTION=utils.template.imputation.aws_function(
-                settings, key="result", array=False
-            ),
-            TORCH_OUTPUT_TYPE=utils.template.imputation.torch_approximation(
-                settings, key="output"
-            ),
-            OUTPUT_TYPE=utils.template.imputation.field_if_exists(
-                settings, key="output", name="type"
-            ),
-            TORCH_RESULT_TYPE=utils.template.imputation.torch_approximation(
-                settings, key="result"
-            ),
-            RESULT_TYPE=utils.template.imputation.field_if_exists(
-                settings, key="result", name="type"
-            ),
-            OUTPUT_NAME=utils.template.imputation.field_if_exists(
-                settings, key="output", name="name"
-            ),
-            RESULT_NAME=utils.template.imputation.field_if_exists(
-                settings, key="result", name="name"
-            ),
+            MODEL_CODE=model_code,
+            CACHE_FIELDS=utils.template.imputation.cache_fields(settings),
+            ALLOCATE_BUFFERS=utils.template.imputation.allocate_buffers(settings),
+            WARMUP_PAYLOADS=utils.template.imputation.warmup_payloads(settings),
+            NPY_DESCR=utils.template.imputation.npy_descr(settings),
+            NPY_DIMENSIONS=utils.template.imputation.npy_dimensions(settings),
             MODEL_PATH=utils.template.imputation.model(settings),
+            ROUTES=utils.template.imputation.routes(settings),
+            CASCADE_STAGES=utils.template.imputation.cascade_stages(settings),
+            CASCADE_LOGITS=utils.template.imputation.cascade_logits(settings),
+            SESSION_STATE=utils.template.imputation.session_state(settings),
         )
+    # Only code paths enabled by settings are left
+    return utils.template.preprocessor.resolve(source, header.keys())
 
 
 def save(source: str, args) -> None:
@@ -259,7 +484,9 @@ def create_template(args) -> None:
     settings = read_settings(args)
     validator = utils.template.validator.get()
     validate(validator, settings)
-    settings = validator.normalized(settings)
+    settings = utils.template.validator.unify(validator.normalized(settings))
+    if settings["warmup"] is not None and settings["warmup"]["payloads"]:
+        settings = read_payloads(settings, args)
 
     source = create_source(settings)
     save(source, args)
@@ -1 +1 @@
-from . import header, imputation, macro, validator
+from . import header, imputation, macro, preprocessor, validator
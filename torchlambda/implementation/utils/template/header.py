@@ -3,7 +3,7 @@ from . import macro
 
 def static(settings) -> str:
     """
-    Return #define STATIC if all inputs fields are integer.
+    Return #define STATIC if all fields of all inputs' shapes are integer.
 
     If specified, no field checks will be performed during request to
     Lambda function.
@@ -19,7 +19,12 @@ def static(settings) -> str:
         Either "" or "#define STATIC"
     """
     return macro.conditional(
-        all(isinstance(x, int) for x in settings["input"]["shape"]), "STATIC"
+        all(
+            isinstance(x, int)
+            for element in settings["inputs"]
+            for x in element["shape"]
+        ),
+        "STATIC",
     )
 
 
@@ -83,14 +88,20 @@ def validate_json(settings) -> str:
 
 def base64(settings) -> str:
     """
-    Return #define BASE64 if input->type is equal to base64.
+    Return #define BASE64 if any input is base64 or image, event: kinesis or binary format.
 
-    If specified, it is assumed data is in base64 string format and will be decoded
-    in handler. In this case input_type IS NOT USED and data type will be
-    unsigned int 8 upon creation (which can be optionally casted).
+    If specified, base64 strings are decoded with static lookup table of
+    characters (base64 and base64url), straight from the request payload
+    into storage of the tensor (escapes are skipped, no intermediate copy).
+    Data of each input with base64 type is assumed to be base64 string which
+    will be decoded into tensor of input->dtype (little-endian elements,
+    unsigned int 8 if not specified, can be optionally casted).
 
-    If not, it is assumed data will be a flat array of specified by user via
-    input_type.
+    Data of other inputs is assumed to be a flat array of type specified by user via
+    input->type.
+
+    Encoded images (see `image`), requests carried by Kinesis records
+    and binary requests (see `format`) in proxy bodies are base64 encoded as well.
 
     Parameters
     ----------
@@ -102,17 +113,28 @@ def base64(settings) -> str:
     str:
         Either "" or "#define BASE64"
     """
-    return macro.conditional(settings["input"]["type"] == "base64", "BASE64")
+    return macro.conditional(
+        any(element["type"] in ("base64", "image") for element in settings["inputs"])
+        or settings["event"] == "kinesis"
+        or settings["format"] != "json",
+        "BASE64",
+    )
 
 
-def validate_field(settings) -> str:
+def batch(settings) -> str:
     """
-    Return #define VALIDATE_FIELD if validate: True specified.
+    Return #define BATCH if input->batch: True specified.
 
-    If specified, data will be checked for correctness
-    (whether `data` field exists and whether it's type is string or array).
+    Validator ensures either all or none of inputs are batched.
 
-    If not, InvalidJson with appropriate text will be returned.
+    If specified, `data` field of each input is expected to be an array of samples
+    (each being base64 string or flat array depending on input->type).
+    Every sample is decoded and reshaped to input->shape separately,
+    after which all of them are concatenated along the batch dimension
+    and passed through network in single forward.
+
+    Output and result are returned per sample (nested arrays or
+    flat array of items if `item: True`).
 
     Parameters
     ----------
@@ -122,16 +144,49 @@ def validate_field(settings) -> str:
     Returns
     -------
     str:
-        Either "" or "#define VALIDATE_FIELD"
+        Either "" or "#define BATCH"
+    """
+    return macro.conditional(
+        any(element["batch"] for element in settings["inputs"]), "BATCH"
+    )
+
+
+def streaming(settings) -> str:
     """
-    return macro.conditional(settings["input"]["validate"], "VALIDATE_FIELD")
+    Return #define STREAMING if parser: streaming or event other than direct specified.
+
+    If specified, request payload is not parsed into JSON DOM.
+    Instead top level fields are indexed in single pass over payload
+    and values are parsed only when needed. Numeric arrays are parsed
+    straight into preallocated tensors (no intermediate JSON nodes
+    or vectors are created), which lowers latency and peak memory
+    for large array payloads.
+
+    Events are always parsed this way, so binary body of proxy event is
+    decoded straight from the event (see `apigateway_binary`) and records
+    (see `records`) are indexed only when handled.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define STREAMING"
+    """
+    return macro.conditional(
+        settings["parser"] == "streaming" or settings["event"] != "direct",
+        "STREAMING",
+    )
 
 
 def validate_shape(settings) -> str:
     """
-    Return #define VALIDATE_SHAPE if validate_inputs: True specified.
+    Return #define VALIDATE_SHAPE if validate_shape: True specified for any input.
 
-    If specified, input fields will be checked (if any exist).
+    If specified, shape fields of those inputs will be checked (if any exist).
     All of them will be checked for existence and whether their type
     is integer.
 
@@ -147,15 +202,419 @@ def validate_shape(settings) -> str:
     str:
         Either "" or "#define VALIDATE_SHAPE"
     """
-    return macro.conditional(settings["input"]["validate_shape"], "VALIDATE_SHAPE")
+    return macro.conditional(
+        any(element["validate_shape"] for element in settings["inputs"]),
+        "VALIDATE_SHAPE",
+    )
+
+
+def preallocate(settings) -> str:
+    """
+    Return #define PREALLOCATE if preallocate: True specified.
+
+    Validator ensures all inputs have static shapes and are not batched.
+
+    If specified, storage for decoded and converted inputs is allocated
+    once in `main()` and reused by every request (data is decoded straight
+    into it), while returned tensors encoded in base64 are converted into
+    storage reallocated only if their shape changes.
+    Other operations (not fused division and normalization of inputs,
+    result operations and forward pass) allocate their outputs as usual.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define PREALLOCATE"
+    """
+    return macro.conditional(settings["preallocate"], "PREALLOCATE")
+
+
+def warmup(settings) -> str:
+    """
+    Return #define WARMUP iterations if warmup specified.
+
+    If specified, each of embedded payloads (see `imputation.warmup_payloads`)
+    will be run `iterations` times through the whole handler (decoding,
+    preprocessing, forward and serialization) during initialization,
+    before first request is received. Time taken is logged.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define WARMUP iterations"
+    """
+    return macro.conditional(
+        settings["warmup"] is not None,
+        "WARMUP",
+        (settings["warmup"] or {}).get("iterations"),
+    )
+
+
+def _threads(settings, key: str) -> str:
+    threads = (settings["threads"] or {}).get(key)
+    return "available_cpus()" if threads == "auto" else threads
+
+
+def intra_op_threads(settings) -> str:
+    """
+    Return #define INTRA_OP_THREADS value if threads specified.
+
+    Number of threads used within single operation (e.g. matrix
+    multiplication or convolution) by libtorch's parallel backend
+    (see `--parallel` of `torchlambda build`).
+
+    If `auto`, number of available vCPUs is used, based on cgroup CPU
+    quota or (if unavailable) `AWS_LAMBDA_FUNCTION_MEMORY_SIZE`
+    (AWS Lambda allocates one vCPU per each 1769 MB of memory).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define INTRA_OP_THREADS value"
+    """
+    return macro.conditional(
+        settings["threads"] is not None,
+        "INTRA_OP_THREADS",
+        _threads(settings, "intra_op"),
+    )
+
+
+def inter_op_threads(settings) -> str:
+    """
+    Return #define INTER_OP_THREADS value if threads specified.
+
+    Number of threads used to run independent operations of TorchScript
+    graph (e.g. `torch.jit.fork`) in parallel.
+    `auto` has the same meaning as for `intra_op_threads`.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define INTER_OP_THREADS value"
+    """
+    return macro.conditional(
+        settings["threads"] is not None,
+        "INTER_OP_THREADS",
+        _threads(settings, "inter_op"),
+    )
+
+
+def cache(settings) -> str:
+    """
+    Return #define CACHE entries if cache specified.
+
+    If specified, serialized responses are kept in LRU cache (bounded by
+    `entries` and `bytes` of keys and responses) of warm Lambda process,
+    keyed by unparsed `data` of inputs and shape fields
+    (see `imputation.cache_fields`), compared whole on lookup.
+    Repeated request skips decoding, inference and serialization.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CACHE entries"
+    """
+    return macro.conditional(
+        settings["cache"] is not None,
+        "CACHE",
+        (settings["cache"] or {}).get("entries"),
+    )
+
+
+def cache_bytes(settings) -> str:
+    """
+    Return #define CACHE_BYTES bytes if cache specified.
+
+    Maximum total size of cached responses, least recently used
+    are evicted first.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CACHE_BYTES bytes"
+    """
+    return macro.conditional(
+        settings["cache"] is not None,
+        "CACHE_BYTES",
+        (settings["cache"] or {}).get("bytes"),
+    )
+
+
+def cache_report(settings) -> str:
+    """
+    Return #define CACHE_REPORT lookups if cache specified.
+
+    Number of cache hits and misses is logged every `report` lookups
+    (never if 0).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CACHE_REPORT lookups"
+    """
+    return macro.conditional(
+        settings["cache"] is not None,
+        "CACHE_REPORT",
+        (settings["cache"] or {}).get("report"),
+    )
+
+
+def instrumentation(settings) -> str:
+    """
+    Return #define INSTRUMENTATION "namespace" if instrumentation specified.
+
+    If specified, each stage of the handler (parsing with validation,
+    decoding, preprocessing, forward and serialization) is timed by
+    monotonic clock and single CloudWatch Embedded Metric Format line
+    (metrics in `namespace`, dimension `FunctionName`) is logged per invocation.
+
+    Duration of each initialization step in `main()` (time before `main()`,
+    AWS SDK initialization, model loading etc.) is logged once the same way
+    (metrics prefixed with `init_`). If Lambda Runtime API is not available
+    (e.g. binary run locally), breakdown is printed instead and
+    no requests are handled.
+
+    If not, timing marks are compiled out and hot path has no overhead.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define INSTRUMENTATION "namespace""
+    """
+    return macro.conditional(
+        settings["instrumentation"] is not None,
+        "INSTRUMENTATION",
+        '"{}"'.format((settings["instrumentation"] or {}).get("namespace")),
+    )
+
+
+def instrumentation_response(settings) -> str:
+    """
+    Return #define INSTRUMENTATION_RESPONSE if timings should be returned.
+
+    If specified, `timings` object (milliseconds of each stage) is added
+    to the response (cannot be used with cache, see `validator`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define INSTRUMENTATION_RESPONSE"
+    """
+    return macro.conditional(
+        (settings["instrumentation"] or {}).get("response", False),
+        "INSTRUMENTATION_RESPONSE",
+    )
+
+
+def profiling(settings) -> str:
+    """
+    Return #define PROFILING sample if profiling specified.
+
+    If specified, forward of `sample` fraction of invocations (chosen randomly)
+    is run under libtorch's profiler (`RecordProfile`) and either
+    Chrome trace is written (see `profiling_trace`) or time taken by
+    operators is logged (see `profiling_top`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define PROFILING sample"
+    """
+    return macro.conditional(
+        settings["profiling"] is not None,
+        "PROFILING",
+        (settings["profiling"] or {}).get("sample"),
+    )
+
+
+def profiling_trace(settings) -> str:
+    """
+    Return #define PROFILING_TRACE "directory" if output: trace specified.
+
+    Chrome trace JSON (viewable in chrome://tracing) of each profiled
+    invocation is written to `directory` (`/tmp` by default, the only writable
+    location on AWS Lambda) and it's path is logged.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define PROFILING_TRACE "directory""
+    """
+    profiling = settings["profiling"] or {}
+    return macro.conditional(
+        profiling.get("output") == "trace",
+        "PROFILING_TRACE",
+        '"{}"'.format(profiling.get("directory")),
+    )
+
+
+def profiling_top(settings) -> str:
+    """
+    Return #define PROFILING_TOP top if output: table specified.
+
+    Table of `top` operators taking most time (inclusive of nested operators)
+    with number of calls and share of total time is logged
+    after each profiled invocation.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define PROFILING_TOP top"
+    """
+    profiling = settings["profiling"] or {}
+    return macro.conditional(
+        profiling.get("output") == "table", "PROFILING_TOP", profiling.get("top")
+    )
+
+
+def predictions(settings) -> str:
+    """
+    Return #define PREDICTIONS if predictions of any return specified.
+
+    If specified, classes with highest scores (see `imputation.create_returns`)
+    are serialized as objects of index, label (if labels file specified)
+    and score and labels files are read once during initialization
+    (see `imputation.postprocessing`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define PREDICTIONS"
+    """
+    return macro.conditional(
+        any(element["predictions"] is not None for element in settings["returns"]),
+        "PREDICTIONS",
+    )
+
+
+def apigateway(settings) -> str:
+    """
+    Return #define APIGATEWAY if event: apigateway specified.
+
+    If specified, payload is API Gateway (REST or HTTP API) or Function URL
+    proxy event. It's `body` is the request (JSON text) or binary data
+    (see `apigateway_binary`). Response (or error with status 400)
+    is returned as proxy response with JSON body.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define APIGATEWAY"
+    """
+    return macro.conditional(settings["event"] == "apigateway", "APIGATEWAY")
+
+
+def apigateway_binary(settings) -> str:
+    """
+    Return #define APIGATEWAY_BINARY "name" if binary body can be passed.
+
+    Applicable if event: apigateway and format: json specified and the only
+    input is not batched base64 (or image) input named `name`.
+    If `isBase64Encoded` is true, body of event (raw bytes of input
+    encoded by API Gateway) is decoded straight into the input, shape fields
+    are taken from query string parameters or headers.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define APIGATEWAY_BINARY "name""
+    """
+    inputs = settings["inputs"]
+    return macro.conditional(
+        settings["event"] == "apigateway"
+        and settings["format"] == "json"
+        and len(inputs) == 1
+        and inputs[0]["type"] in ("base64", "image")
+        and not inputs[0]["batch"],
+        "APIGATEWAY_BINARY",
+        '"{}"'.format(inputs[0]["name"]),
+    )
 
 
-def normalize(settings) -> str:
+def records(settings) -> str:
     """
-    Return #define NORMALIZE if normalize: True specified.
+    Return #define RECORDS records_batch if event: sqs or event: kinesis specified.
 
-    Will normalize image-like tensor across channels using
-    torch::data::transforms::Normalize<>.
+    If specified, payload is SQS or Kinesis event and request of each
+    of it's `Records` is handled separately. Consecutive records with equal
+    input shapes are forwarded together, at most `records_batch` at once.
+    Response contains `batchItemFailures` (records with invalid requests)
+    and `results` of each record.
 
     Parameters
     ----------
@@ -165,16 +624,22 @@ def normalize(settings) -> str:
     Returns
     -------
     str:
-        Either "" or "#define NORMALIZE"
+        Either "" or "#define RECORDS records_batch"
     """
-    return macro.conditional(settings["normalize"], "NORMALIZE")
+    return macro.conditional(
+        settings["event"] in ("sqs", "kinesis"),
+        "RECORDS",
+        settings["records_batch"],
+    )
 
 
-def cast(settings) -> str:
+def kinesis(settings) -> str:
     """
-    Impute libtorch specific type from user provided "human-readable" form.
+    Return #define KINESIS if event: kinesis specified.
 
-    See `type_mapping` in source code for exact mapping.
+    If specified, request of each record is base64 encoded `kinesis->data`
+    and records are identified by `kinesis->sequenceNumber`
+    (instead of SQS message `body` and `messageId`).
 
     Parameters
     ----------
@@ -184,28 +649,43 @@ def cast(settings) -> str:
     Returns
     -------
     str:
-        String specifying type, e.g. "torch::kFloat16"
+        Either "" or "#define KINESIS"
+    """
+    return macro.conditional(settings["event"] == "kinesis", "KINESIS")
+
+
+def request_compression(settings) -> str:
     """
-    type_mapping = {
-        "byte": "torch::kUInt8",
-        "char": "torch::kInt8",
-        "short": "torch::kInt16",
-        "int": "torch::kInt32",
-        "long": "torch::kInt64",
-        "half": "torch::kFloat16",
-        "float": "torch::kFloat32",
-        "double": "torch::kFloat64",
-    }
+    Return #define REQUEST_COMPRESSION if request of compression specified.
 
-    return macro.key(settings["input"], key="cast", mapping=type_mapping,)
+    If specified, `data` of base64 inputs (each sample for batched inputs)
+    is compressed little-endian bytes. Codec is detected from it's header
+    (gzip or zlib, zstd if enabled, see `zstd`) and data is decompressed
+    straight into storage of input tensor.
 
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
 
-def divide(settings) -> str:
+    Returns
+    -------
+    str:
+        Either "" or "#define REQUEST_COMPRESSION"
+    """
+    return macro.conditional(
+        (settings["compression"] or {}).get("request", False), "REQUEST_COMPRESSION"
+    )
+
+
+def response_compression(settings) -> str:
     """
-    Impute value by which casted tensor will be divided.
+    Return #define RESPONSE_COMPRESSION "encoding" if response of compression specified.
 
-    If user doesn't want to cast tensor, he should simply specify `1`,
-    though it won't be used too often.
+    If specified, serialized response is compressed with `encoding`
+    (gzip, deflate or zstd) and encoded in base64. Proxy responses
+    (event: apigateway) carry it as binary body with `Content-Encoding` header,
+    otherwise it is returned as `data` of JSON object with `encoding`.
 
     Parameters
     ----------
@@ -215,18 +695,67 @@ def divide(settings) -> str:
     Returns
     -------
     str:
-        string representation of number, e.g. "255.0"
+        Either "" or "#define RESPONSE_COMPRESSION "encoding""
+    """
+    response = (settings["compression"] or {}).get("response")
+    return macro.conditional(
+        response is not None, "RESPONSE_COMPRESSION", '"{}"'.format(response)
+    )
 
+
+def zstd(settings) -> str:
     """
-    return macro.key(settings["input"], key="divide")
+    Return #define ZSTD if zstd of compression specified.
 
+    If specified, zstd compressed requests are decompressed (next to gzip
+    and zlib ones) and zstd can be used for responses. Requires image
+    built with zstd (see `torchlambda build --zstd`).
 
-def return_output(settings):
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define ZSTD"
+    """
+    return macro.conditional((settings["compression"] or {}).get("zstd", False), "ZSTD")
+
+
+def image(settings) -> str:
+    """
+    Return #define IMAGE if type of any input is image.
+
+    If specified, `data` of image inputs is base64 encoded JPEG or PNG file
+    decoded in handler (by statically compiled `stb_image`), resized
+    and center-cropped to input->shape in single pass (see `imputation.create_inputs`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define IMAGE"
     """
-    Return #define RETURN_OUTPUT if field return->output is specified.
+    return macro.conditional(
+        any(element["type"] == "image" for element in settings["inputs"]), "IMAGE"
+    )
+
 
-    Will return output from neural network as JSON array of specified
-    OUTPUT_TYPE if macro defined.
+def format(settings) -> str:
+    """
+    Return #define FORMAT "format" if format other than json specified.
+
+    If specified, request is MessagePack map, CBOR map or NPY array
+    (see `msgpack`, `cbor` and `npy`) instead of JSON object. It is carried
+    as binary body of proxy event (event: apigateway) or data of Kinesis record.
+    Base64 inputs are raw bytes (binary strings) used in place, aligned
+    samples are wrapped as tensors without copying.
 
     Parameters
     ----------
@@ -236,20 +765,186 @@ def return_output(settings):
     Returns
     -------
     str:
-        Either "" or "#define RETURN_OUTPUT"
+        Either "" or "#define FORMAT "format""
     """
     return macro.conditional(
-        settings["return"]["output"] and not settings["return"]["output"]["item"],
-        "RETURN_OUTPUT",
+        settings["format"] != "json", "FORMAT", '"{}"'.format(settings["format"])
     )
 
 
-def return_output_item(settings):
+def msgpack(settings) -> str:
+    """
+    Return #define MSGPACK if format: msgpack specified.
+
+    If specified, request is MessagePack map with the same fields as JSON one.
+    Data of base64 inputs is `bin` (or `str`), arrays are decoded
+    element by element straight into tensors.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define MSGPACK"
+    """
+    return macro.conditional(settings["format"] == "msgpack", "MSGPACK")
+
+
+def cbor(settings) -> str:
+    """
+    Return #define CBOR if format: cbor specified.
+
+    If specified, request is CBOR map with the same fields as JSON one.
+    Data of base64 inputs is byte (or text) string, arrays are decoded
+    element by element straight into tensors. Tags are ignored, indefinite
+    length items are not supported.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CBOR"
+    """
+    return macro.conditional(settings["format"] == "cbor", "CBOR")
+
+
+def npy(settings) -> str:
+    """
+    Return #define NPY "name" if format: npy specified.
+
+    If specified, request is NPY file (as saved by `numpy.save`)
+    containing data of the only input named `name`. Named dimensions
+    of it's shape are taken from shape of the array.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define NPY "name""
+    """
+    return macro.conditional(
+        settings["format"] == "npy",
+        "NPY",
+        '"{}"'.format(settings["inputs"][0]["name"]),
+    )
+
+
+def models(settings) -> str:
+    """
+    Return #define MODELS "field" if multiple models specified.
+
+    If specified, request names model serving it in `field`.
+    Each model has code generated for it's own inputs and returns,
+    modules are loaded lazily on first request routed to them.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define MODELS "field""
+    """
+    return macro.conditional(
+        settings["models"] is not None,
+        "MODELS",
+        '"{}"'.format(settings["routing"]["field"]),
+    )
+
+
+def models_bytes(settings) -> str:
+    """
+    Return #define MODELS_BYTES value if multiple models specified.
+
+    Least recently used models are evicted once parameters and buffers
+    of resident ones would exceed this many bytes.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define MODELS_BYTES value"
+    """
+    return macro.conditional(
+        settings["models"] is not None,
+        "MODELS_BYTES",
+        settings["routing"]["bytes"],
+    )
+
+
+def cascade(settings) -> str:
+    """
+    Return #define CASCADE stages if cascade specified.
+
+    If specified, request is forwarded through `stages` cheaper models
+    first (loaded during initialization), the first one confident enough
+    (see `imputation.cascade_stages`) answers it and the model
+    is forwarded only if none of them was.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CASCADE stages"
+    """
+    return macro.conditional(
+        settings["cascade"] is not None,
+        "CASCADE",
+        len((settings["cascade"] or {}).get("stages", [])),
+    )
+
+
+def cascade_field(settings) -> str:
+    """
+    Return #define CASCADE_FIELD "field" if cascade reports answering stage.
+
+    Index of stage which answered request (number of stages if the model
+    did) is added to response as `field`.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or "#define CASCADE_FIELD "field""
+    """
+    field = (settings["cascade"] or {}).get("field")
+    return macro.conditional(field is not None, "CASCADE_FIELD", '"{}"'.format(field))
+
+
+def session(settings) -> str:
     """
-    Return #define RETURN_OUTPUT if field return->output->item is specified.
+    Return #define SESSION entries if session specified.
 
-    Will return output from neural network as single element of specified
-    OUTPUT_TYPE if macro defined.
+    If specified, state returned by the model (see `imputation.session_state`)
+    is kept per session (up to `entries` of them) in warm Lambda process
+    and passed as last argument of forward with next request of the session
+    (None if there is no state yet), so recurrent models are fed only
+    new chunks of input.
 
     Parameters
     ----------
@@ -259,20 +954,20 @@ def return_output_item(settings):
     Returns
     -------
     str:
-        Either "" or "#define RETURN_OUTPUT_ITEM"
+        Either "" or "#define SESSION entries"
     """
     return macro.conditional(
-        settings["return"]["output"] and settings["return"]["output"]["item"],
-        "RETURN_OUTPUT_ITEM",
+        settings["session"] is not None,
+        "SESSION",
+        (settings["session"] or {}).get("entries"),
     )
 
 
-def return_result(settings):
+def session_field(settings) -> str:
     """
-    Return #define RETURN_RESULT if field return->result is specified.
+    Return #define SESSION_FIELD "field" if session specified.
 
-    Will return modified by RESULT_OPERATION output from neural network
-    as JSON array of specified RESULT_TYPE if macro defined.
+    Request field (string) identifying session.
 
     Parameters
     ----------
@@ -282,20 +977,20 @@ def return_result(settings):
     Returns
     -------
     str:
-        Either "" or "#define RETURN_RESULT"
+        Either "" or "#define SESSION_FIELD "field""
     """
     return macro.conditional(
-        settings["return"]["result"] and not settings["return"]["result"]["item"],
-        "RETURN_RESULT",
+        settings["session"] is not None,
+        "SESSION_FIELD",
+        '"{}"'.format((settings["session"] or {}).get("field")),
     )
 
 
-def return_result_item(settings):
+def session_ttl(settings) -> str:
     """
-    Return #define RETURN_RESULT_ITEM if field return->result->item is specified.
+    Return #define SESSION_TTL seconds if session specified.
 
-    Will return modified by RESULT_OPERATION output from neural network
-    as single item of specified RESULT_TYPE if macro defined
+    State of session without request for `seconds` is dropped.
 
     Parameters
     ----------
@@ -305,9 +1000,10 @@ def return_result_item(settings):
     Returns
     -------
     str:
-        Either "" or "#define RETURN_RESULT_ITEM"
+        Either "" or "#define SESSION_TTL seconds"
     """
     return macro.conditional(
-        settings["return"]["result"] and settings["return"]["result"]["item"],
-        "RETURN_RESULT_ITEM",
+        settings["session"] is not None,
+        "SESSION_TTL",
+        (settings["session"] or {}).get("ttl"),
     )
@@ -1,29 +1,35 @@
-import collections
+import base64
 import itertools
+import json
+import struct
+import zlib
 
 
-def data(settings) -> str:
+def data(element) -> str:
     """
-    Impute name of field containing base64 encoded data.
+    Impute name of field containing input's data.
 
     Parameters
     ----------
-    settings : typing.Dict
-        YAML parsed to dict
+    element : typing.Dict
+        Settings of single input
 
     Returns
     -------
     str:
         "name_of_data_field"
     """
-    return '"' + settings["input"]["name"] + '"'
+    return '"' + element["name"] + '"'
 
 
 def fields(settings) -> str:
     """
-    Impute name of fields (if any) specifying tensor shape during request.
+    Impute name of fields (if any) specifying tensor shapes during request.
 
-    Fields can be empty if tensor shape is known beforehand
+    Fields are gathered (without repetitions) from all inputs which specify
+    validate_shape: True.
+
+    Fields can be empty if tensor shapes are known beforehand
     (STATIC macro defined, see `header.static` function).
 
     Parameters
@@ -36,32 +42,121 @@ def fields(settings) -> str:
     str:
         "field1", "field2", ..., "fieldN"
     """
+    unique = []
+    for element in settings["inputs"]:
+        if element["validate_shape"]:
+            for field in element["shape"]:
+                if isinstance(field, str) and field not in unique:
+                    unique.append(field)
+    return ", ".join('"' + field + '"' for field in unique)
+
+
+def cache_fields(settings) -> str:
+    """
+    Impute name of fields hashed into cache key (if cache specified).
+
+    Those are `data` fields of all inputs and all fields specifying
+    their shapes (without repetitions) and field naming served model
+    (if multiple models specified), other fields of request
+    do not influence response.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        "name1", ..., "nameN", "field1", ..., "fieldN"
+    """
+    unique = []
+    if settings["models"] is not None:
+        unique.append(settings["routing"]["field"])
+    for element in settings["inputs"]:
+        if element["name"] not in unique:
+            unique.append(element["name"])
+    for element in settings["inputs"]:
+        for field in element["shape"]:
+            if isinstance(field, str) and field not in unique:
+                unique.append(field)
+    return ", ".join('"' + field + '"' for field in unique)
+
+
+def npy_descr(settings) -> str:
+    """
+    Impute NumPy type string of NPY input (if format: npy specified).
+
+    Only arrays of this type are accepted, see `header.npy`.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Either "" or type string, e.g. "<f4" for float input->dtype
+    """
+    if settings["format"] != "npy":
+        return ""
+    descriptions = {
+        "byte": "|u1",
+        "char": "|i1",
+        "short": "<i2",
+        "int": "<i4",
+        "long": "<i8",
+        "half": "<f2",
+        "float": "<f4",
+        "double": "<f8",
+    }
+    return descriptions[base64_type(settings["inputs"][0])]
+
+
+def npy_dimensions(settings) -> str:
+    """
+    Impute names of dimensions of NPY input (if format: npy specified).
+
+    Named dimensions of input->shape become fields with values taken
+    from shape of the array, static ones are marked by empty names.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        "", "field1", ..., "fieldN" (one for each dimension)
+    """
+    if settings["format"] != "npy":
+        return ""
     return ", ".join(
-        [
-            '"' + field + '"'
-            for field in settings["input"]["shape"]
-            if isinstance(field, str)
-        ]
+        '"{}"'.format(dimension if isinstance(dimension, str) else "")
+        for dimension in settings["inputs"][0]["shape"]
     )
 
 
-def data_type(settings) -> str:
+def data_type(element) -> str:
     type_mapping = {
-        "base64": "",
         "byte": "uint8_t",
         "char": "int8_t",
         "short": "int16_t",
         "int": "int32_t",
         "long": "int64_t",
+        "half": "c10::Half",
         "float": "float",
         "double": "double",
     }
-    return type_mapping[settings["input"]["type"]]
+    return type_mapping[base64_type(element) or element["type"]]
 
 
-def data_func(settings) -> str:
+def data_func(element) -> str:
     type_mapping = {
         "base64": "",
+        "image": "",
         "byte": "Integer",
         "char": "Integer",
         "short": "Integer",
@@ -70,47 +165,121 @@ def data_func(settings) -> str:
         "float": "Double",
         "double": "Double",
     }
-    return "As" + type_mapping[settings["input"]["type"]]
+    return "As" + type_mapping[element["type"]]
+
+
+def torch_data_type(element) -> str:
+    type_mapping = {
+        "byte": "torch::kUInt8",
+        "char": "torch::kInt8",
+        "short": "torch::kInt16",
+        "int": "torch::kInt32",
+        "long": "torch::kInt64",
+        "half": "torch::kFloat16",
+        "float": "torch::kFloat32",
+        "double": "torch::kFloat64",
+    }
+    return type_mapping[base64_type(element) or element["type"]]
+
+
+def base64_type(element):
+    """
+    Get element type of decoded base64 buffer (or pixels of decoded image).
+
+    Parameters
+    ----------
+    element : typing.Dict
+        Settings of single input
+
+    Returns
+    -------
+    typing.Optional[str]:
+        input->dtype ("byte" if not specified) for base64 inputs,
+        "byte" for image inputs, None otherwise
+    """
+    if element["type"] == "image":
+        return "byte"
+    if element["type"] != "base64":
+        return None
+    return element["dtype"] or "byte"
 
 
-def normalize(settings, key: str) -> str:
+def compressed(settings, element) -> bool:
     """
-    Impute normalization values if any.
+    Whether data of input is compressed (request of compression specified).
+
+    Only base64 inputs carry compressed bytes, see `header.request_compression`.
 
     Parameters
     ----------
     settings : typing.Dict
         YAML parsed to dict
-    key : str
-        Name of YAML settings field (either means or stddevs) to be imputed
+    element : typing.Dict
+        Settings of single input
 
     Returns
     -------
-    str:
-        "" or "value1, value2, value3"
+    bool:
+        True if data is decompressed into input tensor
     """
-    if settings["normalize"] is None:
-        return ""
-    return ", ".join(map(str, settings["normalize"][key]))
+    compression = settings["compression"] or {}
+    return element["type"] == "base64" and compression.get("request", False)
+
+
+def cast(element) -> str:
+    """
+    Impute libtorch specific type from user provided "human-readable" form.
 
+    See `type_mapping` in source code for exact mapping.
+
+    Parameters
+    ----------
+    element : typing.Dict
+        Settings of single input
 
-def torch_data_type(settings):
+    Returns
+    -------
+    str:
+        String specifying type, e.g. "torch::kFloat16"
+    """
     type_mapping = {
-        "base64": "torch::kUInt8",
         "byte": "torch::kUInt8",
         "char": "torch::kInt8",
         "short": "torch::kInt16",
         "int": "torch::kInt32",
         "long": "torch::kInt64",
+        "half": "torch::kFloat16",
         "float": "torch::kFloat32",
         "double": "torch::kFloat64",
     }
-    return type_mapping[settings["input"]["type"]]
+    return type_mapping[element["cast"]]
+
+
+def normalize(element, key: str) -> str:
+    """
+    Impute normalization values of input.
+
+    Parameters
+    ----------
+    element : typing.Dict
+        Settings of single input
+    key : str
+        Name of YAML settings field (either means or stddevs) to be imputed
+
+    Returns
+    -------
+    str:
+        "value1, value2, value3"
+    """
+    values = element["normalize"][key]
+    if not isinstance(values, list):
+        values = [values]
+    return ", ".join(map(str, values))
 
 
-def inputs(settings) -> str:
+def inputs(element, separator: str = ", ") -> str:
     """
-    Impute input shapes.
+    Impute input shape.
 
     Shapes may be name of fields passed during request (dynamic input shape)
     or integers (static input shape) or mix of both.
@@ -119,27 +288,40 @@ def inputs(settings) -> str:
 
     Parameters
     ----------
-    settings : typing.Dict
-        YAML parsed to dict
+    element : typing.Dict
+        Settings of single input
+    separator : str, optional
+        Separator between dimensions, " * " imputes number of elements.
+        Default: ", "
 
     Returns
     -------
     str:
         String like "1, 3, json_view.GetInteger("width"), json_view.GetInteger("height")"
     """
-    return ", ".join(
+    return separator.join(
         str(elem)
         if isinstance(elem, int)
         else 'json_view.GetInteger("{}")'.format(elem)
-        for elem in settings["input"]["shape"]
+        for elem in element["shape"]
     )
 
 
-def aws_to_torch(settings, key: str) -> str:
+def validate_bytes(settings) -> str:
     """
-    Impute libtorch specific type from user provided "human-readable" form.
+    Impute check of decoded length of each base64 or array input with validate: True.
 
-    See `type_mapping` in source code for exact mapping.
+    Length of base64 string (or each sample of it for batched inputs)
+    after decoding has to be equal to number of elements specified by
+    input->shape times size of input->dtype in bytes.
+    Length of array (or each sample) has to be equal to number of elements,
+    otherwise it would be truncated or padded when decoded into
+    preallocated storage or fail to reshape.
+
+    Decoded length is calculated from number of base64 characters only,
+    so no decoding happens before the check.
+    Compressed inputs are skipped, their decompressed length is checked
+    during decompression (see `create_inputs`).
 
     Parameters
     ----------
@@ -149,57 +331,657 @@ def aws_to_torch(settings, key: str) -> str:
     Returns
     -------
     str:
-        String specifying type, e.g. "torch::kFloat16"
+        C++ code validating decoded lengths (or "" if no validation specified)
     """
-    type_mapping = {
-        "bool": "torch::kInt8",
-        "int": "torch::kInt32",
-        "long": "torch::kInt64",
-        "double": "torch::kFloat64",
-    }
 
-    if settings["return"][key] is None:
-        return ""
+    def _validate_array(element):
+        name = element["name"]
+        value = 'json_view.GetObject("{}")'.format(name)
+        length = "static_cast<std::size_t>({})".format(inputs(element, separator=" * "))
+        if element["batch"]:
+            condition = (
+                "    if (!is_batch_of(\n"
+                "            {0},\n"
+                "            [&](const JsonView &sample) {{\n"
+                "#ifdef STREAMING\n"
+                "              return sample.Count() == {1};\n"
+                "#else\n"
+                "              return sample.AsArray().GetLength() == {1};\n"
+                "#endif\n"
+                "            }}))\n"
+            ).format(value, length)
+        else:
+            condition = (
+                "#ifdef STREAMING\n"
+                "    if ({0}.Count() != {1})\n"
+                "#else\n"
+                "    if ({0}.AsArray().GetLength() != {1})\n"
+                "#endif\n"
+            ).format(value, length)
+        return (
+            "{}"
+            "      return aws::lambda_runtime::invocation_response::failure(\n"
+            '          "Length of field: \\"{}\\" does not match input shape.",\n'
+            '          "InvalidJSON");\n'
+        ).format(condition, name)
+
+    def _validate(element):
+        if element["type"] not in ("base64", "image"):
+            return _validate_array(element)
+        name = element["name"]
+        value = 'json_view.GetObject("{}")'.format(name)
+        length = "c10::elementSize({}) * {}".format(
+            torch_data_type(element), inputs(element, separator=" * ")
+        )
+        if element["batch"]:
+            condition = (
+                "is_batch_of(\n"
+                "            {},\n"
+                "            [&](const JsonView &sample) {{\n"
+                "              return decoded_length(sample) ==\n"
+                "                     {};\n"
+                "            }})"
+            ).format(value, length)
+        else:
+            condition = "decoded_length({}) ==\n          {}".format(
+                value, length
+            )
+        return (
+            "    if (!({}))\n"
+            "      return aws::lambda_runtime::invocation_response::failure(\n"
+            '          "Decoded length of field: \\"{}\\" does not match input shape.",\n'
+            '          "InvalidJSON");\n'
+        ).format(condition, name)
+
+    return "\n".join(
+        _validate(element)
+        for element in settings["inputs"]
+        if element["validate"]
+        and element["type"] != "image"
+        and not compressed(settings, element)
+    )
+
+
+def validate_inputs(settings) -> str:
+    """
+    Impute validation of data field of each input with validate: True.
+
+    Each data field will be checked for existence and whether it's
+    type is string (base64) or array. For batched inputs each sample
+    is checked separately.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        C++ code validating data fields (or "" if no validation specified)
+    """
+
+    def _failure(name, message):
+        return (
+            "      return aws::lambda_runtime::invocation_response::failure(\n"
+            '          "Required field: \\"{}\\" {}.", "InvalidJSON");\n'
+        ).format(name, message)
+
+    def _validate(element):
+        name = element["name"]
+        value = 'json_view.GetObject("{}")'.format(name)
+        check, message, samples = (
+            ("IsString", "is not string", "strings")
+            if element["type"] in ("base64", "image")
+            else ("IsListType", "is not list type", "lists")
+        )
+        if element["batch"]:
+            condition = "is_batch_of({}, &JsonView::{})".format(value, check)
+            message = "is not non-empty list of {}".format(samples)
+        else:
+            condition = "{}.{}()".format(value, check)
+        return (
+            '    if (!json_view.KeyExists("{}"))\n'.format(name)
+            + _failure(name, "was not provided")
+            + "    if (!{})\n".format(condition)
+            + _failure(name, message)
+        )
+
+    return "\n".join(
+        _validate(element) for element in settings["inputs"] if element["validate"]
+    )
+
+
+def create_inputs(settings) -> str:
+    """
+    Impute creation of tensor for each input.
+
+    Each input is decoded (either from base64 string or flat array of it's type),
+    reshaped to input->shape and optionally casted, divided and normalized.
+    Cast to floating point type followed by division and/or normalization
+    is done in single pass by precomputed transformation (see `preprocessing`).
+
+    Batched inputs have each sample decoded and reshaped separately, after
+    which samples are concatenated and processed at once.
+
+    If preallocate: True specified, data is decoded and converted straight
+    into storage allocated once (`buffers.inputs`, two per input
+    for decoded data and it's casted counterpart).
+
+    Compressed inputs (see `header.request_compression`) are decompressed
+    straight into tensor of input->shape (each sample into it's part
+    of the batch), failure is returned if decompressed length does not match.
+    Image inputs are decoded, resized and center-cropped the same way,
+    failure is returned if data is not valid JPEG or PNG image.
+
+    Tensors are named `input_<index>` based on position in inputs.
+    Decoding and preprocessing are marked as stages for instrumentation
+    (see `header.instrumentation`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        C++ code creating tensors
+    """
+
+    def _decode(element, value):
+        if element["type"] == "base64":
+            return "decode({}, {})".format(value, torch_data_type(element))
+        return "decode<{}>({}, {}, &JsonView::{})".format(
+            data_type(element), value, torch_data_type(element), data_func(element)
+        )
+
+    def _failure(element):
+        return (
+            "      return aws::lambda_runtime::invocation_response::failure(\n"
+            '          "Field: \\"{}\\" could not be decompressed into input shape.",\n'
+            '          "InvalidJSON");'
+        ).format(element["name"])
+
+    def _image_failure(element):
+        return (
+            "      return aws::lambda_runtime::invocation_response::failure(\n"
+            '          "Field: \\"{}\\" is not valid JPEG or PNG image.",\n'
+            '          "InvalidJSON");'
+        ).format(element["name"])
+
+    def _image_arguments(element):
+        return "{}, Interpolation::{}".format(
+            element["resize"] or 0, element["interpolation"]
+        )
+
+    def _preallocated(index, element, variable):
+        value = "json_view.GetObject({})".format(data(element))
+        raw, converted = (
+            "buffers.inputs[{}]".format(2 * index),
+            "buffers.inputs[{}]".format(2 * index + 1),
+        )
+        if compressed(settings, element):
+            decode = "if (!decompress_into({}, {}))\n{}".format(
+                value, raw, _failure(element)
+            )
+        elif element["type"] == "image":
+            decode = "if (!decode_image_into({}, {}, {}))\n{}".format(
+                value, raw, _image_arguments(element), _image_failure(element)
+            )
+        elif element["type"] == "base64":
+            decode = "decode_into({}, {});".format(value, raw)
+        else:
+            decode = "decode_into<{}>({}, {}, &JsonView::{});".format(
+                data_type(element), value, raw, data_func(element)
+            )
+        lines = [
+            "    /* Input {} */".format(data(element)),
+            "    " + decode,
+            "    TIMING(decode);",
+        ]
+        if fused(element):
+            lines.append(
+                "    preprocess_{}.ApplyInto<{}>({}, {});".format(
+                    index, data_type(element), raw, converted
+                )
+            )
+        elif element["cast"] is not None:
+            lines.append("    {}.copy_({});".format(converted, raw))
+        else:
+            converted = raw
+        lines.append("    torch::Tensor {} = {};".format(variable, converted))
+        return lines
+
+    def _decompressed(element, variable):
+        return [
+            "    /* Input {} */".format(data(element)),
+            "    torch::Tensor {} = {}(\n"
+            "        json_view.GetObject({}),\n"
+            "        {{{}}}, {});".format(
+                variable,
+                "decompress_batch" if element["batch"] else "decompress",
+                data(element),
+                inputs(element),
+                torch_data_type(element),
+            ),
+            "    if (!{}.defined())".format(variable),
+            _failure(element),
+            "    TIMING(decode);",
+        ]
+
+    def _image(element, variable):
+        return [
+            "    /* Input {} */".format(data(element)),
+            "    torch::Tensor {} = {}(\n"
+            "        json_view.GetObject({}),\n"
+            "        {{{}}}, {});".format(
+                variable,
+                "decode_image_batch" if element["batch"] else "decode_image",
+                data(element),
+                inputs(element),
+                _image_arguments(element),
+            ),
+            "    if (!{}.defined())".format(variable),
+            _image_failure(element),
+            "    TIMING(decode);",
+        ]
+
+    def _allocated(index, element, variable):
+        value = "json_view.GetObject({})".format(data(element))
+        if element["batch"]:
+            tensor = (
+                "decode_batch(\n"
+                "        {},\n"
+                "        [&](const JsonView &sample) {{\n"
+                "          return {}.reshape({{{}}});\n"
+                "        }})"
+            ).format(value, _decode(element, "sample"), inputs(element))
+        else:
+            tensor = "{}\n        .reshape({{{}}})".format(
+                _decode(element, value), inputs(element)
+            )
+
+        if compressed(settings, element):
+            lines = _decompressed(element, variable)
+        elif element["type"] == "image":
+            lines = _image(element, variable)
+        else:
+            lines = [
+                "    /* Input {} */".format(data(element)),
+                "    torch::Tensor {} = {};".format(variable, tensor),
+                "    TIMING(decode);",
+            ]
+        if fused(element):
+            lines.append(
+                "    {0} = preprocess_{1}.Apply<{2}>({0});".format(
+                    variable, index, data_type(element)
+                )
+            )
+        elif element["cast"] is not None:
+            lines.append("    {0} = {0}.toType({1});".format(variable, cast(element)))
+        return lines
+
+    def _create(index, element):
+        variable = "input_{}".format(index)
+        if settings["preallocate"]:
+            lines = _preallocated(index, element, variable)
+        else:
+            lines = _allocated(index, element, variable)
+        if not fused(element):
+            if element["divide"] is not None:
+                lines.append("    {0} = {0} / {1};".format(variable, element["divide"]))
+            if element["normalize"] is not None:
+                lines.append(
+                    "    {0} = torch::data::transforms::Normalize<>{{\n"
+                    "        {{{1}}}, {{{2}}}}}({0});".format(
+                        variable,
+                        normalize(element, key="means"),
+                        normalize(element, key="stddevs"),
+                    )
+                )
+        if any(element[key] is not None for key in ("cast", "divide", "normalize")):
+            lines.append("    TIMING(preprocess);")
+        return "\n".join(lines) + "\n"
+
+    return "\n".join(
+        _create(index, element) for index, element in enumerate(settings["inputs"])
+    )
+
+
+def fused(element) -> bool:
+    """
+    Whether cast, division and normalization of input are done in single pass.
+
+    Applicable if input is casted to floating point type and divided
+    and/or normalized (all of those known during code generation).
+
+    Parameters
+    ----------
+    element : typing.Dict
+        Settings of single input
+
+    Returns
+    -------
+    bool:
+        True if input is processed by `Affine` transformation
+    """
+    return element["cast"] in ("half", "float", "double") and (
+        element["divide"] is not None or element["normalize"] is not None
+    )
+
+
+def scale_and_shift(element):
+    """
+    Fold division and normalization of input into per channel scale and shift.
+
+    `(x / divide - mean) / stddev` is equal to `x * scale + shift` where
+    `scale = 1 / (divide * stddev)` and `shift = -mean / stddev`.
+
+    Parameters
+    ----------
+    element : typing.Dict
+        Settings of single input
+
+    Returns
+    -------
+    typing.Tuple[typing.List[float], typing.List[float]]:
+        Scale and shift for each channel (single value if broadcasted)
+    """
+
+    def _values(key):
+        values = element["normalize"][key]
+        if not isinstance(values, list):
+            values = [values]
+        return values
+
+    divide = 1 if element["divide"] is None else element["divide"]
+    if element["normalize"] is None:
+        return [1 / divide], [0.0]
+
+    means, stddevs = _values("means"), _values("stddevs")
+    channels = max(len(means), len(stddevs))
+    means = means * channels if len(means) == 1 else means
+    stddevs = stddevs * channels if len(stddevs) == 1 else stddevs
+    return (
+        [1 / (divide * stddev) for stddev in stddevs],
+        [-mean / stddev for mean, stddev in zip(means, stddevs)],
+    )
+
+
+def preprocessing(settings) -> str:
+    """
+    Impute `Affine` transformation for each input processed in single pass.
+
+    Scale and shift are precomputed during code generation and transformations
+    (including lookup tables for byte inputs) are created once during
+    program initialization instead of every request.
+
+    Transformations are named `preprocess_<index>` based on position in inputs.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        C++ code defining transformations (or "" if none of inputs is fused)
+    """
+
+    def _create(index, element):
+        type_mapping = {"half": "c10::Half", "float": "float", "double": "double"}
+        scale, shift = scale_and_shift(element)
+        return (
+            "/* Input {}: division and normalization folded into scale and shift */\n"
+            "static const Affine<{}> preprocess_{}{{\n"
+            "    {{{}}},\n"
+            "    {{{}}},\n"
+            "    {}}};\n"
+        ).format(
+            data(element),
+            type_mapping[element["cast"]],
+            index,
+            ", ".join(map(repr, scale)),
+            ", ".join(map(repr, shift)),
+            cast(element),
+        )
+
+    return "\n".join(
+        _create(index, element)
+        for index, element in enumerate(settings["inputs"])
+        if fused(element)
+    )
 
-    return type_mapping[settings["return"][key]["type"].lower()]
 
+def postprocessing(settings) -> str:
+    """
+    Impute labels of classes for each return with predictions using them.
+
+    Labels files are read once during program initialization instead of
+    every request. Labels are named `labels_<index>` based on position
+    in returns.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        C++ code defining labels (or "" if none of returns uses them)
+    """
+
+    def _create(index, element):
+        return (
+            "/* Return {}: labels of predicted classes */\n"
+            'static const Labels labels_{}{{"{}"}};\n'
+        ).format(index, index, element["predictions"]["labels"])
+
+    return "\n".join(
+        _create(index, element)
+        for index, element in enumerate(settings["returns"])
+        if element["predictions"] is not None
+        and element["predictions"]["labels"] is not None
+    )
+
+
+def predictions(predictions, batch: bool):
+    """
+    Get scores of output tensor and classes ranked by them.
+
+    Last dimension of output (or all of it's elements if not batched) are
+    scores of classes. Softmax (divided by temperature if other than 1)
+    is applied if specified. Only `top` classes are ranked via `topk`
+    instead of sorting all of them (if specified).
+
+    Parameters
+    ----------
+    predictions : typing.Dict
+        Settings of returned predictions
+    batch : bool
+        Whether output contains predictions of multiple samples
+
+    Returns
+    -------
+    typing.Tuple[str, str]:
+        Scores and ranked classes (tuple of scores and indices) expressions,
+        e.g. "torch::softmax(output.reshape({1, -1}).to(torch::kFloat32), 1)"
+        and "torch::topk(scores, std::min<int64_t>(5, scores.size(1)), 1)"
+    """
+    scores = "output.reshape({{{}, -1}}).to(torch::kFloat32)".format(
+        "output.size(0)" if batch else 1
+    )
+    temperature = predictions["softmax"]
+    if temperature is not None:
+        if temperature != 1:
+            scores = "{} / {!r}".format(scores, float(temperature))
+        scores = "torch::softmax({}, 1)".format(scores)
+    if predictions["top"] is None:
+        return scores, "torch::sort(scores, 1, true)"
+    return (
+        scores,
+        "torch::topk(scores, std::min<int64_t>({}, scores.size(1)), 1)".format(
+            predictions["top"]
+        ),
+    )
+
+
+def allocate_buffers(settings) -> str:
+    """
+    Impute initialization of storage reused by every request.
 
-def torch_approximation(settings, key: str) -> str:
+    Each input has two tensors of static shape allocated, for decoded data
+    and for data casted to input->cast (undefined if not casted).
+    Storage for returned tensors (two per element of returns, for output
+    and result) is allocated during first request.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        C++ initializer of `Buffers` structure
     """
-    PyTorch has no `bool` type in libtorch hence we approximate one.
 
-    Each item will be later static_casted to appropriate type if needed,
-    which is essentially a no-op for for already correct types.
+    def _allocate(element):
+        shape = inputs(element)
+        converted = (
+            "torch::Tensor{}"
+            if element["cast"] is None
+            else "torch::empty({{{}}}, {})".format(shape, cast(element))
+        )
+        return (
+            "                /* Input {} */\n"
+            "                torch::empty({{{}}}, {}),\n"
+            "                {},\n"
+        ).format(data(element), shape, torch_data_type(element), converted)
+
+    if not settings["preallocate"]:
+        return "{}"
+    return (
+        "{{\n"
+        "            {{\n"
+        "{}"
+        "            }},\n"
+        "            std::vector<torch::Tensor>({})}}"
+    ).format(
+        "".join(_allocate(element) for element in settings["inputs"]),
+        2 * len(settings["returns"]),
+    )
 
-    Usually only `bool` will be casted (eventually other "hard-types" if
-    the architecture is specific).
+
+def forward_inputs(settings) -> str:
+    """
+    Impute tensors passed to network in order specified by inputs.
 
     Parameters
     ----------
     settings : typing.Dict
         YAML parsed to dict
 
+    Returns
+    -------
+    str:
+        "input_0, input_1, ..., input_N"
+    """
+    return ", ".join(
+        "input_{}".format(index) for index in range(len(settings["inputs"]))
+    )
+
+
+def aws_to_torch(spec) -> str:
+    """
+    Impute libtorch specific type of base64 encoded output or result.
+
+    See `type_mapping` in source code for exact mapping.
+
+    Parameters
+    ----------
+    spec : typing.Dict
+        Settings of returned output or result
+
+    Returns
+    -------
+    str:
+        String specifying type, e.g. "torch::kFloat16"
+    """
+    type_mapping = {
+        "float16": "torch::kFloat16",
+        "float32": "torch::kFloat32",
+        "float64": "torch::kFloat64",
+        "int8": "torch::kInt8",
+        "uint8": "torch::kUInt8",
+        "int32": "torch::kInt32",
+        "int64": "torch::kInt64",
+    }
+    return type_mapping[encoded_type(spec)]
+
+
+def torch_approximation(spec) -> str:
+    """
+    Impute C++ type of elements of base64 encoded output or result.
+
+    Arrays serialized to JSON need no such type, as values are casted
+    to `type` during formatting from whatever type network returned.
+
+    Parameters
+    ----------
+    spec : typing.Dict
+        Settings of returned output or result
+
     Returns
     -------
     str:
         String specifying type, e.g. "int8_t"
     """
     type_mapping = {
-        "bool": "int8_t",
-        "int": "int32_t",
-        "long": "int64_t",
-        "double": "double",
+        "float16": "c10::Half",
+        "float32": "float",
+        "float64": "double",
+        "int8": "int8_t",
+        "uint8": "uint8_t",
+        "int32": "int32_t",
+        "int64": "int64_t",
     }
+    return type_mapping[encoded_type(spec)]
 
-    if settings["return"][key] is None:
-        return ""
 
-    return type_mapping[settings["return"][key]["type"].lower()]
+def encoded_type(spec) -> str:
+    """
+    Get dtype of base64 encoded output or result.
+
+    It is either specified explicitly by `dtype` or derived from `type`
+    (`bool` is approximated by `int8` as in the case of JSON arrays).
 
+    Parameters
+    ----------
+    spec : typing.Dict
+        Settings of returned output or result
 
-def operations_and_arguments(settings):
+    Returns
+    -------
+    str:
+        NumPy-like dtype name, e.g. "float16"
     """
-    If return->result specified get names of operations to apply on output tensor.
+    type_mapping = {
+        "bool": "int8",
+        "int": "int32",
+        "long": "int64",
+        "float": "float32",
+        "double": "float64",
+    }
+    return spec["dtype"] or type_mapping[spec["type"].lower()]
+
+
+def operations_and_arguments(result):
+    """
+    Get names of operations to apply on output tensor.
 
     Merges return->result->operations and return->result->arguments into
     single string to input.
@@ -213,13 +995,13 @@ def operations_and_arguments(settings):
 
     Parameters
     ----------
-    settings : typing.Dict
-        YAML parsed to dict
+    result : typing.Dict
+        Settings of returned result
 
     Returns
     -------
     str:
-        string representation of number, e.g. "255.0"
+        string representation of operations, e.g. "torch::argmax(output, 1)"
 
     """
 
@@ -243,14 +1025,11 @@ def operations_and_arguments(settings):
             return [value]
         return value
 
-    if settings["return"]["result"] is None:
-        return ""
-
-    if "code" in settings["return"]["result"]:
-        return settings["return"]["result"]["code"]
+    if "code" in result:
+        return result["code"]
 
-    operations = settings["return"]["result"]["operations"]
-    arguments = settings["return"]["result"]["arguments"]
+    operations = result["operations"]
+    arguments = result["arguments"]
     if arguments is None:
         if isinstance(operations, str):
             return "{}(output)".format(_add_namespace(operations))
@@ -263,66 +1042,382 @@ def operations_and_arguments(settings):
     return output
 
 
-def aws_function(settings, key: str, array: bool) -> str:
+def create_returns(settings) -> str:
     """
-    Internal imputation specifying one of AWS SDK functions based on type.
+    Impute creation of returned JSON fields for each element of returns.
+
+    Each element is processed in it's own scope where returned tensor
+    (whole network output or it's tuple/dict element) is named `output`
+    and tensor obtained via operations is named `result`.
+
+    Arrays (or single items) are written straight into `response` JSON
+    object under specified names (optionally with fixed number of decimal
+    places, see `precision`). For batched inputs arrays are nested per sample,
+    while items are returned as flat array (one item per sample).
 
-    This function specifies which AWS SDK function will be used to create
-    JSONValue (either as single item to return or as part of array to return).
+    Tensors are serialized in the type returned by the network
+    (each value is casted during formatting), hence no converted copy is made.
+    Result is obtained from the returned tensor (not the casted one).
 
-    Looked for in return->output and return->result settings and returns one or both
-    depending on which is specified.
+    Arrays with `encoding: base64` are returned as objects containing
+    raw little-endian bytes of tensor (casted to `dtype`) encoded in base64,
+    `dtype` and `shape` (including batch dimension) instead.
+    Casting is skipped if the network returns `dtype` already.
+    If preallocate: True specified, they are converted into
+    storage reused by every request (`buffers.returns`).
+
+    For records events (see `header.records`) returned tensors are narrowed
+    to samples of single record (`first` and `samples`), so each record
+    gets it's own response.
+
+    Predictions (see `predictions`) are returned as array of objects
+    containing index, label (if labels specified, see `postprocessing`)
+    and score of class, best first. Classes with score lower than
+    `threshold` are skipped. For batched inputs arrays are nested per sample.
 
     Parameters
     ----------
     settings : typing.Dict
         YAML parsed to dict
-    key : str
-        Name of field to look for in type (either "output" or "result")
-    array: bool
-        Whether prefix should be tailored to array output (`As`) or item (`With`)
 
     Returns
     -------
     str:
-        "" or "As<type>" or "With<type>" AWS function name
-
+        C++ code adding values to `response`
     """
+    batch = any(element["batch"] for element in settings["inputs"])
+
+    def _source(element):
+        if element["index"] is not None:
+            return (
+                "Element {} of returned tuple".format(element["index"]),
+                "forwarded.toTuple()->elements()[{}].toTensor()".format(
+                    element["index"]
+                ),
+            )
+        if element["key"] is not None:
+            return (
+                'Element "{}" of returned dict'.format(element["key"]),
+                'forwarded.toGenericDict().at(c10::IValue{{"{}"}}).toTensor()'.format(
+                    element["key"]
+                ),
+            )
+        return "Returned tensor", "forwarded.toTensor()"
+
+    def _serialize(variable, spec, slot):
+        if spec["encoding"] == "base64":
+            return '        response.Encoded<{}>("{}", {}, "{}");\n'.format(
+                torch_approximation(spec),
+                spec["name"],
+                _convert(variable, spec, slot),
+                encoded_type(spec),
+            )
+        arguments = '<{}>("{}", '.format(spec["type"], spec["name"])
+        if spec["item"]:
+            function = "Array" if batch else "Item"
+            # Single item per sample is returned as flat array
+            if batch:
+                variable = "{0}.reshape({{{0}.size(0)}})".format(variable)
+        else:
+            function = "NestedArray" if batch else "Array"
+        precision = (
+            "" if spec["precision"] is None else ", {}".format(spec["precision"])
+        )
+        return "        response.{}{}{}{});\n".format(
+            function, arguments, variable, precision
+        )
 
-    prefix = "As" if array else "With"
-    type_mapping = {
-        "int": "Integer",
-        "long": "Int64",
-        "double": "Double",
-    }
+    def _convert(tensor, spec, slot):
+        if settings["preallocate"]:
+            return "convert({}, buffers.returns[{}], {})".format(
+                tensor, slot, aws_to_torch(spec)
+            )
+        return "{}.toType({})".format(tensor, aws_to_torch(spec))
+
+    def _predictions(index, spec):
+        scores, ranked = predictions(spec, batch)
+        threshold = (
+            "-std::numeric_limits<double>::infinity()"
+            if spec["threshold"] is None
+            else repr(float(spec["threshold"]))
+        )
+        labels = "nullptr" if spec["labels"] is None else "&labels_{}".format(index)
+        precision = (
+            "" if spec["precision"] is None else ", {}".format(spec["precision"])
+        )
+        return (
+            "        const auto scores = {};\n"
+            "        const auto ranked = {};\n"
+            '        response.{}("{}", std::get<0>(ranked), std::get<1>(ranked), '
+            "{}, {}{});\n"
+        ).format(
+            scores,
+            ranked,
+            "NestedPredictions" if batch else "Predictions",
+            spec["name"],
+            labels,
+            threshold,
+            precision,
+        )
 
-    if settings["return"][key] is None:
-        return ""
-    return prefix + type_mapping[settings["return"][key]["type"].lower()]
+    def _create(index, element):
+        description, source = _source(element)
+        if settings["event"] in ("sqs", "kinesis"):
+            source += ".narrow(0, first, samples)"
+        output, result = element["output"], element["result"]
+        code = "    {{\n        /* {} */\n".format(description)
+        code += "        const auto output = {};\n".format(source)
+        if result is not None:
+            code += "        const auto result = {};\n".format(
+                operations_and_arguments(result)
+            )
+        if output is not None:
+            code += _serialize("output", output, 2 * index)
+        if result is not None:
+            code += _serialize("result", result, 2 * index + 1)
+        if element["predictions"] is not None:
+            code += _predictions(index, element["predictions"])
+        return code + "    }\n"
+
+    return "\n".join(
+        _create(index, element) for index, element in enumerate(settings["returns"])
+    )
+
+
+def _png(channels: int, height: int, width: int) -> bytes:
+    """Encode black grayscale (single channel) or RGB image as PNG file."""
+
+    def _chunk(kind: bytes, payload: bytes) -> bytes:
+        return (
+            struct.pack(">I", len(payload))
+            + kind
+            + payload
+            + struct.pack(">I", zlib.crc32(kind + payload))
+        )
+
+    header = struct.pack(
+        ">IIBBBBB", width, height, 8, 0 if channels == 1 else 2, 0, 0, 0
+    )
+    # Each row is preceded by filter type (0, none)
+    rows = (b"\x00" + bytes(width * channels)) * height
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + _chunk(b"IHDR", header)
+        + _chunk(b"IDAT", zlib.compress(rows))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def _cbor(value) -> bytes:
+    """Encode integers, bytes, strings, lists and dicts as CBOR."""
+
+    def _head(major: int, argument: int) -> bytes:
+        if argument < 24:
+            return bytes([major << 5 | argument])
+        for info, size in ((24, 1), (25, 2), (26, 4), (27, 8)):
+            if argument < 1 << 8 * size:
+                return bytes([major << 5 | info]) + argument.to_bytes(size, "big")
+        raise ValueError("Integer {} cannot be encoded as CBOR".format(argument))
+
+    if isinstance(value, int):
+        return _head(0, value) if value >= 0 else _head(1, -1 - value)
+    if isinstance(value, bytes):
+        return _head(2, len(value)) + value
+    if isinstance(value, str):
+        return _head(3, len(value.encode())) + value.encode()
+    if isinstance(value, list):
+        return _head(4, len(value)) + b"".join(map(_cbor, value))
+    return _head(5, len(value)) + b"".join(
+        _cbor(key) + _cbor(item) for key, item in value.items()
+    )
 
 
-def field_if_exists(settings, key: str, name: str) -> str:
+def _msgpack(value) -> bytes:
+    """Encode integers, bytes, strings, lists and dicts as MessagePack."""
+
+    def _head(fixed: int, limit: int, codes, length: int) -> bytes:
+        # Fixed type (if any) with length in it's lower bits or the shortest code
+        if length < limit:
+            return bytes([fixed | length])
+        for code, size in codes:
+            if length < 1 << 8 * size:
+                return bytes([code]) + length.to_bytes(size, "big")
+        raise ValueError("Length {} cannot be encoded as MessagePack".format(length))
+
+    if isinstance(value, int):
+        if -32 <= value < 128:
+            return value.to_bytes(1, "big", signed=True)
+        for index, size in enumerate((1, 2, 4, 8)):
+            if value >= 0 and value < 1 << 8 * size:
+                return bytes([0xCC + index]) + value.to_bytes(size, "big")
+            if value < 0 and value >= -(1 << 8 * size - 1):
+                return bytes([0xD0 + index]) + value.to_bytes(size, "big", signed=True)
+        raise ValueError("Integer {} cannot be encoded as MessagePack".format(value))
+    if isinstance(value, bytes):
+        return _head(0, 0, ((0xC4, 1), (0xC5, 2), (0xC6, 4)), len(value)) + value
+    if isinstance(value, str):
+        encoded = value.encode()
+        codes = ((0xD9, 1), (0xDA, 2), (0xDB, 4))
+        return _head(0xA0, 32, codes, len(encoded)) + encoded
+    if isinstance(value, list):
+        return _head(0x90, 16, ((0xDC, 2), (0xDD, 4)), len(value)) + b"".join(
+            map(_msgpack, value)
+        )
+    return _head(0x80, 16, ((0xDE, 2), (0xDF, 4)), len(value)) + b"".join(
+        _msgpack(key) + _msgpack(item) for key, item in value.items()
+    )
+
+
+def _npy(descr: str, shape, data: bytes) -> bytes:
+    """Encode data as NPY file (version 1.0) of C ordered array."""
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': ({}), }}".format(
+        descr, "".join("{},".format(dimension) for dimension in shape)
+    )
+    # Header (with magic, version, length and newline) is padded to 64 bytes
+    header += " " * (-(len(header) + 11) % 64) + "\n"
+    return (
+        b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode() + data
+    )
+
+
+def synthetic_payload(settings) -> str:
     """
-    Return value of nested fields if those are specified.
+    Create request with zero-filled data of each input.
+
+    Named dimensions of shapes are taken from warmup->fields and included
+    in the request. Batched inputs contain single sample, compressed
+    inputs carry zlib compressed zeros and image inputs black PNG image.
+    Request of binary format (see `header.format`) carries those bytes
+    as they are and is base64 encoded as a whole.
+
+    If event: apigateway specified, request is wrapped in proxy event:
+    either raw bytes of the only base64 input with shape fields as query
+    string parameters (if binary body can be passed, see
+    `header.apigateway_binary`) or JSON request as body.
+    For event: sqs or event: kinesis request is carried by single record
+    (as message body or base64 encoded data respectively).
 
     Parameters
     ----------
     settings : typing.Dict
         YAML parsed to dict
-    key : str
-        Name of field to look for in type (either "output" or "result")
-    name: str
-        Name of field to look for in one of "output" or "result"
 
     Returns
     -------
     str:
-        "" or value provided in field
+        Compact JSON request (or proxy event)
+    """
+    encoders = {"msgpack": _msgpack, "cbor": _cbor}
+    byte_sizes = {
+        "byte": 1,
+        "char": 1,
+        "short": 2,
+        "int": 4,
+        "long": 8,
+        "half": 2,
+        "float": 4,
+        "double": 8,
+    }
+    fields = settings["warmup"]["fields"]
+    request = dict(fields)
+    for element in settings["inputs"]:
+        numel = 1
+        for dimension in element["shape"]:
+            numel *= fields[dimension] if isinstance(dimension, str) else dimension
+        if element["type"] == "image":
+            sample = _png(*element["shape"][1:])
+        elif element["type"] == "base64":
+            sample = bytes(numel * byte_sizes[base64_type(element)])
+            if compressed(settings, element):
+                sample = zlib.compress(sample)
+        else:
+            sample = [0] * numel
+        if isinstance(sample, bytes) and settings["format"] == "json":
+            sample = base64.b64encode(sample).decode()
+        request[element["name"]] = [sample] if element["batch"] else sample
+
+    if settings["format"] != "json":
+        if settings["format"] == "npy":
+            element = settings["inputs"][0]
+            shape = [fields.get(dimension, dimension) for dimension in element["shape"]]
+            payload = _npy(npy_descr(settings), shape, request[element["name"]])
+        else:
+            payload = encoders[settings["format"]](request)
+        payload = base64.b64encode(payload).decode()
+        if settings["event"] == "apigateway":
+            request = {"body": payload, "isBase64Encoded": True}
+        else:
+            request = {
+                "Records": [{"kinesis": {"sequenceNumber": "warmup", "data": payload}}]
+            }
+    elif settings["event"] == "apigateway":
+        element, *others = settings["inputs"]
+        if (
+            not others
+            and element["type"] in ("base64", "image")
+            and not element["batch"]
+        ):
+            request = {
+                "body": request[element["name"]],
+                "isBase64Encoded": True,
+                "queryStringParameters": {
+                    key: str(value) for key, value in fields.items()
+                },
+            }
+        else:
+            request = {
+                "body": json.dumps(request, separators=(",", ":")),
+                "isBase64Encoded": False,
+            }
+    elif settings["event"] == "sqs":
+        request = {
+            "Records": [
+                {
+                    "messageId": "warmup",
+                    "body": json.dumps(request, separators=(",", ":")),
+                }
+            ]
+        }
+    elif settings["event"] == "kinesis":
+        data = json.dumps(request, separators=(",", ":")).encode()
+        request = {
+            "Records": [
+                {
+                    "kinesis": {
+                        "sequenceNumber": "warmup",
+                        "data": base64.b64encode(data).decode(),
+                    }
+                }
+            ]
+        }
+    return json.dumps(request, separators=(",", ":"))
+
+
+def warmup_payloads(settings) -> str:
+    """
+    Impute requests run through handler during initialization.
+
+    Requests are contents of warmup->payloads files (see
+    `template.read_payloads`, events if event other than direct specified)
+    or single synthetic request (see `synthetic_payload`)
+    if files were not specified.
 
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Comma separated C++ raw string literals (or "" if no warmup specified)
     """
-    if settings["return"][key] is None:
+    if settings["warmup"] is None:
         return ""
-    return settings["return"][key][name]
+    payloads = settings["warmup"]["payloads"] or [synthetic_payload(settings)]
+    return ",\n".join(
+        'R"torchlambda({})torchlambda"'.format(payload) for payload in payloads
+    )
 
 
 def model(settings) -> str:
@@ -341,3 +1436,104 @@ def model(settings) -> str:
 
     """
     return '"' + settings["model"] + '"'
+
+
+def routes(settings) -> str:
+    """
+    Impute name, path and generated functions of each model (if multiple models).
+
+    Functions of each model are placed in `model_<index>` namespace.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        {"name1", "/path/to/model1", &model_0::create_inputs,
+        &model_0::create_response}, ...
+    """
+    return ", ".join(
+        '{{"{}", "{}", &model_{index}::create_inputs, '
+        "&model_{index}::create_response}}".format(
+            model["name"], model["path"], index=index
+        )
+        for index, model in enumerate(settings["models"] or [])
+    )
+
+
+def cascade_stages(settings) -> str:
+    """
+    Impute path, confidence criterion and threshold of each stage (if cascade).
+
+    Stage answers request if it's confidence (lowest across samples)
+    is at least `threshold`.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        {"/path/to/stage1", Confidence::probability, 0.9}, ...
+    """
+    return ", ".join(
+        '{{"{}", Confidence::{}, {}}}'.format(
+            stage["model"], stage["confidence"], float(stage["threshold"])
+        )
+        for stage in (settings["cascade"] or {}).get("stages", [])
+    )
+
+
+def cascade_logits(settings) -> str:
+    """
+    Impute logits (classes in last dimension) judged by cascade (if cascade).
+
+    Returned tensor by default, element of returned tuple (index)
+    or dict (key) if specified.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        forwarded.toTensor() or element of forwarded
+    """
+    cascade = settings["cascade"] or {}
+    if cascade.get("index") is not None:
+        return "forwarded.toTuple()->elements()[{}].toTensor()".format(cascade["index"])
+    if cascade.get("key") is not None:
+        return 'forwarded.toGenericDict().at(c10::IValue{{"{}"}}).toTensor()'.format(
+            cascade["key"]
+        )
+    return "forwarded.toTensor()"
+
+
+def session_state(settings) -> str:
+    """
+    Impute new state of session returned by the model (if session specified).
+
+    State is element `index` of returned tuple, the last one by default
+    (e.g. `return output, hidden`).
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict
+
+    Returns
+    -------
+    str:
+        Element of forwarded tuple
+    """
+    index = (settings["session"] or {}).get("index")
+    if index is None:
+        return "forwarded.toTuple()->elements().back()"
+    return "forwarded.toTuple()->elements()[{}]".format(index)
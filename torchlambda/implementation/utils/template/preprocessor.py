@@ -0,0 +1,310 @@
+import re
+import typing
+
+_DEFINE = re.compile(r"^\s*#\s*define\s+(\w+)(?:\s+(.*?))?\s*$")
+_DIRECTIVE = re.compile(r"^\s*#\s*(ifdef|ifndef|if|elif|else|endif)\b\s*(.*?)\s*$")
+_MACRO = re.compile(r"defined\s*\(\s*(\w+)\s*\)|defined\s+(\w+)|\b([A-Za-z_]\w*)\b")
+_TOKEN = re.compile(r"\s*(?:(\d+)[uUlL]*|(\w+)|(&&|\|\||==|!=|!|\(|\)))")
+# Alternative tokens of C++ operators
+_ALTERNATIVES = {"and": "&&", "or": "||", "not": "!", "not_eq": "!="}
+_EMPTY_FUNCTION = re.compile(r"^\s*#\s*define\s+(TIMING|INIT_TIMING)\([^)]*\)\s*$")
+
+
+def _substitute(expression: str, macros: typing.Dict[str, typing.Optional[str]]):
+    """
+    Substitute known macros in condition of `#if` or `#elif` directive.
+
+    `defined(NAME)` of known macro becomes `1` or `0`, known macro used
+    as value is replaced by it (`0` if not defined, like C preprocessor does).
+    Other macros (e.g. `__cpp_lib_to_chars`) are left for the compiler.
+
+    Parameters
+    ----------
+    expression : str
+        Condition of the directive, e.g. "defined(STREAMING) && __cpp_lib_to_chars"
+    macros : typing.Dict[str, typing.Optional[str]]
+        Known macros and their values (`None` if not defined)
+
+    Returns
+    -------
+    str:
+        Condition with known macros substituted
+    """
+
+    def _replace(match):
+        defined = match.group(1) or match.group(2)
+        if defined is not None:
+            if defined not in macros:
+                return match.group(0)
+            return "1" if macros[defined] is not None else "0"
+        name = match.group(3)
+        if name not in macros:
+            return name
+        if macros[name] == "":
+            raise ValueError(
+                "Macro {} without value cannot be used as value in #if".format(name)
+            )
+        return macros[name] or "0"
+
+    return _MACRO.sub(_replace, expression)
+
+
+class _Parser:
+    """Evaluator of `#if` conditions with `&&`, `||`, `!`, `==` and `!=`.
+
+    Alternative tokens (`and`, `or`, `not`, `not_eq`) are also accepted.
+
+    Values of unknown macros (and `defined` of them) are `None`, which
+    propagates unless the result does not depend on it (e.g. `0 && X`).
+    """
+
+    def __init__(self, tokens: typing.List[str]):
+        self.tokens = tokens
+        self.position = 0
+
+    def _peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def _take(self, expected=None):
+        token = self._peek()
+        if token is None or (expected is not None and token != expected):
+            raise SyntaxError(token)
+        self.position += 1
+        return token
+
+    def parse(self):
+        value = self._or()
+        if self._peek() is not None:
+            raise SyntaxError(self._peek())
+        return value
+
+    def _or(self):
+        values = [self._and()]
+        while self._peek() == "||":
+            self._take()
+            values.append(self._and())
+        if len(values) == 1:
+            return values[0]
+        if any(value for value in values if value is not None):
+            return 1
+        return None if None in values else 0
+
+    def _and(self):
+        values = [self._equality()]
+        while self._peek() == "&&":
+            self._take()
+            values.append(self._equality())
+        if len(values) == 1:
+            return values[0]
+        if any(value == 0 for value in values if value is not None):
+            return 0
+        return None if None in values else 1
+
+    def _equality(self):
+        value = self._unary()
+        while self._peek() in ("==", "!="):
+            operator, other = self._take(), self._unary()
+            if value is None or other is None:
+                value = None
+            else:
+                value = int((value == other) == (operator == "=="))
+        return value
+
+    def _unary(self):
+        if self._peek() == "!":
+            self._take()
+            value = self._unary()
+            return None if value is None else int(not value)
+        return self._primary()
+
+    def _primary(self):
+        token = self._take()
+        if token == "(":
+            value = self._or()
+            self._take(")")
+            return value
+        if token == "defined":
+            if self._peek() == "(":
+                self._take()
+                self._take()
+                self._take(")")
+            else:
+                self._take()
+            return None
+        if token.isdigit():
+            return int(token)
+        if re.fullmatch(r"[A-Za-z_]\w*", token) is None:
+            raise SyntaxError(token)
+        return None
+
+
+def _tokenize(expression: str) -> typing.List[str]:
+    tokens, position = [], 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN.match(expression, position)
+        if match is None:
+            raise SyntaxError(expression[position:])
+        token = match.group(match.lastindex)
+        tokens.append(_ALTERNATIVES.get(token, token))
+        position = match.end()
+    return tokens
+
+
+def _evaluate(expression: str, macros: typing.Dict[str, typing.Optional[str]]):
+    """
+    Evaluate condition of `#if` directive if it only depends on known macros.
+
+    Parameters
+    ----------
+    expression : str
+        Condition of the directive, e.g. "defined(CACHE) && !defined(STREAMING)"
+    macros : typing.Dict[str, typing.Optional[str]]
+        Known macros and their values (`None` if not defined)
+
+    Returns
+    -------
+    typing.Optional[bool]:
+        Value of condition or `None` if it depends on other macros
+        (e.g. `__cpp_lib_to_chars`) or uses operators other than
+        `&&`, `||`, `!`, `==` and `!=` and has to be left to the compiler
+    """
+    try:
+        value = _Parser(_tokenize(_substitute(expression, macros))).parse()
+    except SyntaxError:
+        return None
+    return None if value is None else bool(value)
+
+
+def _condition(directive: str, argument: str, macros) -> typing.Optional[bool]:
+    if directive == "ifdef":
+        return _evaluate("defined({})".format(argument), macros)
+    if directive == "ifndef":
+        return _evaluate("!defined({})".format(argument), macros)
+    return _evaluate(argument, macros)
+
+
+class _Block:
+    """State of single conditional block (`#if` ... `#endif`).
+
+    Resolved blocks have their directives removed and only the taken
+    branch kept, unresolved ones are kept for the compiler (see `_kept`).
+    """
+
+    def __init__(self, condition: typing.Optional[bool]):
+        self.resolved = condition is not None
+        self.active = bool(condition)
+        self.taken = bool(condition)
+
+
+def _remove_empty_functions(lines: typing.List[str]) -> typing.List[str]:
+    """Remove `TIMING` and `INIT_TIMING` expanding to nothing and their statements."""
+    names = [
+        match.group(1)
+        for match in map(_EMPTY_FUNCTION.match, lines)
+        if match is not None
+    ]
+    if not names:
+        return lines
+    statement = re.compile(r"^\s*(?:{})\([^)]*\);\s*$".format("|".join(names)))
+    return [
+        line
+        for line in lines
+        if _EMPTY_FUNCTION.match(line) is None and statement.match(line) is None
+    ]
+
+
+def _kept(line: str, match, macros) -> str:
+    """Directive line left for the compiler with known macros substituted."""
+    if match.group(1) not in ("if", "elif"):
+        return line
+    return (
+        line[: match.start(2)]
+        + _substitute(match.group(2), macros)
+        + line[match.end(2) :]
+    )
+
+
+def resolve(source: str, names: typing.Iterable[str]) -> str:
+    """
+    Resolve feature switches in source, leaving only active code paths.
+
+    Every macro in `names` is known to be either defined by `#define` present
+    in source (header fields, see `header`) or not defined at all.
+    Conditional blocks depending only on known macros are removed
+    with their inactive branches (also when result does not depend on other
+    macros, e.g. `defined(CACHE) && __cpp_lib_to_chars` without `CACHE`).
+    Others (e.g. checking compiler or platform macros) are left for the compiler
+    with known macros substituted in their directives (`defined(CACHE)` becomes
+    `1` or `0`, known macro used as value is replaced by it).
+
+    Defines of known macros without value are removed (they are only
+    feature switches), ones with value are kept as they are used in code.
+    `TIMING` and `INIT_TIMING` expanding to nothing (without instrumentation)
+    are removed together with statements invoking them.
+    Runs of empty lines left after removal are collapsed.
+
+    Parameters
+    ----------
+    source : str
+        C++ source with header fields and direct insertions already imputed
+    names : typing.Iterable[str]
+        Names of macros controlled by settings
+
+    Returns
+    -------
+    str:
+        Source containing only code paths enabled by settings
+    """
+    macros = {name: None for name in names}
+    for line in source.splitlines():
+        match = _DEFINE.match(line)
+        if match is not None and match.group(1) in macros:
+            macros[match.group(1)] = match.group(2) or ""
+
+    blocks, lines = [], []
+    for line in source.splitlines():
+        emitting = all(block.active for block in blocks if block.resolved)
+        match = _DIRECTIVE.match(line)
+        if match is None:
+            define = _DEFINE.match(line)
+            if define is not None and define.group(1) in macros:
+                if define.group(2) and emitting:
+                    lines.append(line)
+            elif emitting:
+                lines.append(line)
+            continue
+
+        directive, argument = match.groups()
+        if directive in ("if", "ifdef", "ifndef"):
+            blocks.append(_Block(_condition(directive, argument, macros)))
+            if not blocks[-1].resolved and emitting:
+                lines.append(_kept(line, match, macros))
+            continue
+
+        block = blocks[-1]
+        emitting = all(other.active for other in blocks[:-1] if other.resolved)
+        if not block.resolved:
+            if emitting:
+                lines.append(_kept(line, match, macros))
+            if directive == "endif":
+                blocks.pop()
+        elif directive == "elif":
+            condition = _evaluate(argument, macros)
+            if condition is None:
+                raise ValueError(
+                    "#elif depending on unknown macros cannot follow resolved #if: "
+                    "{}".format(line)
+                )
+            block.active = not block.taken and condition
+            block.taken = block.taken or condition
+        elif directive == "else":
+            block.active = not block.taken
+            block.taken = True
+        else:
+            blocks.pop()
+
+    lines = _remove_empty_functions(lines)
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).lstrip("\n") + "\n"
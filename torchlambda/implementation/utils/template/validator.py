@@ -1,4 +1,4 @@
-import collections
+import collections.abc
 
 import cerberus
 
@@ -11,7 +11,7 @@ class Validator(cerberus.Validator):
         {"type": "string"}
         """
         arguments_length = (
-            1 if not isinstance(value, collections.Iterable) else len(value)
+            1 if not isinstance(value, collections.abc.Iterable) else len(value)
         )
         operations_length = (
             1 if isinstance(self.document[other], str) else len(self.document[other])
@@ -25,13 +25,28 @@ class Validator(cerberus.Validator):
             )
 
     def _validate_broadcastable(self, shape_field: str, field, value):
-        """Test whether one field (arguments) is shorter than other (operations).
+        """Test whether normalization values are broadcastable to input shape.
+
+        Input is either top level `input` (for top level `normalize`) or
+        the one containing `normalize` field (for elements of `inputs`).
 
         The rule's arguments are validated against this schema:
         {"type": "string"}
         """
         if isinstance(value, (list, tuple)):
-            shapes = self.root_document["input"][shape_field]
+            if self.document_path[0] == "normalize":
+                # Missing or multiple inputs are reported by their own rules
+                if "input" not in self.root_document:
+                    return
+                shapes = self.root_document["input"][shape_field]
+            else:
+                document = self.root_document
+                for key in self.document_path[:-1]:
+                    document = document[key]
+                # Top level `normalize` of model applies to it's single input
+                if self.document_path[0] == "models" and "input" in document:
+                    document = document["input"]
+                shapes = document[shape_field]
             if len(value) != 1 and len(value) != shapes[1]:
                 self._error(
                     field,
@@ -40,143 +55,921 @@ class Validator(cerberus.Validator):
                     ),
                 )
 
+    def _validate_static_inputs(self, static_inputs: bool, field, value):
+        """Test whether all inputs have static (integer) shape and are not batched.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if static_inputs and value:
+            inputs = self.root_document.get("inputs")
+            if inputs is None:
+                inputs = [self.root_document.get("input", {})]
+            for element in inputs:
+                if element.get("batch") or not all(
+                    isinstance(dimension, int) for dimension in element.get("shape", [])
+                ):
+                    self._error(
+                        field,
+                        "{} requires static (integer) shapes of all inputs without batch".format(
+                            field
+                        ),
+                    )
+                    return
+
+    def _validate_single_request(self, single_request: bool, field, value):
+        """Test whether settings storing per request state are not used with records.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if single_request and value in ("sqs", "kinesis"):
+            for key in ("preallocate", "cache"):
+                if self.root_document.get(key) not in (None, False):
+                    self._error(
+                        field,
+                        "{} cannot be used with {} event".format(key, value),
+                    )
+
+    def _validate_cacheable(self, cacheable: bool, field, value):
+        """Test whether responses can be returned again for repeated requests.
+
+        Cached response is returned as it is, so it cannot contain anything
+        specific to single invocation (e.g. timings of it's stages).
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if cacheable and value is not None:
+            if (self.root_document.get("instrumentation") or {}).get("response"):
+                self._error(field, "cache cannot be used with instrumentation response")
+
+    def _validate_compressible(self, compressible: bool, field, value):
+        """Test whether compression can be applied to requests and responses.
+
+        Compressed requests need base64 input (it's data is decompressed),
+        compressed responses cannot be used with records (failures of
+        records have to be readable) and zstd response needs zstd enabled.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if not compressible or value is None:
+            return
+        inputs = self.root_document.get("inputs")
+        if inputs is None:
+            inputs = [self.root_document.get("input", {})]
+        for model in self.root_document.get("models") or []:
+            inputs = inputs + (model.get("inputs") or [model.get("input", {})])
+        if value.get("request") and not any(
+            element.get("type") == "base64" for element in inputs
+        ):
+            self._error(field, "compressed request requires base64 input")
+        if value.get("response") is not None and self.root_document.get("event") in (
+            "sqs",
+            "kinesis",
+        ):
+            self._error(
+                field,
+                "compressed response cannot be used with {} event".format(
+                    self.root_document.get("event")
+                ),
+            )
+        if value.get("response") == "zstd" and not value.get("zstd"):
+            self._error(field, "zstd response requires zstd: True")
+
+    def _validate_binary_format(self, binary_format: bool, field, value):
+        """Test whether request format other than JSON can be used.
+
+        Binary payloads are carried by API Gateway/Function URL bodies and
+        Kinesis records only (Lambda Invoke and SQS bodies are text).
+        NPY payload is single array of not batched base64 input.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if not binary_format or value == "json":
+            return
+        event = self.root_document.get("event", "direct")
+        if event not in ("apigateway", "kinesis"):
+            self._error(
+                field, "{} format cannot be used with {} event".format(value, event)
+            )
+        if value != "npy":
+            return
+        inputs = self.root_document.get("inputs")
+        if inputs is None:
+            inputs = [self.root_document.get("input", {})]
+        if (
+            len(inputs) != 1
+            or inputs[0].get("type") != "base64"
+            or inputs[0].get("batch")
+        ):
+            self._error(field, "npy format requires single not batched base64 input")
+        if (self.root_document.get("compression") or {}).get("request"):
+            self._error(field, "npy format cannot be used with compressed request")
+
+    def _validate_routable(self, routable: bool, field, value):
+        """Test whether models can be selected by request and loaded lazily.
+
+        Models have to be uniquely named and the routing field cannot
+        clash with data or shape fields of their inputs. Settings keeping
+        state of single model (preallocated buffers, warm-up at initialization)
+        and records events (batches of records spanning models) are not supported.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if not routable or not isinstance(value, list):
+            return
+        names = [model.get("name") for model in value]
+        if len(names) != len(set(names)):
+            self._error(field, "names of models have to be unique")
+        routing = (self.root_document.get("routing") or {}).get("field", "model")
+        for model in value:
+            inputs = model.get("inputs") or [model.get("input") or {}]
+            for element in inputs:
+                if routing == element.get("name") or routing in element.get(
+                    "shape", []
+                ):
+                    self._error(
+                        field,
+                        "routing field {} cannot be data or shape field of input".format(
+                            routing
+                        ),
+                    )
+                    return
+        for key in ("preallocate", "warmup"):
+            if self.root_document.get(key) not in (None, False):
+                self._error(field, "{} cannot be used with multiple models".format(key))
+        if self.root_document.get("event") in ("sqs", "kinesis"):
+            self._error(
+                field,
+                "multiple models cannot be used with {} event".format(
+                    self.root_document.get("event")
+                ),
+            )
+        if self.root_document.get("format") == "npy":
+            self._error(field, "multiple models cannot be used with npy format")
+
+    def _validate_cascadable(self, cascadable: bool, field, value):
+        """Test whether cheaper models can answer request before the model.
+
+        Stages are forwarded whole request (records events split batches
+        across records) and the model is single one (multiple models are
+        selected by request instead). Reported stage cannot clash with
+        names of returned outputs, results and predictions.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if not cascadable or value is None:
+            return
+        if self.root_document.get("models") is not None:
+            self._error(field, "cascade cannot be used with multiple models")
+        if self.root_document.get("event") in ("sqs", "kinesis"):
+            self._error(
+                field,
+                "cascade cannot be used with {} event".format(
+                    self.root_document.get("event")
+                ),
+            )
+        returns = self.root_document.get("returns")
+        if returns is None:
+            returns = [self.root_document.get("return") or {}]
+        names = [
+            element[key].get("name")
+            for element in returns
+            for key in ("output", "result", "predictions")
+            if isinstance(element.get(key), dict)
+        ]
+        if value.get("field") in names:
+            self._error(
+                field,
+                "reported stage {} clashes with returned name".format(value["field"]),
+            )
+
+    def _validate_stateful(self, stateful: bool, field, value):
+        """Test whether state of session can be kept between requests.
+
+        Each request has to be forwarded with the latest state of it's
+        session, so cached responses, cheaper stages of cascade, records
+        events (batches of many sessions), multiple models and warm-up
+        (requests without session) cannot be used. Session field cannot
+        clash with data or shape fields of inputs.
+
+        The model returns tuple with state as one of it's elements, so
+        outputs have to be taken from other elements by `returns` with `index`.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if not stateful or value is None:
+            return
+        for key in ("cache", "cascade", "models", "warmup"):
+            if self.root_document.get(key) not in (None, False):
+                self._error(field, "session cannot be used with {}".format(key))
+        if self.root_document.get("event") in ("sqs", "kinesis"):
+            self._error(
+                field,
+                "session cannot be used with {} event".format(
+                    self.root_document.get("event")
+                ),
+            )
+        inputs = self.root_document.get("inputs") or [
+            self.root_document.get("input") or {}
+        ]
+        session = value.get("field", "session")
+        for element in inputs:
+            if session == element.get("name") or session in element.get("shape", []):
+                self._error(
+                    field,
+                    "session field {} cannot be data or shape field of input".format(
+                        session
+                    ),
+                )
+        returns = self.root_document.get("returns")
+        if returns is None or any(element.get("index") is None for element in returns):
+            self._error(
+                field,
+                "session requires returns with index of tuple element for each",
+            )
+        elif value.get("index") in [element.get("index") for element in returns]:
+            self._error(
+                field,
+                "state (element {}) cannot be returned".format(value["index"]),
+            )
+
+    def _validate_warmup_fields(self, warmup_fields: bool, field, value):
+        """Test whether synthetic warm-up payload can be created for all inputs.
+
+        Every named (dynamic) dimension of inputs has to be provided in
+        `fields` unless payload files are specified.
+
+        The rule's arguments are validated against this schema:
+        {"type": "boolean"}
+        """
+        if warmup_fields and value is not None and value.get("payloads") is None:
+            inputs = self.root_document.get("inputs")
+            if inputs is None:
+                inputs = [self.root_document.get("input", {})]
+            missing = [
+                dimension
+                for element in inputs
+                for dimension in element.get("shape", [])
+                if isinstance(dimension, str)
+                and dimension not in value.get("fields", {})
+            ]
+            if missing:
+                self._error(
+                    field,
+                    "values of shape fields {} have to be provided in fields for synthetic payload".format(
+                        missing
+                    ),
+                )
+
 
 def _is_not_dict(field, value, error):
     if isinstance(value, dict):
         error(field, "field cannot be an instance of dict")
 
 
+def _image_shape(field, value, error):
+    if value.get("type") != "image":
+        return
+    shape = value.get("shape", [])
+    if (
+        len(shape) != 4
+        or not all(isinstance(dimension, int) for dimension in shape)
+        or shape[0] != 1
+        or shape[1] not in (1, 3)
+    ):
+        error(
+            field,
+            "image input requires static shape [1, channels (1 or 3), height, width]",
+        )
+
+
+def _same_batch(field, value, error):
+    if len(set(element["batch"] for element in value)) > 1:
+        error(field, "either all or none of inputs have to be batched")
+
+
+def _unique_names(field, value, error):
+    # Single return is a special case of returns
+    if isinstance(value, dict):
+        value = [value]
+    names = [
+        element[key]["name"]
+        for element in value
+        for key in ("output", "result", "predictions")
+        if element.get(key) is not None
+    ]
+    if len(names) != len(set(names)):
+        error(
+            field,
+            "names of returned outputs, results and predictions have to be unique",
+        )
+
+
+def _encoded_array(field, value, error):
+    if value is not None and value["encoding"] == "base64" and value["item"]:
+        error(field, "only arrays (item: False) can be encoded in base64")
+
+
+def _positive(field, value, error):
+    if value is not None and value <= 0:
+        error(field, "has to be positive")
+
+
+def _normalize():
+    return {
+        "type": "dict",
+        "nullable": True,
+        "schema": {
+            "means": {
+                "required": True,
+                "broadcastable": "shape",
+                "anyof_type": ["list", "number"],
+                "schema": {"type": "number"},
+            },
+            "stddevs": {
+                "required": True,
+                "broadcastable": "shape",
+                "anyof_type": ["list", "number"],
+                "schema": {"type": "number"},
+            },
+        },
+        "default": None,
+    }
+
+
+def _input(multiple: bool):
+    schema = {
+        "name": {"type": "string", "default": "data", "empty": False},
+        "validate": {"type": "boolean", "default": True},
+        "batch": {"type": "boolean", "default": False},
+        "type": {
+            "type": "string",
+            "allowed": [
+                "base64",
+                "image",
+                "byte",
+                "char",
+                "short",
+                "int",
+                "long",
+                "float",
+                "double",
+            ],
+            "required": True,
+        },
+        # Element type of decoded base64 buffer (little-endian), byte if absent
+        "dtype": {
+            "type": "string",
+            "allowed": [
+                "byte",
+                "char",
+                "short",
+                "int",
+                "long",
+                "half",
+                "float",
+                "double",
+            ],
+            "dependencies": {"type": ["base64"]},
+        },
+        "shape": {
+            "type": "list",
+            "schema": {"type": ["string", "integer"]},
+            "required": True,
+            "minlength": 2,
+            "empty": False,
+        },
+        "validate_shape": {"type": "boolean", "default": True},
+        # Shorter side of image is resized to before center crop,
+        # just enough to cover the crop if absent
+        "resize": {"type": "integer", "min": 1, "dependencies": {"type": ["image"]}},
+        "interpolation": {
+            "type": "string",
+            "allowed": ["nearest", "bilinear"],
+            "dependencies": {"type": ["image"]},
+        },
+        "cast": {
+            "type": "string",
+            "allowed": [
+                "byte",
+                "char",
+                "short",
+                "int",
+                "long",
+                "half",
+                "float",
+                "double",
+            ],
+            "nullable": True,
+            "default": None,
+        },
+        "divide": {"type": "number", "nullable": True, "default": None},
+    }
+    # Each of multiple inputs is named explicitly and normalized separately
+    if multiple:
+        schema["name"] = {"type": "string", "required": True, "empty": False}
+        schema["normalize"] = _normalize()
+    return {"type": "dict", "schema": schema, "check_with": _image_shape}
+
+
+def _return():
+    return {
+        "output": {
+            "type": "dict",
+            "nullable": True,
+            "schema": {
+                # Return only single item, not array
+                "name": {"type": "string", "default": "output", "empty": False},
+                "type": {
+                    "type": "string",
+                    "allowed": ["int", "long", "float", "double", "bool"],
+                    "required": True,
+                },
+                "item": {"type": "boolean", "default": False},
+                # Fixed number of decimal places, shortest round-trip if absent
+                "precision": {
+                    "type": "integer",
+                    "min": 0,
+                    "max": 17,
+                    "dependencies": {"type": ["float", "double"]},
+                },
+                # Raw little-endian bytes encoded in base64 instead of JSON array
+                "encoding": {
+                    "type": "string",
+                    "allowed": ["json", "base64"],
+                    "default": "json",
+                },
+                # Element type of encoded bytes, the one of type if absent
+                "dtype": {
+                    "type": "string",
+                    "allowed": ["float16", "float32", "int8", "uint8"],
+                    "dependencies": {"encoding": ["base64"]},
+                },
+            },
+            "check_with": _encoded_array,
+            "default": None,
+        },
+        "result": {
+            "type": "dict",
+            "nullable": True,
+            "schema": {
+                # Return only single item, not array
+                "name": {"type": "string", "default": "result"},
+                "type": {
+                    "type": "string",
+                    "allowed": ["int", "long", "float", "double", "bool"],
+                    "required": True,
+                },
+                "item": {"type": "boolean", "default": False},
+                # Fixed number of decimal places, shortest round-trip if absent
+                "precision": {
+                    "type": "integer",
+                    "min": 0,
+                    "max": 17,
+                    "dependencies": {"type": ["float", "double"]},
+                },
+                # Raw little-endian bytes encoded in base64 instead of JSON array
+                "encoding": {
+                    "type": "string",
+                    "allowed": ["json", "base64"],
+                    "default": "json",
+                },
+                # Element type of encoded bytes, the one of type if absent
+                "dtype": {
+                    "type": "string",
+                    "allowed": ["float16", "float32", "int8", "uint8"],
+                    "dependencies": {"encoding": ["base64"]},
+                },
+                "operations": {
+                    "oneof": [
+                        {
+                            "type": "list",
+                            "schema": {"type": "string", "empty": False},
+                            "empty": False,
+                        },
+                        {"type": "string", "empty": False},
+                    ],
+                    "required": True,
+                },
+                "arguments": {
+                    "is_shorter": "operations",
+                    "check_with": _is_not_dict,
+                    "empty": False,
+                    "dependencies": "operations",
+                    "nullable": True,
+                    "default": None,
+                },
+            },
+            "check_with": _encoded_array,
+            "default": None,
+        },
+        # Classes with highest scores of output (along last dimension)
+        "predictions": {
+            "type": "dict",
+            "nullable": True,
+            "schema": {
+                "name": {"type": "string", "default": "predictions", "empty": False},
+                # Temperature of softmax applied to scores, raw scores if absent
+                "softmax": {
+                    "type": "number",
+                    "check_with": _positive,
+                    "nullable": True,
+                    "default": None,
+                },
+                # Number of classes with highest scores, all if absent
+                "top": {"type": "integer", "min": 1, "nullable": True, "default": None},
+                # Only classes with score at least threshold are returned
+                "threshold": {"type": "number", "nullable": True, "default": None},
+                # Text file with label of each class, one per line
+                "labels": {
+                    "type": "string",
+                    "empty": False,
+                    "nullable": True,
+                    "default": None,
+                },
+                "precision": {
+                    "type": "integer",
+                    "min": 0,
+                    "max": 17,
+                    "nullable": True,
+                    "default": None,
+                },
+            },
+            "default": None,
+        },
+    }
+
+
 # Fix validator
+def _specification(excludes=()):
+    """Inputs and returns of model, either top level or element of `models`."""
+    returns = _return()
+    # Element of tuple (index) or dict (key) returned from forward
+    returns["index"] = {
+        "type": "integer",
+        "min": 0,
+        "required": True,
+        "excludes": "key",
+    }
+    returns["key"] = {
+        "type": "string",
+        "empty": False,
+        "required": True,
+        "excludes": "index",
+    }
+
+    # Normalization of single input, elements of inputs specify their own
+    # (no default, otherwise it would always exclude inputs)
+    normalize = _normalize()
+    del normalize["default"]
+    normalize["excludes"] = ["inputs", *excludes]
+
+    return {
+        # Either single input or list of multiple named inputs
+        "input": {
+            **_input(multiple=False),
+            "required": True,
+            "excludes": ["inputs", *excludes],
+        },
+        "inputs": {
+            "type": "list",
+            "schema": _input(multiple=True),
+            "required": True,
+            "excludes": ["input", *excludes],
+            "empty": False,
+            "check_with": _same_batch,
+        },
+        "normalize": normalize,
+        # Return can be any of result, output and predictions
+        "return": {
+            "type": "dict",
+            "required": True,
+            "excludes": ["returns", *excludes],
+            "schema": _return(),
+            "check_with": _unique_names,
+        },
+        # Multiple returns, one for each element of tuple/dict output
+        "returns": {
+            "type": "list",
+            "required": True,
+            "excludes": ["return", *excludes],
+            "empty": False,
+            "schema": {"type": "dict", "schema": returns},
+            "check_with": _unique_names,
+        },
+    }
+
+
 def get():
     return Validator(
         {
             "grad": {"type": "boolean", "default": False},
             "optimize": {"type": "boolean", "default": False},
             "validate_json": {"type": "boolean", "default": True},
-            "model": {"type": "string", "default": "/opt/model.ptc", "empty": False},
-            "input": {
+            "parser": {
+                "type": "string",
+                "allowed": ["dom", "streaming"],
+                "default": "dom",
+            },
+            # Payload is request itself, API Gateway/Function URL proxy event
+            # or SQS/Kinesis event with request in each record
+            "event": {
+                "type": "string",
+                "allowed": ["direct", "apigateway", "sqs", "kinesis"],
+                "default": "direct",
+                "single_request": True,
+            },
+            # Encoding of request, binary ones carry base64 inputs as raw bytes
+            "format": {
+                "type": "string",
+                "allowed": ["json", "msgpack", "cbor", "npy"],
+                "default": "json",
+                "binary_format": True,
+            },
+            # Maximum number of records forwarded together
+            "records_batch": {"type": "integer", "min": 1, "default": 64},
+            # Allocate storage of inputs and returned tensors once
+            "preallocate": {
+                "type": "boolean",
+                "default": False,
+                "static_inputs": True,
+            },
+            # Requests run through handler during initialization
+            "warmup": {
                 "type": "dict",
+                "nullable": True,
+                "warmup_fields": True,
                 "schema": {
-                    "name": {"type": "string", "default": "data", "empty": False},
-                    "validate": {"type": "boolean", "default": True},
-                    "type": {
-                        "type": "string",
-                        "allowed": [
-                            "base64",
-                            "byte",
-                            "char",
-                            "short",
-                            "int",
-                            "long",
-                            "float",
-                            "double",
-                        ],
-                        "required": True,
-                    },
-                    "shape": {
+                    "iterations": {"type": "integer", "min": 1, "default": 1},
+                    # JSON request files embedded in source, synthetic if absent
+                    "payloads": {
                         "type": "list",
-                        "schema": {"type": ["string", "integer"]},
-                        "required": True,
-                        "minlength": 2,
+                        "schema": {"type": "string", "empty": False},
                         "empty": False,
-                    },
-                    "validate_shape": {"type": "boolean", "default": True},
-                    "cast": {
-                        "type": "string",
-                        "allowed": [
-                            "byte",
-                            "char",
-                            "short",
-                            "int",
-                            "long",
-                            "half",
-                            "float",
-                            "double",
-                        ],
                         "nullable": True,
                         "default": None,
                     },
-                    "divide": {"type": "number", "nullable": True, "default": None},
+                    # Values of shape fields of synthetic payload
+                    "fields": {
+                        "type": "dict",
+                        "keysrules": {"type": "string"},
+                        "valuesrules": {"type": "integer", "min": 1},
+                        "default": {},
+                    },
                 },
+                "default": None,
             },
-            "normalize": {
+            # Number of threads used by libtorch, vCPUs of Lambda if auto
+            "threads": {
                 "type": "dict",
                 "nullable": True,
                 "schema": {
-                    "means": {
-                        "required": True,
-                        "broadcastable": "shape",
-                        "anyof_type": ["list", "number"],
-                        "schema": {"type": "number"},
+                    "intra_op": {
+                        "anyof": [
+                            {"type": "integer", "min": 1},
+                            {"type": "string", "allowed": ["auto"]},
+                        ],
+                        "default": "auto",
                     },
-                    "stddevs": {
-                        "required": True,
-                        "broadcastable": "shape",
-                        "anyof_type": ["list", "number"],
-                        "schema": {"type": "number"},
+                    "inter_op": {
+                        "anyof": [
+                            {"type": "integer", "min": 1},
+                            {"type": "string", "allowed": ["auto"]},
+                        ],
+                        "default": 1,
                     },
                 },
                 "default": None,
             },
-            # Return can be either result, output or both
-            "return": {
+            # LRU cache of responses keyed by hash of inputs data and shape fields
+            "cache": {
                 "type": "dict",
-                "required": True,
+                "nullable": True,
+                "cacheable": True,
                 "schema": {
+                    "entries": {"type": "integer", "min": 1, "default": 1024},
+                    "bytes": {"type": "integer", "min": 1, "default": 67108864},
+                    # Log hits and misses every report lookups, never if 0
+                    "report": {"type": "integer", "min": 0, "default": 100},
+                },
+                "default": None,
+            },
+            # Per stage latency logged in CloudWatch Embedded Metric Format
+            "instrumentation": {
+                "type": "dict",
+                "nullable": True,
+                "schema": {
+                    "namespace": {
+                        "type": "string",
+                        "regex": "[A-Za-z0-9_./#:-]+",
+                        "default": "torchlambda",
+                    },
+                    # Add timings object to response
+                    "response": {"type": "boolean", "default": False},
+                },
+                "default": None,
+            },
+            # Forward of sampled invocations run under libtorch profiler
+            "profiling": {
+                "type": "dict",
+                "nullable": True,
+                "schema": {
+                    "sample": {
+                        "type": "number",
+                        "min": 0,
+                        "max": 1,
+                        "default": 1,
+                    },
+                    # Chrome trace files or logged table of operators
                     "output": {
-                        "type": "dict",
+                        "type": "string",
+                        "allowed": ["trace", "table"],
+                        "default": "table",
+                    },
+                    "directory": {"type": "string", "empty": False, "default": "/tmp"},
+                    "top": {"type": "integer", "min": 1, "default": 20},
+                },
+                "default": None,
+            },
+            # Compressed data of base64 inputs and responses
+            "compression": {
+                "type": "dict",
+                "nullable": True,
+                "compressible": True,
+                "schema": {
+                    # Codec of each sample detected from it's header
+                    "request": {"type": "boolean", "default": False},
+                    # Content-Encoding of response, uncompressed if absent
+                    "response": {
+                        "type": "string",
+                        "allowed": ["gzip", "deflate", "zstd"],
                         "nullable": True,
-                        "schema": {
-                            # Return only single item, not array
-                            "name": {
-                                "type": "string",
-                                "default": "output",
-                                "empty": False,
-                            },
-                            "type": {
-                                "type": "string",
-                                "allowed": ["int", "long", "double", "bool"],
-                                "required": True,
-                            },
-                            "item": {"type": "boolean", "default": False},
-                        },
                         "default": None,
                     },
-                    "result": {
-                        "type": "dict",
+                    # Image built with zstd (torchlambda build --zstd)
+                    "zstd": {"type": "boolean", "default": False},
+                },
+                "default": None,
+            },
+            "model": {"type": "string", "default": "/opt/model.ptc", "empty": False},
+            **_specification(excludes=["models"]),
+            # Named models (each with own inputs and returns) selected by request
+            "models": {
+                "type": "list",
+                "required": True,
+                "excludes": ["input", "inputs", "return", "returns"],
+                "empty": False,
+                "routable": True,
+                "schema": {
+                    "type": "dict",
+                    "schema": {
+                        "name": {"type": "string", "empty": False, "required": True},
+                        "path": {"type": "string", "empty": False, "required": True},
+                        **_specification(),
+                    },
+                },
+            },
+            # Field of request naming model and memory budget of loaded models
+            "routing": {
+                "type": "dict",
+                "schema": {
+                    "field": {"type": "string", "empty": False, "default": "model"},
+                    # Size of parameters and buffers of resident models
+                    "bytes": {"type": "integer", "min": 1, "default": 1073741824},
+                },
+                "default": {},
+            },
+            # Hidden state of recurrent model kept per session between requests
+            "session": {
+                "type": "dict",
+                "nullable": True,
+                "stateful": True,
+                "schema": {
+                    # Request field identifying session
+                    "field": {"type": "string", "empty": False, "default": "session"},
+                    "entries": {"type": "integer", "min": 1, "default": 1024},
+                    # Seconds since last request after which state is dropped
+                    "ttl": {"type": "integer", "min": 1, "default": 300},
+                    # Element of returned tuple with new state, last if not specified
+                    "index": {
+                        "type": "integer",
+                        "min": 0,
                         "nullable": True,
+                        "default": None,
+                    },
+                },
+                "default": None,
+            },
+            # Cheaper models forwarded before the model, first confident answers
+            "cascade": {
+                "type": "dict",
+                "nullable": True,
+                "cascadable": True,
+                "schema": {
+                    "stages": {
+                        "type": "list",
+                        "required": True,
+                        "empty": False,
                         "schema": {
-                            # Return only single item, not array
-                            "name": {"type": "string", "default": "result"},
-                            "type": {
-                                "type": "string",
-                                "allowed": ["int", "long", "double", "bool"],
-                                "required": True,
-                            },
-                            "item": {"type": "boolean", "default": False},
-                            "operations": {
-                                "oneof": [
-                                    {
-                                        "type": "list",
-                                        "schema": {"type": "string", "empty": False},
-                                        "empty": False,
-                                    },
-                                    {"type": "string", "empty": False},
-                                ],
-                                "required": True,
-                            },
-                            "arguments": {
-                                "is_shorter": "operations",
-                                "check_with": _is_not_dict,
-                                "empty": False,
-                                "dependencies": "operations",
-                                "nullable": True,
-                                "default": None,
+                            "type": "dict",
+                            "schema": {
+                                "model": {
+                                    "type": "string",
+                                    "empty": False,
+                                    "required": True,
+                                },
+                                # Max softmax probability or it's top-2 margin
+                                "confidence": {
+                                    "type": "string",
+                                    "allowed": ["probability", "margin"],
+                                    "default": "probability",
+                                },
+                                "threshold": {
+                                    "type": "number",
+                                    "min": 0,
+                                    "max": 1,
+                                    "required": True,
+                                },
                             },
                         },
-                        "default": None,
+                    },
+                    # Logits in element of tuple (index) or dict (key) output
+                    "index": {"type": "integer", "min": 0, "excludes": "key"},
+                    "key": {"type": "string", "empty": False, "excludes": "index"},
+                    # Response field with index of stage which answered
+                    "field": {
+                        "type": "string",
+                        "empty": False,
+                        "nullable": True,
+                        "default": "stage",
                     },
                 },
+                "default": None,
             },
         }
     )
+
+
+def _unify_model(settings):
+    settings = dict(settings)
+    normalize = settings.pop("normalize", None)
+    if "input" in settings:
+        settings["inputs"] = [{**settings.pop("input"), "normalize": normalize}]
+    for element in settings.get("inputs", []):
+        element.setdefault("dtype", None)
+        element.setdefault("resize", None)
+        element.setdefault("interpolation", "bilinear")
+    if "return" in settings:
+        settings["returns"] = [{"index": None, "key": None, **settings.pop("return")}]
+    for element in settings.get("returns", []):
+        element.setdefault("index", None)
+        element.setdefault("key", None)
+        element.setdefault("output", None)
+        element.setdefault("result", None)
+        element.setdefault("predictions", None)
+        for key in ("output", "result"):
+            if element[key] is not None:
+                element[key].setdefault("precision", None)
+                element[key].setdefault("dtype", None)
+    return settings
+
+
+def unify(settings):
+    """
+    Transform single `input` and `return` settings into `inputs` and `returns`.
+
+    Code is generated for each input and return separately, hence
+    single input (with top level `normalize`) and single return (which
+    takes whole tensor returned by network) are special cases of those.
+
+    Each of `models` (if specified) is unified the same way and `inputs`
+    and `returns` of settings become those of all models (so header defines
+    cover every model). `models` is None for single model.
+
+    Parameters
+    ----------
+    settings : typing.Dict
+        YAML parsed to dict and normalized by validator
+
+    Returns
+    -------
+    typing.Dict:
+        Settings with `inputs`, `returns` and `models` fields
+    """
+    settings = _unify_model(settings)
+    if "models" not in settings:
+        settings["models"] = None
+        return settings
+    settings["models"] = [_unify_model(model) for model in settings["models"]]
+    for key in ("inputs", "returns"):
+        settings[key] = [
+            element for model in settings["models"] for element in model[key]
+        ]
+    return settings
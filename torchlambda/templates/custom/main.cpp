@@ -1,3 +1,15 @@
+#include <algorithm>
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <ctime>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <unistd.h>
+
 #include <aws/core/Aws.h>
 #include <aws/core/utils/base64/Base64.h>
 #include <aws/core/utils/json/JsonSerializer.h>
@@ -82,7 +94,112 @@ handler(torch::jit::script::Module &module,
       "application/json");
 }
 
+/*!
+ *
+ *                COLD START BREAKDOWN INSTRUMENTATION
+ *
+ */
+
+/*!
+ * Milliseconds taken by each initialization step in main().
+ *
+ * Time before main() (loader and static initializers, e.g. of whole-archive
+ * linked libtorch) is the difference between process start time
+ * (/proc/self/stat, clock ticks resolution) and entering main().
+ *
+ */
+class InitTimings {
+public:
+  InitTimings() { Add("static_initialization", BeforeMain()); }
+
+  void Mark(const char *step) {
+    const auto now = std::chrono::steady_clock::now();
+    Add(step, std::chrono::duration<double, std::milli>(now - last_).count());
+    last_ = now;
+  }
+
+  /* Add sum of all steps, called once after last mark */
+  void Finish() { steps_.emplace_back("total", total_); }
+
+  /* Print EMF line with init_ prefixed metric of each step */
+  void Emit() const {
+    static const char *function = std::getenv("AWS_LAMBDA_FUNCTION_NAME");
+    const auto timestamp =
+        std::chrono::duration_cast<std::chrono::milliseconds>(
+            std::chrono::system_clock::now().time_since_epoch())
+            .count();
+    std::string line{"{\"_aws\":{\"Timestamp\":"};
+    line.reserve(1024);
+    line.append(std::to_string(timestamp));
+    line.append(",\"CloudWatchMetrics\":[{\"Namespace\":\"torchlambda\","
+                "\"Dimensions\":[[\"FunctionName\"]],\"Metrics\":[");
+    for (std::size_t i = 0; i < steps_.size(); ++i) {
+      if (i != 0)
+        line.push_back(',');
+      line.append("{\"Name\":\"init_");
+      line.append(steps_[i].first);
+      line.append("\",\"Unit\":\"Milliseconds\"}");
+    }
+    line.append("]}]},\"FunctionName\":\"");
+    line.append(function == nullptr ? "torchlambda" : function);
+    line.push_back('"');
+    char value[32];
+    for (const auto &step : steps_) {
+      std::snprintf(value, sizeof(value), "%.3f", step.second);
+      line.append(",\"init_");
+      line.append(step.first);
+      line.append("\":");
+      line.append(value);
+    }
+    line.append("}\n");
+    std::fwrite(line.data(), 1, line.size(), stdout);
+    std::fflush(stdout);
+  }
+
+  /* Print human readable breakdown (local mode) */
+  void Print() const {
+    std::printf("torchlambda:: Initialization breakdown:\n");
+    for (const auto &step : steps_)
+      std::printf("  %-24s %10.3f ms\n", step.first, step.second);
+    std::fflush(stdout);
+  }
+
+private:
+  void Add(const char *step, const double milliseconds) {
+    steps_.emplace_back(step, milliseconds);
+    total_ += milliseconds;
+  }
+
+  static double BeforeMain() {
+    unsigned long long start = 0;
+    if (auto *file = std::fopen("/proc/self/stat", "r")) {
+      char stat[1024];
+      const auto length = std::fread(stat, 1, sizeof(stat) - 1, file);
+      std::fclose(file);
+      stat[length] = '\0';
+      /* Process name may contain spaces, fields are counted after it */
+      const char *field = std::strrchr(stat, ')');
+      for (int index = 2; field != nullptr && index < 22; ++index)
+        field = std::strchr(field + 1, ' ');
+      if (field != nullptr)
+        start = std::strtoull(field + 1, nullptr, 10);
+    }
+    timespec now{};
+    if (start == 0 || clock_gettime(CLOCK_BOOTTIME, &now) != 0)
+      return 0.0;
+    const auto since_boot = now.tv_sec * 1000.0 + now.tv_nsec / 1e6;
+    return std::max(since_boot - start * 1000.0 / sysconf(_SC_CLK_TCK), 0.0);
+  }
+
+  std::chrono::steady_clock::time_point last_ =
+      std::chrono::steady_clock::now();
+  std::vector<std::pair<const char *, double>> steps_;
+  double total_ = 0.0;
+};
+
 int main() {
+  InitTimings init_timings{};
+
   /*!
    *
    *                        LOAD MODEL ON CPU
@@ -94,11 +211,14 @@ int main() {
   torch::NoGradGuard no_grad_guard{};
   /* No optimization during first pass as it might slow down inference by 30s */
   torch::jit::setGraphExecutorOptimize(false);
+  init_timings.Mark("graph_executor");
 
   constexpr auto model_path = "/opt/model.ptc";
 
   torch::jit::script::Module module = torch::jit::load(model_path, torch::kCPU);
+  init_timings.Mark("load");
   module.eval();
+  init_timings.Mark("eval");
 
   /*!
    *
@@ -109,6 +229,7 @@ int main() {
 
   Aws::SDKOptions options;
   Aws::InitAPI(options);
+  init_timings.Mark("aws_init");
   {
     const Aws::Utils::Base64::Base64 transformer{};
     const auto handler_fn =
@@ -116,7 +237,14 @@ int main() {
          &transformer](const aws::lambda_runtime::invocation_request &request) {
           return handler(module, transformer, request);
         };
-    aws::lambda_runtime::run_handler(handler_fn);
+    init_timings.Finish();
+    /* Local mode (no Lambda Runtime API), breakdown is only printed */
+    if (std::getenv("AWS_LAMBDA_RUNTIME_API") == nullptr)
+      init_timings.Print();
+    else {
+      init_timings.Emit();
+      aws::lambda_runtime::run_handler(handler_fn);
+    }
   }
   Aws::ShutdownAPI(options);
   return 0;
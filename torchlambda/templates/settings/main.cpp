@@ -8,76 +8,2806 @@
 
 {BASE64}
 
-{VALIDATE_FIELD}
+{BATCH}
+
+{STREAMING}
 
 {VALIDATE_SHAPE}
 
-{NORMALIZE}
+{PREALLOCATE}
+
+{WARMUP}
+
+{INTRA_OP_THREADS}
+
+{INTER_OP_THREADS}
+
+{CACHE}
+
+{CACHE_BYTES}
+
+{CACHE_REPORT}
+
+{INSTRUMENTATION}
+
+{INSTRUMENTATION_RESPONSE}
+
+{PROFILING}
+
+{PROFILING_TRACE}
+
+{PROFILING_TOP}
+
+{PREDICTIONS}
+
+{APIGATEWAY}
+
+{APIGATEWAY_BINARY}
+
+{RECORDS}
+
+{KINESIS}
+
+{REQUEST_COMPRESSION}
+
+{RESPONSE_COMPRESSION}
+
+{ZSTD}
+
+{IMAGE}
+
+{FORMAT}
+
+{MSGPACK}
+
+{CBOR}
+
+{NPY}
+
+{MODELS}
+
+{MODELS_BYTES}
+
+{CASCADE}
+
+{CASCADE_FIELD}
+
+{SESSION}
+
+{SESSION_FIELD}
+
+{SESSION_TTL}
+
+#include <string> /* To use for InvalidJson return if any of shape fields not provided */
+
+#include <algorithm>
+#include <charconv>
+#include <cmath>
+#include <cstdint>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <functional>
+#include <initializer_list>
+#include <iterator>
+#include <limits>
+#include <type_traits>
+#include <vector>
+
+#if defined(STREAMING) || defined(RESPONSE_COMPRESSION)
+#include <string_view>
+#endif
+#ifdef BASE64
+#include <array>
+#endif
+#if defined(WARMUP) || defined(INSTRUMENTATION) || defined(SESSION)
+#include <chrono>
+#endif
+#if defined(INTRA_OP_THREADS) || defined(INTER_OP_THREADS)
+#include <thread>
+#endif
+#if defined(CACHE) || defined(MODELS) || defined(SESSION)
+#include <list>
+#endif
+#if defined(CACHE) || defined(SESSION) || (defined(PROFILING) && !defined(PROFILING_TRACE))
+#include <unordered_map>
+#endif
+#ifdef PROFILING
+#include <random>
+#include <sstream>
+#endif
+#ifdef PREDICTIONS
+#include <fstream>
+#endif
+#ifdef IMAGE
+#include <memory>
+#endif
+#if defined(INSTRUMENTATION) || defined(PROFILING_TRACE)
+#include <ctime>
+
+#include <unistd.h>
+#endif
+#ifdef MODELS
+#include <sys/stat.h>
+#endif
+#if defined(REQUEST_COMPRESSION) || defined(RESPONSE_COMPRESSION)
+#include <zlib.h>
+#endif
+#ifdef ZSTD
+#include <zstd.h>
+#endif
+#ifdef IMAGE
+/* Single header decoder compiled into deployment, only JPEG and PNG */
+#define STBI_ONLY_JPEG
+#define STBI_ONLY_PNG
+#define STBI_NO_STDIO
+#define STB_IMAGE_IMPLEMENTATION
+#include <stb_image.h>
+#endif
+
+#include <aws/core/Aws.h>
+#if !defined(STREAMING) || (defined(PROFILING) && !defined(PROFILING_TRACE))
+#include <aws/core/utils/json/JsonSerializer.h>
+#endif
+#include <aws/core/utils/memory/stl/AWSString.h>
+
+#include <aws/lambda-runtime/runtime.h>
+
+#include <torch/script.h>
+#include <torch/torch.h>
+
+#ifdef PROFILING
+#include <torch/csrc/autograd/profiler.h>
+#endif
+
+#ifdef STREAMING
+/*!
+ *
+ *            DOM-FREE STREAMING PARSER FOR REQUEST PAYLOAD
+ *
+ */
+
+namespace stream {{
+
+static const char *skip_whitespace(const char *current, const char *end) {{
+  while (current != end && (*current == ' ' || *current == '\n' ||
+                            *current == '\r' || *current == '\t'))
+    ++current;
+  return current;
+}}
+
+/* Return pointer past the value starting at current, nullptr if malformed */
+static const char *skip_value(const char *current, const char *end) {{
+  if (current == end)
+    return nullptr;
+  if (*current == '"') {{
+    for (++current; current != end; ++current) {{
+      if (*current == '\\') {{
+        if (++current == end)
+          return nullptr;
+      }} else if (*current == '"')
+        return current + 1;
+    }}
+    return nullptr;
+  }}
+  if (*current == '[' || *current == '{{') {{
+    std::size_t depth = 0;
+    while (current != end) {{
+      if (*current == '"') {{
+        current = skip_value(current, end);
+        if (current == nullptr)
+          return nullptr;
+        continue;
+      }}
+      if (*current == '[' || *current == '{{')
+        ++depth;
+      else if ((*current == ']' || *current == '}}') && --depth == 0)
+        return current + 1;
+      ++current;
+    }}
+    return nullptr;
+  }}
+  /* Number or literal, ends at separator or whitespace */
+  const auto *begin = current;
+  while (current != end && *current != ',' && *current != ']' &&
+         *current != '}}' && skip_whitespace(current, end) == current)
+    ++current;
+  return current == begin ? nullptr : current;
+}}
+
+/* Parse single number, return pointer past it or nullptr on failure */
+template <typename T>
+static const char *parse_number(const char *first, const char *last, T &value) {{
+  if constexpr (std::is_integral<T>::value) {{
+    const auto [pointer, error] = std::from_chars(first, last, value);
+    return error == std::errc{{}} ? pointer : nullptr;
+  }} else {{
+#ifdef __cpp_lib_to_chars
+    const auto [pointer, error] = std::from_chars(first, last, value);
+    return error == std::errc{{}} ? pointer : nullptr;
+#else
+    /* Payload is null terminated, hence strtod stops at the latest there */
+    char *pointer = nullptr;
+    value = static_cast<T>(std::strtod(first, &pointer));
+    return pointer == first ? nullptr : pointer;
+#endif
+  }}
+}}
+
+class Array;
+
+/*!
+ * Non-owning view over part of request payload.
+ *
+ * Mimics subset of Aws::Utils::Json::JsonView used by the handler.
+ * Top level object has it's fields indexed once (values are only skipped,
+ * not parsed), everything else is parsed lazily and only when requested.
+ * No DOM nodes are allocated for numeric arrays, numbers are parsed straight
+ * into caller provided buffer.
+ *
+ */
+class JsonView {{
+public:
+  /* Index top level fields of payload in single pass */
+  explicit JsonView(const std::string_view payload)
+      : begin_{{payload.data()}}, end_{{payload.data() + payload.size()}} {{
+    auto current = skip_whitespace(begin_, end_);
+    if (current == end_ || *current != '{{')
+      return;
+    current = skip_whitespace(current + 1, end_);
+    if (current != end_ && *current == '}}') {{
+      valid_ = true;
+      return;
+    }}
+    while (current != end_ && *current == '"') {{
+      const auto *key_end = skip_value(current, end_);
+      if (key_end == nullptr)
+        return;
+      const auto *value_begin = skip_whitespace(key_end, end_);
+      if (value_begin == end_ || *value_begin != ':')
+        return;
+      value_begin = skip_whitespace(value_begin + 1, end_);
+      const auto *value_end = skip_value(value_begin, end_);
+      if (value_end == nullptr)
+        return;
+      fields_.push_back({{current + 1, key_end - 1, value_begin, value_end}});
+
+      current = skip_whitespace(value_end, end_);
+      if (current != end_ && *current == '}}') {{
+        valid_ = true;
+        return;
+      }}
+      if (current == end_ || *current != ',')
+        return;
+      current = skip_whitespace(current + 1, end_);
+    }}
+  }}
+
+  JsonView(const char *begin, const char *end)
+      : begin_{{begin}}, end_{{end}}, valid_{{begin != nullptr}} {{}}
+
+  bool WasParseSuccessful() const {{ return valid_; }}
+
+  bool KeyExists(const Aws::String &key) const {{
+    return Find(key) != fields_.end();
+  }}
+
+  JsonView GetObject(const Aws::String &key) const {{
+    const auto field = Find(key);
+    if (field == fields_.end())
+      return {{nullptr, nullptr}};
+    return {{field->value_begin, field->value_end}};
+  }}
+
+  int GetInteger(const Aws::String &key) const {{
+    return GetObject(key).AsInteger();
+  }}
+
+  bool IsString() const {{ return begin_ != end_ && *begin_ == '"'; }}
+
+  bool IsListType() const {{ return begin_ != end_ && *begin_ == '['; }}
+
+  bool IsIntegerType() const {{
+    int64_t value;
+    return begin_ != end_ && parse_number(begin_, end_, value) == end_;
+  }}
+
+  int AsInteger() const {{ return AsNumber<int>(); }}
+
+  int64_t AsInt64() const {{ return AsNumber<int64_t>(); }}
+
+  double AsDouble() const {{ return AsNumber<double>(); }}
+
+  /* Value of string with escape sequences replaced (\u as UTF-8) */
+  Aws::String AsString() const {{
+    Aws::String value;
+    if (!IsString())
+      return value;
+    value.reserve(static_cast<std::size_t>(end_ - begin_));
+    const auto *last = end_ - 1;
+    for (const auto *current = begin_ + 1; current < last; ++current) {{
+      if (*current != '\\') {{
+        value.push_back(*current);
+        continue;
+      }}
+      switch (*++current) {{
+      case 'b':
+        value.push_back('\b');
+        break;
+      case 'f':
+        value.push_back('\f');
+        break;
+      case 'n':
+        value.push_back('\n');
+        break;
+      case 'r':
+        value.push_back('\r');
+        break;
+      case 't':
+        value.push_back('\t');
+        break;
+      case 'u': {{
+        auto code = CodeUnit(current + 1, last);
+        current += 4;
+        /* Surrogate pair encodes single code point */
+        if (code >= 0xD800 && code < 0xDC00 && current + 2 < last &&
+            current[1] == '\\' && current[2] == 'u') {{
+          const auto low = CodeUnit(current + 3, last);
+          if (low >= 0xDC00 && low < 0xE000) {{
+            code = 0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00);
+            current += 6;
+          }}
+        }}
+        AppendUtf8(value, code);
+        break;
+      }}
+      default:
+        value.push_back(*current);
+      }}
+    }}
+    return value;
+  }}
+
+  /* Unparsed text of value */
+  std::string_view Raw() const {{
+    return {{begin_, static_cast<std::size_t>(end_ - begin_)}};
+  }}
+
+  /* Elements of array, used for batches only (values are not parsed) */
+  Array AsArray() const;
+
+  /* Number of elements of flat numeric array (single vectorizable pass) */
+  std::size_t Count() const {{
+    if (!IsListType() || *skip_whitespace(begin_ + 1, end_) == ']')
+      return 0;
+    return static_cast<std::size_t>(std::count(begin_, end_, ',')) + 1;
+  }}
+
+  /* Parse flat numeric array into buffer, unparsable elements become 0 */
+  template <typename T> void ParseInto(T *output, const int64_t length) const {{
+    auto *const last = output + length;
+    auto current = skip_whitespace(begin_ + 1, end_);
+    while (output != last && current != end_ && *current != ']') {{
+      const auto *next = parse_number(current, end_, *output);
+      if (next == nullptr) {{
+        *output = 0;
+        next = std::find_if(current, end_,
+                            [](const char c) {{ return c == ',' || c == ']'; }});
+      }}
+      ++output;
+      current = skip_whitespace(next, end_);
+      if (current != end_ && *current == ',')
+        current = skip_whitespace(current + 1, end_);
+    }}
+    std::fill(output, last, T{{}});
+  }}
+
+#if defined(APIGATEWAY) || defined(RECORDS)
+  /* Index fields of object value (e.g. headers of proxy event) */
+  JsonView AsObject() const {{ return JsonView{{Raw()}}; }}
+
+#endif
+#ifdef APIGATEWAY
+  /* Add field with value of other view, key has to outlive this view */
+  void Insert(const char *key, const JsonView &value) {{
+    fields_.push_back({{key, key + std::strlen(key), value.begin_, value.end_}});
+  }}
+
+  /* Add fields of other indexed object, quotes of string values are skipped */
+  void Merge(const JsonView &object) {{
+    for (auto field : object.fields_) {{
+      if (field.value_end - field.value_begin >= 2 && *field.value_begin == '"') {{
+        ++field.value_begin;
+        --field.value_end;
+      }}
+      fields_.push_back(field);
+    }}
+  }}
+#endif
+
+private:
+  struct Field {{
+    const char *key_begin;
+    const char *key_end;
+    const char *value_begin;
+    const char *value_end;
+  }};
+
+  std::vector<Field>::const_iterator Find(const Aws::String &key) const {{
+    return std::find_if(fields_.begin(), fields_.end(), [&key](const Field &field) {{
+      return static_cast<std::size_t>(field.key_end - field.key_begin) ==
+                 key.size() &&
+             std::equal(field.key_begin, field.key_end, key.begin());
+    }});
+  }}
+
+  /* Value of four hexadecimal digits of \u escape, 0xFFFD if malformed */
+  static uint32_t CodeUnit(const char *first, const char *last) {{
+    uint32_t code = 0;
+    if (last - first < 4 ||
+        std::from_chars(first, first + 4, code, 16).ptr != first + 4)
+      return 0xFFFD;
+    return code;
+  }}
+
+  static void AppendUtf8(Aws::String &value, const uint32_t code) {{
+    if (code < 0x80) {{
+      value.push_back(static_cast<char>(code));
+    }} else if (code < 0x800) {{
+      value.push_back(static_cast<char>(0xC0 | code >> 6));
+      value.push_back(static_cast<char>(0x80 | (code & 0x3F)));
+    }} else if (code < 0x10000) {{
+      value.push_back(static_cast<char>(0xE0 | code >> 12));
+      value.push_back(static_cast<char>(0x80 | (code >> 6 & 0x3F)));
+      value.push_back(static_cast<char>(0x80 | (code & 0x3F)));
+    }} else {{
+      value.push_back(static_cast<char>(0xF0 | code >> 18));
+      value.push_back(static_cast<char>(0x80 | (code >> 12 & 0x3F)));
+      value.push_back(static_cast<char>(0x80 | (code >> 6 & 0x3F)));
+      value.push_back(static_cast<char>(0x80 | (code & 0x3F)));
+    }}
+  }}
+
+  template <typename T> T AsNumber() const {{
+    T value{{}};
+    if (begin_ == end_ || parse_number(begin_, end_, value) == nullptr)
+      return T{{}};
+    return value;
+  }}
+
+  const char *begin_ = nullptr;
+  const char *end_ = nullptr;
+  bool valid_ = false;
+  std::vector<Field> fields_;
+}};
+
+/* Mimics Aws::Utils::Array interface used by the handler */
+class Array : public std::vector<JsonView> {{
+public:
+  std::size_t GetLength() const {{ return size(); }}
+}};
+
+inline Array JsonView::AsArray() const {{
+  Array elements;
+  if (!IsListType())
+    return elements;
+  auto current = skip_whitespace(begin_ + 1, end_);
+  while (current != end_ && *current != ']') {{
+    const auto *element_end = skip_value(current, end_);
+    if (element_end == nullptr)
+      break;
+    elements.emplace_back(current, element_end);
+    current = skip_whitespace(element_end, end_);
+    if (current != end_ && *current == ',')
+      current = skip_whitespace(current + 1, end_);
+  }}
+  return elements;
+}}
+
+}} // namespace stream
+#endif
+
+#ifdef FORMAT
+/*!
+ *
+ *           BINARY REQUEST FORMATS (MESSAGEPACK, CBOR, NPY)
+ *
+ */
+
+namespace binary {{
+
+enum class Kind {{ invalid, integer, floating, bytes, text, array, map, other }};
+
+/* Header of single encoded item */
+struct Item {{
+  Kind kind = Kind::invalid;
+  /* Bytes of string or first element of container */
+  const char *payload = nullptr;
+  /* Past scalar or string, the same as payload for containers */
+  const char *next = nullptr;
+  /* Bytes of string, elements (pairs for maps) of container */
+  uint64_t length = 0;
+  int64_t integer = 0;
+  double floating = 0;
+}};
+
+#ifndef NPY
+/* Unsigned big-endian integer of size bytes */
+static uint64_t big_endian(const char *bytes, const int size) {{
+  uint64_t value = 0;
+  for (int i = 0; i < size; ++i)
+    value = value << 8 | static_cast<unsigned char>(bytes[i]);
+  return value;
+}}
+
+/* Floating point value of big-endian IEEE 754 bits */
+template <typename Float, typename Bits> static double to_floating(Bits bits) {{
+  Float value;
+  std::memcpy(&value, &bits, sizeof(value));
+  return static_cast<double>(value);
+}}
+
+/* Finish string or container item, false if it does not fit into payload */
+static bool sized(Item &item, const Kind kind, const uint64_t length,
+                  const char *current, const char *end) {{
+  const auto available = static_cast<uint64_t>(end - current);
+  item.kind = kind;
+  item.length = length;
+  item.payload = current;
+  if (kind == Kind::array || kind == Kind::map) {{
+    /* Each element takes at least one byte */
+    item.next = current;
+    return length <= available && (kind == Kind::array || length <= available / 2);
+  }}
+  item.next = current + std::min(length, available);
+  return length <= available;
+}}
+#endif
+
+#ifdef MSGPACK
+/* Read header of MessagePack item starting at current */
+static bool read_item(const char *current, const char *end, Item &item) {{
+  if (current == end)
+    return false;
+  const auto byte = static_cast<unsigned char>(*current++);
+  const auto available = end - current;
+  /* Big-endian argument of size bytes following type byte */
+  const auto argument = [&](const int size, uint64_t &value) {{
+    if (available < size)
+      return false;
+    value = big_endian(current, size);
+    current += size;
+    return true;
+  }};
+  uint64_t value = 0;
+  item.next = current;
+  if (byte <= 0x7F || byte >= 0xE0) {{
+    item.kind = Kind::integer;
+    item.integer = static_cast<int8_t>(byte);
+    return true;
+  }}
+  if ((byte & 0xF0) == 0x80)
+    return sized(item, Kind::map, byte & 0x0F, current, end);
+  if ((byte & 0xF0) == 0x90)
+    return sized(item, Kind::array, byte & 0x0F, current, end);
+  if ((byte & 0xE0) == 0xA0)
+    return sized(item, Kind::text, byte & 0x1F, current, end);
+  switch (byte) {{
+  case 0xC0: /* nil, false, true */
+  case 0xC2:
+  case 0xC3:
+    item.kind = Kind::other;
+    return true;
+  case 0xC4: /* bin 8, 16, 32 */
+  case 0xC5:
+  case 0xC6:
+    return argument(1 << (byte - 0xC4), value) &&
+           sized(item, Kind::bytes, value, current, end);
+  case 0xC7: /* ext 8, 16, 32 (length excludes type byte) */
+  case 0xC8:
+  case 0xC9:
+    return argument(1 << (byte - 0xC7), value) &&
+           sized(item, Kind::other, value + 1, current, end);
+  case 0xCA:
+    if (!argument(4, value))
+      return false;
+    item.kind = Kind::floating;
+    item.floating = to_floating<float>(static_cast<uint32_t>(value));
+    item.next = current;
+    return true;
+  case 0xCB:
+    if (!argument(8, value))
+      return false;
+    item.kind = Kind::floating;
+    item.floating = to_floating<double>(value);
+    item.next = current;
+    return true;
+  case 0xCC: /* uint 8, 16, 32, 64 */
+  case 0xCD:
+  case 0xCE:
+  case 0xCF:
+    if (!argument(1 << (byte - 0xCC), value))
+      return false;
+    item.kind = Kind::integer;
+    item.integer = static_cast<int64_t>(value);
+    item.next = current;
+    return true;
+  case 0xD0: /* int 8, 16, 32, 64 (sign extended) */
+  case 0xD1:
+  case 0xD2:
+  case 0xD3: {{
+    const auto size = 1 << (byte - 0xD0);
+    if (!argument(size, value))
+      return false;
+    const auto shift = 64 - 8 * size;
+    item.kind = Kind::integer;
+    item.integer = static_cast<int64_t>(value << shift) >> shift;
+    item.next = current;
+    return true;
+  }}
+  case 0xD4: /* fixext 1, 2, 4, 8, 16 (and type byte) */
+  case 0xD5:
+  case 0xD6:
+  case 0xD7:
+  case 0xD8:
+    return sized(item, Kind::other, (1 << (byte - 0xD4)) + 1, current, end);
+  case 0xD9: /* str 8, 16, 32 */
+  case 0xDA:
+  case 0xDB:
+    return argument(1 << (byte - 0xD9), value) &&
+           sized(item, Kind::text, value, current, end);
+  case 0xDC: /* array 16, 32 */
+  case 0xDD:
+    return argument(2 << (byte - 0xDC), value) &&
+           sized(item, Kind::array, value, current, end);
+  case 0xDE: /* map 16, 32 */
+  case 0xDF:
+    return argument(2 << (byte - 0xDE), value) &&
+           sized(item, Kind::map, value, current, end);
+  default:
+    return false;
+  }}
+}}
+#endif
+
+#ifdef CBOR
+/* Value of IEEE 754 half precision bits */
+static double half_to_double(const uint64_t bits) {{
+  const auto exponent = static_cast<int>(bits >> 10 & 0x1F);
+  const auto mantissa = static_cast<double>(bits & 0x3FF);
+  const auto magnitude =
+      exponent == 0    ? std::ldexp(mantissa, -24)
+      : exponent == 31 ? (mantissa == 0 ? std::numeric_limits<double>::infinity()
+                                        : std::numeric_limits<double>::quiet_NaN())
+                       : std::ldexp(mantissa + 1024, exponent - 25);
+  return bits & 0x8000 ? -magnitude : magnitude;
+}}
+
+/* Read header of CBOR item starting at current, tags are skipped */
+static bool read_item(const char *current, const char *end, Item &item) {{
+  unsigned char byte = 0;
+  uint64_t argument = 0;
+  /* Tags (major type 6) only annotate item following them */
+  do {{
+    if (current == end)
+      return false;
+    byte = static_cast<unsigned char>(*current++);
+    argument = byte & 0x1F;
+    if (argument >= 24) {{
+      /* Indefinite lengths (31) and reserved values are not supported */
+      const auto size = argument > 27 ? 0 : 1 << (argument - 24);
+      if (size == 0 || end - current < size)
+        return false;
+      argument = big_endian(current, size);
+      current += size;
+    }}
+  }} while (byte >> 5 == 6);
+  const auto major = byte >> 5;
+  const auto info = byte & 0x1F;
+  item.next = current;
+  switch (major) {{
+  case 0:
+    item.kind = Kind::integer;
+    item.integer = static_cast<int64_t>(argument);
+    return true;
+  case 1:
+    item.kind = Kind::integer;
+    /* -1 - argument without overflow */
+    item.integer = static_cast<int64_t>(~argument);
+    return true;
+  case 2:
+    return sized(item, Kind::bytes, argument, current, end);
+  case 3:
+    return sized(item, Kind::text, argument, current, end);
+  case 4:
+    return sized(item, Kind::array, argument, current, end);
+  case 5:
+    return sized(item, Kind::map, argument, current, end);
+  default:
+    item.kind = info >= 25 && info <= 27 ? Kind::floating : Kind::other;
+    item.floating = info == 25   ? half_to_double(argument)
+                    : info == 26 ? to_floating<float>(static_cast<uint32_t>(argument))
+                                 : to_floating<double>(argument);
+    return true;
+  }}
+}}
+#endif
+
+#ifdef NPY
+/* NPY payload has no encoded items, it's fields are created from header */
+static bool read_item(const char *, const char *, Item &) {{ return false; }}
+#endif
+
+/* Return pointer past item starting at current, nullptr if malformed */
+static const char *skip_item(const char *current, const char *end) {{
+  uint64_t remaining = 1;
+  while (remaining != 0) {{
+    Item item;
+    if (!read_item(current, end, item))
+      return nullptr;
+    current = item.next;
+    --remaining;
+    if (item.kind == Kind::array)
+      remaining += item.length;
+    else if (item.kind == Kind::map)
+      remaining += 2 * item.length;
+  }}
+  return current;
+}}
+
+class Array;
+
+/*!
+ * Non-owning view over part of binary request payload.
+ *
+ * Mimics interface of streaming JSON view (hence handler is generated
+ * the same way for every format). Top level map has it's fields indexed
+ * once, values are decoded only when requested.
+ * Binary strings (raw little-endian bytes of base64 inputs) are used
+ * in place, numeric arrays are parsed straight into tensors.
+ *
+ * NPY payload is single array of NPY input, it's dimensions (named
+ * in input's shape) are available as fields.
+ *
+ */
+class View {{
+public:
+#ifdef NPY
+  /* Parse NPY header, data and dimensions become fields */
+  explicit View(const std::string_view payload) {{
+    /* Names of dimensions of NPY input, empty for static ones */
+    static const char *const names[]{{{NPY_DIMENSIONS}}};
+    if (payload.size() < 10 || payload.compare(0, 6, "\x93NUMPY") != 0)
+      return;
+    const auto version = static_cast<unsigned char>(payload[6]);
+    const auto size = version == 1 ? 2 : 4;
+    if (payload.size() < static_cast<std::size_t>(8 + size))
+      return;
+    std::size_t length = 0;
+    for (int i = size - 1; i >= 0; --i)
+      length = length << 8 | static_cast<unsigned char>(payload[8 + i]);
+    if (payload.size() < 8 + size + length)
+      return;
+    const auto header = payload.substr(8 + size, length);
+    const auto data = payload.substr(8 + size + length);
+
+    /* Only C ordered arrays of input's type are accepted */
+    const auto descr = header.find("'descr':");
+    if (descr == std::string_view::npos ||
+        header.find("'{NPY_DESCR}'", descr) == std::string_view::npos ||
+        header.find("'fortran_order': False") == std::string_view::npos)
+      return;
+    auto current = header.find("'shape':");
+    if (current == std::string_view::npos ||
+        (current = header.find('(', current)) == std::string_view::npos)
+      return;
+    const auto last = header.find(')', current);
+    if (last == std::string_view::npos)
+      return;
+
+    fields_.push_back({{NPY, NPY + std::strlen(NPY), data.data(),
+                       data.data() + data.size(), Kind::bytes}});
+    std::size_t dimension = 0;
+    for (++current; current < last; ++current) {{
+      if (header[current] < '0' || header[current] > '9')
+        continue;
+      const auto *first = header.data() + current;
+      int64_t value = 0;
+      const auto *digits_end =
+          std::from_chars(first, header.data() + last, value).ptr;
+      if (dimension == std::size(names))
+        return;
+      const auto *name = names[dimension++];
+      if (*name != '\0')
+        fields_.push_back(
+            {{name, name + std::strlen(name), first, digits_end, Kind::integer}});
+      current = static_cast<std::size_t>(digits_end - header.data());
+    }}
+    valid_ = dimension == std::size(names);
+  }}
+#else
+  /* Index fields of top level map in single pass */
+  explicit View(const std::string_view payload) {{
+    const auto *current = payload.data();
+    const auto *end = payload.data() + payload.size();
+    Item map;
+    if (!read_item(current, end, map) || map.kind != Kind::map)
+      return;
+    current = map.next;
+    for (uint64_t pair = 0; pair < map.length; ++pair) {{
+      Item key;
+      if (!read_item(current, end, key) ||
+          (key.kind != Kind::text && key.kind != Kind::bytes))
+        return;
+      const auto *value_end = skip_item(key.next, end);
+      if (value_end == nullptr)
+        return;
+      fields_.push_back({{key.payload, key.next, key.next, value_end}});
+      current = value_end;
+    }}
+    valid_ = true;
+  }}
+#endif
+
+  /* Single encoded value */
+  View(const char *begin, const char *end) : begin_{{begin}}, end_{{end}} {{
+    Item item;
+    if (begin == nullptr || !read_item(begin, end, item))
+      return;
+    kind_ = item.kind;
+    payload_ = item.payload;
+    length_ = item.length;
+    integer_ = item.integer;
+    floating_ = item.floating;
+    valid_ = true;
+  }}
+
+  bool WasParseSuccessful() const {{ return valid_; }}
+
+  bool KeyExists(const Aws::String &key) const {{
+    return Find(key) != fields_.end();
+  }}
+
+  View GetObject(const Aws::String &key) const {{
+    const auto field = Find(key);
+    if (field == fields_.end())
+      return {{nullptr, nullptr}};
+    if (field->kind == Kind::invalid)
+      return {{field->value_begin, field->value_end}};
+    return {{field->kind, field->value_begin, field->value_end}};
+  }}
+
+  int GetInteger(const Aws::String &key) const {{
+    return GetObject(key).AsInteger();
+  }}
+
+  /* Text or binary string (raw bytes of base64 inputs) */
+  bool IsString() const {{ return kind_ == Kind::bytes || kind_ == Kind::text; }}
+
+  bool IsListType() const {{ return kind_ == Kind::array; }}
+
+  bool IsIntegerType() const {{ return kind_ == Kind::integer; }}
+
+  int AsInteger() const {{ return AsNumber<int>(); }}
+
+  int64_t AsInt64() const {{ return AsNumber<int64_t>(); }}
+
+  double AsDouble() const {{ return AsNumber<double>(); }}
+
+  /* Encoded value (used as part of cache key) */
+  std::string_view Raw() const {{
+    return {{begin_, static_cast<std::size_t>(end_ - begin_)}};
+  }}
+
+  /* Bytes of string, used in place without copying */
+  std::string_view Bytes() const {{
+    if (!IsString())
+      return {{}};
+    return {{payload_, static_cast<std::size_t>(length_)}};
+  }}
+
+  /* Copy of string item (e.g. name of served model) */
+  Aws::String AsString() const {{
+    const auto bytes = Bytes();
+    return {{bytes.data(), bytes.size()}};
+  }}
+
+  /* Elements of array, used for batches only (values are not decoded) */
+  Array AsArray() const;
+
+  /* Number of elements of numeric array */
+  std::size_t Count() const {{
+    return IsListType() ? static_cast<std::size_t>(length_) : 0;
+  }}
+
+  /* Decode numeric array into buffer, non-numeric elements become 0 */
+  template <typename T> void ParseInto(T *output, const int64_t length) const {{
+    auto *const last = output + length;
+    const auto *current = payload_;
+    for (uint64_t element = 0; element < Count() && output != last;
+         ++element, ++output) {{
+      Item item;
+      if (!read_item(current, end_, item))
+        break;
+      *output = item.kind == Kind::integer    ? static_cast<T>(item.integer)
+                : item.kind == Kind::floating ? static_cast<T>(item.floating)
+                                              : T{{}};
+      current = item.kind == Kind::integer || item.kind == Kind::floating
+                    ? item.next
+                    : skip_item(current, end_);
+      if (current == nullptr) {{
+        ++output;
+        break;
+      }}
+    }}
+    std::fill(output, last, T{{}});
+  }}
+
+private:
+  struct Field {{
+    const char *key_begin;
+    const char *key_end;
+    const char *value_begin;
+    const char *value_end;
+    /* Kind of unencoded value (NPY fields), invalid for encoded ones */
+    Kind kind = Kind::invalid;
+  }};
+
+  /* Unencoded value, either bytes or digits of integer */
+  View(const Kind kind, const char *begin, const char *end)
+      : begin_{{begin}}, end_{{end}}, payload_{{begin}},
+        length_{{static_cast<uint64_t>(end - begin)}}, kind_{{kind}}, valid_{{true}} {{
+    if (kind == Kind::integer)
+      std::from_chars(begin, end, integer_);
+  }}
+
+  std::vector<Field>::const_iterator Find(const Aws::String &key) const {{
+    return std::find_if(fields_.begin(), fields_.end(), [&key](const Field &field) {{
+      return static_cast<std::size_t>(field.key_end - field.key_begin) ==
+                 key.size() &&
+             std::equal(field.key_begin, field.key_end, key.begin());
+    }});
+  }}
+
+  template <typename T> T AsNumber() const {{
+    if (kind_ == Kind::integer)
+      return static_cast<T>(integer_);
+    if (kind_ == Kind::floating)
+      return static_cast<T>(floating_);
+    return T{{}};
+  }}
+
+  const char *begin_ = nullptr;
+  const char *end_ = nullptr;
+  const char *payload_ = nullptr;
+  uint64_t length_ = 0;
+  int64_t integer_ = 0;
+  double floating_ = 0;
+  Kind kind_ = Kind::invalid;
+  bool valid_ = false;
+  std::vector<Field> fields_;
+}};
+
+/* Mimics Aws::Utils::Array interface used by the handler */
+class Array : public std::vector<View> {{
+public:
+  std::size_t GetLength() const {{ return size(); }}
+}};
+
+inline Array View::AsArray() const {{
+  Array elements;
+  const auto *current = payload_;
+  for (std::size_t element = 0; element < Count(); ++element) {{
+    const auto *element_end = skip_item(current, end_);
+    if (element_end == nullptr)
+      break;
+    elements.emplace_back(current, element_end);
+    current = element_end;
+  }}
+  return elements;
+}}
+
+}} // namespace binary
+
+/* Request view, named after JSON one as handler is shared by all formats */
+using JsonView = binary::View;
+#elif defined(STREAMING)
+using JsonView = stream::JsonView;
+#else
+using JsonView = Aws::Utils::Json::JsonView;
+#endif
+
+/*!
+ *
+ *            RESPONSE SERIALIZATION FOR OUTPUT & RESULT
+ *
+ */
+
+/* Encode bytes as base64 (with padding) appending them to buffer */
+static void append_base64(std::string &buffer, const unsigned char *bytes,
+                          const std::size_t length) {{
+  static constexpr char alphabet[] =
+      "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/";
+  std::size_t i = 0;
+  for (; i + 2 < length; i += 3) {{
+    const auto triple = static_cast<uint32_t>(bytes[i]) << 16 |
+                        static_cast<uint32_t>(bytes[i + 1]) << 8 | bytes[i + 2];
+    buffer.push_back(alphabet[triple >> 18 & 0x3F]);
+    buffer.push_back(alphabet[triple >> 12 & 0x3F]);
+    buffer.push_back(alphabet[triple >> 6 & 0x3F]);
+    buffer.push_back(alphabet[triple & 0x3F]);
+  }}
+  if (i < length) {{
+    const auto two = i + 1 < length;
+    const auto triple = static_cast<uint32_t>(bytes[i]) << 16 |
+                        (two ? static_cast<uint32_t>(bytes[i + 1]) << 8 : 0);
+    buffer.push_back(alphabet[triple >> 18 & 0x3F]);
+    buffer.push_back(alphabet[triple >> 12 & 0x3F]);
+    buffer.push_back(two ? alphabet[triple >> 6 & 0x3F] : '=');
+    buffer.push_back('=');
+  }}
+}}
+
+#ifdef PREDICTIONS
+/*!
+ * Labels of classes read once from text file (one label per line).
+ *
+ * Labels are kept as escaped JSON strings, so they are appended to response
+ * as they are. Classes without label (index past the last line) get null.
+ *
+ */
+class Labels {{
+public:
+  explicit Labels(const char *path) {{
+    std::ifstream file{{path}};
+    if (!file) {{
+      std::fprintf(stderr, "torchlambda:: Unable to read labels file: %s\n",
+                   path);
+      std::exit(1);
+    }}
+    for (std::string line; std::getline(file, line);) {{
+      if (!line.empty() && line.back() == '\r')
+        line.pop_back();
+      labels_.push_back(Escape(line));
+      length_ = std::max(length_, labels_.back().size());
+    }}
+  }}
+
+  const std::string &operator[](const int64_t index) const {{
+    static const std::string null{{"null"}};
+    if (index < 0 || static_cast<std::size_t>(index) >= labels_.size())
+      return null;
+    return labels_[index];
+  }}
+
+  /* Upper bound of serialized label length */
+  std::size_t MaxLength() const {{ return std::max<std::size_t>(length_, 4); }}
+
+private:
+  static std::string Escape(const std::string &label) {{
+    std::string escaped{{"\""}};
+    for (const unsigned char c : label) {{
+      if (c == '"' || c == '\\') {{
+        escaped.push_back('\\');
+        escaped.push_back(c);
+      }} else if (c < 0x20) {{
+        char chars[8];
+        std::snprintf(chars, sizeof(chars), "\\u%04x", c);
+        escaped.append(chars);
+      }} else
+        escaped.push_back(c);
+    }}
+    escaped.push_back('"');
+    return escaped;
+  }}
+
+  std::vector<std::string> labels_;
+  std::size_t length_ = 0;
+}};
+
+#endif
+
+/*!
+ * Writes response JSON object straight into single reserved string.
+ *
+ * No intermediate JSON values are created, elements of returned tensors
+ * are formatted one after another into the buffer.
+ * Floating point values use shortest representation which round-trips
+ * (or fixed number of decimal places if precision is not negative),
+ * non-finite values are written as null.
+ * Encoded values are written as object with base64 encoded raw bytes,
+ * dtype and shape instead of array.
+ * Predictions are written as array of objects (index, label and score).
+ *
+ */
+class Response {{
+public:
+  Response() : buffer_{{"{{"}} {{}}
+
+  /* Add first element of data as single item of type Cast */
+  template <typename Cast>
+  void Item(const char *name, const torch::Tensor &data,
+            const int precision = -1) {{
+    Key(name, MaxLength<Cast>());
+    if (data.numel() == 0) {{
+      buffer_.append("null");
+      return;
+    }}
+    Dispatch(data, [&](const auto *pointer) {{
+      Value(static_cast<Cast>(*pointer), precision);
+    }});
+  }}
+
+  /* Add all elements of data as flat array of type Cast */
+  template <typename Cast>
+  void Array(const char *name, const torch::Tensor &data,
+             const int precision = -1) {{
+    const auto contiguous = data.contiguous();
+    Key(name, static_cast<std::size_t>(contiguous.numel()) * MaxLength<Cast>());
+    Dispatch(contiguous, [&](const auto *pointer) {{
+      Values<Cast>(pointer, contiguous.numel(), precision);
+    }});
+  }}
+
+  /* Add elements of data as array of arrays, one per sample (first dimension) */
+  template <typename Cast>
+  void NestedArray(const char *name, const torch::Tensor &data,
+                   const int precision = -1) {{
+    const auto contiguous = data.contiguous();
+    const auto samples = contiguous.size(0);
+    const auto length = samples == 0 ? 0 : contiguous.numel() / samples;
+    Key(name, static_cast<std::size_t>(contiguous.numel() + 2 * samples) *
+                  MaxLength<Cast>());
+    buffer_.push_back('[');
+    Dispatch(contiguous, [&](const auto *pointer) {{
+      for (int64_t sample = 0; sample < samples; ++sample) {{
+        if (sample != 0)
+          buffer_.push_back(',');
+        Values<Cast>(pointer + sample * length, length, precision);
+      }}
+    }});
+    buffer_.push_back(']');
+  }}
+
+  /* Add data as base64 encoded little-endian bytes with it's dtype and shape */
+  template <typename T>
+  void Encoded(const char *name, const torch::Tensor &data,
+               const char *dtype) {{
+    const auto contiguous = data.contiguous();
+    const auto length = static_cast<std::size_t>(contiguous.numel()) * sizeof(T);
+    Key(name, (length + 2) / 3 * 4 + std::strlen(dtype) +
+                  static_cast<std::size_t>(contiguous.dim()) * MaxLength<int64_t>() +
+                  32);
+    const auto *bytes =
+        reinterpret_cast<const unsigned char *>(contiguous.data_ptr<T>());
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    /* Swap bytes of each element, no-op (compiled out) on little-endian hosts */
+    std::vector<unsigned char> swapped(bytes, bytes + length);
+    for (std::size_t i = 0; i + sizeof(T) <= length; i += sizeof(T))
+      std::reverse(swapped.begin() + i, swapped.begin() + i + sizeof(T));
+    bytes = swapped.data();
+#endif
+    buffer_.append("{{\"data\":\"");
+    append_base64(buffer_, bytes, length);
+    buffer_.append("\",\"dtype\":\"");
+    buffer_.append(dtype);
+    buffer_.append("\",\"shape\":[");
+    for (int64_t dimension = 0; dimension < contiguous.dim(); ++dimension) {{
+      if (dimension != 0)
+        buffer_.push_back(',');
+      Value(static_cast<int64_t>(contiguous.size(dimension)), -1);
+    }}
+    buffer_.append("]}}");
+  }}
+
+  /* Add object of named numbers */
+  void Object(const char *name, const char *const *keys, const double *values,
+              const std::size_t length, const int precision = -1) {{
+    std::size_t capacity = 2;
+    for (std::size_t i = 0; i < length; ++i)
+      capacity += std::strlen(keys[i]) + 4 + MaxLength<double>();
+    Key(name, capacity);
+    buffer_.push_back('{{');
+    for (std::size_t i = 0; i < length; ++i) {{
+      if (i != 0)
+        buffer_.push_back(',');
+      buffer_.push_back('"');
+      buffer_.append(keys[i]);
+      buffer_.append("\":");
+      Value(values[i], precision);
+    }}
+    buffer_.push_back('}}');
+  }}
+
+#ifdef PREDICTIONS
+  /*!
+   * Add classes of single sample as array of objects with index,
+   * label (if labels provided) and score.
+   *
+   * Scores and indices are ranked (best first), classes are added until
+   * score lower than threshold is encountered.
+   *
+   */
+  void Predictions(const char *name, const torch::Tensor &scores,
+                   const torch::Tensor &indices, const Labels *labels,
+                   const double threshold, const int precision = -1) {{
+    const auto ranked = scores.contiguous();
+    const auto classes = indices.contiguous();
+    Key(name, PredictionsLength(ranked, labels));
+    Hits(ranked.data_ptr<float>(), classes.data_ptr<int64_t>(), ranked.size(1),
+         labels, threshold, precision);
+  }}
+
+  /* Add classes as array of arrays of objects, one per sample */
+  void NestedPredictions(const char *name, const torch::Tensor &scores,
+                         const torch::Tensor &indices, const Labels *labels,
+                         const double threshold, const int precision = -1) {{
+    const auto ranked = scores.contiguous();
+    const auto classes = indices.contiguous();
+    const auto samples = ranked.size(0), length = ranked.size(1);
+    Key(name, PredictionsLength(ranked, labels));
+    buffer_.push_back('[');
+    for (int64_t sample = 0; sample < samples; ++sample) {{
+      if (sample != 0)
+        buffer_.push_back(',');
+      Hits(ranked.data_ptr<float>() + sample * length,
+           classes.data_ptr<int64_t>() + sample * length, length, labels,
+           threshold, precision);
+    }}
+    buffer_.push_back(']');
+  }}
+#endif
+#ifdef CASCADE_FIELD
+
+  /* Add single integer (e.g. index of stage which answered) */
+  void Integer(const char *name, const int64_t value) {{
+    Key(name, MaxLength<int64_t>());
+    Value(value, -1);
+  }}
+#endif
+
+  /* Close JSON object and move out serialized response */
+  std::string Finish() {{
+    buffer_.push_back('}}');
+    return std::move(buffer_);
+  }}
+
+private:
+  /* Upper bound of formatted length (with separator) for most values */
+  template <typename T> static constexpr std::size_t MaxLength() {{
+    if (std::is_same<T, bool>::value)
+      return 6;
+    if (std::is_integral<T>::value)
+      return std::numeric_limits<T>::digits10 + 3;
+    return std::numeric_limits<T>::max_digits10 + 8;
+  }}
+
+  /* Write key and reserve space for it's values at once */
+  void Key(const char *name, const std::size_t capacity) {{
+    buffer_.reserve(buffer_.size() + std::strlen(name) + 4 + capacity);
+    if (buffer_.size() > 1)
+      buffer_.push_back(',');
+    buffer_.push_back('"');
+    buffer_.append(name);
+    buffer_.append("\":");
+  }}
+
+#ifdef PREDICTIONS
+  static std::size_t PredictionsLength(const torch::Tensor &scores,
+                                       const Labels *labels) {{
+    const auto hit = MaxLength<int64_t>() + MaxLength<float>() + 24 +
+                     (labels == nullptr ? 0 : labels->MaxLength() + 9);
+    return static_cast<std::size_t>(scores.numel()) * hit +
+           static_cast<std::size_t>(scores.size(0)) * 2 + 2;
+  }}
+
+  void Hits(const float *scores, const int64_t *indices, const int64_t length,
+            const Labels *labels, const double threshold, const int precision) {{
+    buffer_.push_back('[');
+    /* NaN scores (ranked first by libtorch) are kept and written as null */
+    for (int64_t i = 0; i < length && !(scores[i] < threshold); ++i) {{
+      if (i != 0)
+        buffer_.push_back(',');
+      buffer_.append("{{\"index\":");
+      Value(indices[i], -1);
+      if (labels != nullptr) {{
+        buffer_.append(",\"label\":");
+        buffer_.append((*labels)[indices[i]]);
+      }}
+      buffer_.append(",\"score\":");
+      Value(scores[i], precision);
+      buffer_.push_back('}}');
+    }}
+    buffer_.push_back(']');
+  }}
+
+#endif
+  /*!
+   * Call function with pointer to elements of data in their own type.
+   *
+   * Values are casted one by one during formatting, so tensor returned by
+   * the network is serialized without converted copy.
+   * Other types (e.g. bfloat16) are converted to double.
+   *
+   */
+  template <typename Function>
+  static void Dispatch(const torch::Tensor &data, Function function) {{
+    switch (data.scalar_type()) {{
+    case torch::kUInt8:
+      return function(data.data_ptr<uint8_t>());
+    case torch::kInt8:
+      return function(data.data_ptr<int8_t>());
+    case torch::kInt16:
+      return function(data.data_ptr<int16_t>());
+    case torch::kInt32:
+      return function(data.data_ptr<int32_t>());
+    case torch::kInt64:
+      return function(data.data_ptr<int64_t>());
+    case torch::kFloat16:
+      return function(data.data_ptr<c10::Half>());
+    case torch::kFloat32:
+      return function(data.data_ptr<float>());
+    case torch::kFloat64:
+      return function(data.data_ptr<double>());
+    case torch::kBool:
+      return function(data.data_ptr<bool>());
+    default: {{
+      const auto converted = data.toType(torch::kFloat64);
+      return function(converted.data_ptr<double>());
+    }}
+    }}
+  }}
+
+  template <typename Cast, typename T>
+  void Values(const T *data, const int64_t length, const int precision) {{
+    buffer_.push_back('[');
+    for (int64_t i = 0; i < length; ++i) {{
+      if (i != 0)
+        buffer_.push_back(',');
+      Value(static_cast<Cast>(data[i]), precision);
+    }}
+    buffer_.push_back(']');
+  }}
+
+  template <typename T> void Value(const T value, const int precision) {{
+    char chars[64];
+    if constexpr (std::is_same<T, bool>::value) {{
+      buffer_.append(value ? "true" : "false");
+    }} else if constexpr (std::is_integral<T>::value) {{
+      buffer_.append(chars,
+                     std::to_chars(std::begin(chars), std::end(chars), value).ptr);
+    }} else {{
+      if (!std::isfinite(value)) {{
+        buffer_.append("null");
+        return;
+      }}
+#ifdef __cpp_lib_to_chars
+      auto result =
+          precision < 0
+              ? std::to_chars(std::begin(chars), std::end(chars), value)
+              : std::to_chars(std::begin(chars), std::end(chars), value,
+                              std::chars_format::fixed, precision);
+      /* Too long for fixed notation, fallback to shortest representation */
+      if (result.ec != std::errc{{}})
+        result = std::to_chars(std::begin(chars), std::end(chars), value);
+      char *last = result.ptr;
+#else
+      auto length = std::snprintf(chars, sizeof(chars), "%.*f", precision,
+                                  static_cast<double>(value));
+      if (precision < 0 || length < 0 ||
+          static_cast<std::size_t>(length) >= sizeof(chars))
+        length = std::snprintf(chars, sizeof(chars), "%.*g",
+                               std::numeric_limits<T>::max_digits10,
+                               static_cast<double>(value));
+      char *last = chars + length;
+#endif
+      buffer_.append(chars, last);
+      /* Keep value floating point for JSON readers, e.g. 1 -> 1.0 */
+      if (precision < 0 && std::none_of(chars, last, [](const char c) {{
+            return c == '.' || c == 'e';
+          }}))
+        buffer_.append(".0");
+    }}
+  }}
+
+  std::string buffer_;
+}};
+
+/*!
+ *
+ *            UTILITY FUNCTIONS FOR INPUT PROCESSING
+ *
+ */
+
+#ifdef BATCH
+/* Check whether value is non-empty array with each sample passing check */
+template <typename Check>
+static bool is_batch_of(const JsonView &value, Check check) {{
+  if (!value.IsListType())
+    return false;
+  const auto samples = value.AsArray();
+  if (samples.GetLength() == 0)
+    return false;
+  for (size_t sample = 0; sample < samples.GetLength(); ++sample)
+    if (!std::invoke(check, samples[sample]))
+      return false;
+  return true;
+}}
+#endif
+
+#ifdef BASE64
+/* Value of base64 (or base64url) character, -1 for padding and others */
+static const int8_t *sextets() {{
+  static const auto table = [] {{
+    std::array<int8_t, 256> values{{}};
+    values.fill(-1);
+    for (int i = 0; i < 26; ++i) {{
+      values['A' + i] = static_cast<int8_t>(i);
+      values['a' + i] = static_cast<int8_t>(i + 26);
+    }}
+    for (int i = 0; i < 10; ++i)
+      values['0' + i] = static_cast<int8_t>(i + 52);
+    values['+'] = values['-'] = 62;
+    values['/'] = values['_'] = 63;
+    return values;
+  }}();
+  return table.data();
+}}
+
+/*!
+ * Characters of base64 sample.
+ *
+ * View straight into request payload for streaming parser (escaped
+ * characters are skipped during decoding), unescaped copy otherwise
+ * as JsonView of AWS SDK only returns copies of strings.
+ *
+ */
+#ifdef STREAMING
+static std::string_view base64_text(const stream::JsonView &data) {{
+  if (!data.IsString())
+    return {{}};
+  const auto raw = data.Raw();
+  return raw.substr(1, raw.size() - 2);
+}}
+#else
+static Aws::String base64_text(const JsonView &data) {{ return data.AsString(); }}
+#endif
+
+/* Call function with value of each base64 character, escapes are skipped */
+template <typename Function>
+static void for_each_sextet(const char *first, const char *last,
+                            Function function) {{
+  const auto *table = sextets();
+  for (; first < last; ++first) {{
+    if (*first == '\\') {{
+      /* Only escaped slash (\/) can be part of base64 */
+      if (++first == last)
+        break;
+      if (*first == 'u')
+        first += std::min<std::ptrdiff_t>(4, last - first - 1);
+      if (*first != '/')
+        continue;
+    }}
+    const auto value = table[static_cast<unsigned char>(*first)];
+    if (value >= 0)
+      function(value);
+  }}
+}}
+
+template <typename Text> static std::size_t decoded_length(const Text &text) {{
+  std::size_t characters = 0;
+  for_each_sextet(text.data(), text.data() + text.size(),
+                  [&characters](int8_t) {{ ++characters; }});
+  return characters * 6 / 8;
+}}
+
+/* Call function with each byte decoded from base64 characters of text */
+template <typename Text, typename Function>
+static void for_each_byte(const Text &text, Function function) {{
+  uint32_t bits = 0;
+  int available = 0;
+  for_each_sextet(text.data(), text.data() + text.size(), [&](int8_t value) {{
+    bits = bits << 6 | static_cast<uint32_t>(value);
+    available += 6;
+    if (available >= 8) {{
+      available -= 8;
+      function(static_cast<unsigned char>(bits >> available & 0xFF));
+    }}
+  }});
+}}
+
+/* Swap bytes of each element, no-op (compiled out) on little-endian hosts */
+static void to_host_order(const torch::Tensor &buffer) {{
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+  auto *bytes = static_cast<unsigned char *>(buffer.data_ptr());
+  const auto length = static_cast<std::size_t>(buffer.nbytes());
+  const auto element_size = static_cast<std::size_t>(buffer.element_size());
+  for (std::size_t i = 0; i + element_size <= length; i += element_size)
+    std::reverse(bytes + i, bytes + i + element_size);
+#endif
+}}
+
+/* Decode characters of little-endian elements straight into buffer */
+template <typename Text>
+static void decode_into(const Text &text, const torch::Tensor &buffer) {{
+  auto *bytes = static_cast<unsigned char *>(buffer.data_ptr());
+  const auto length = static_cast<std::size_t>(buffer.nbytes());
+
+  std::size_t written = 0;
+  for_each_byte(text, [&](const unsigned char byte) {{
+    if (written < length)
+      bytes[written++] = byte;
+  }});
+  /* Missing bytes (if not validated) are zeroed, excess ones are ignored */
+  std::fill(bytes + written, bytes + length, 0);
+  to_host_order(buffer);
+}}
+
+#ifdef FORMAT
+/* Length of binary sample, known without decoding */
+static std::size_t decoded_length(const JsonView &data) {{
+  return data.Bytes().size();
+}}
+
+/* Copy little-endian elements of binary sample into buffer */
+static void decode_into(const JsonView &data, const torch::Tensor &buffer) {{
+  const auto bytes = data.Bytes();
+  auto *target = static_cast<char *>(buffer.data_ptr());
+  const auto length = static_cast<std::size_t>(buffer.nbytes());
+  const auto written = std::min(length, bytes.size());
+  std::memcpy(target, bytes.data(), written);
+  /* Missing bytes (if not validated) are zeroed, excess ones are ignored */
+  std::fill(target + written, target + length, 0);
+  to_host_order(buffer);
+}}
+
+/*!
+ * Flat tensor of type over little-endian elements of binary sample.
+ *
+ * Bytes are used in place via from_blob (request payload outlives
+ * the tensor) if they are aligned for type on little-endian host,
+ * otherwise they are copied into storage owned by tensor.
+ *
+ */
+static torch::Tensor decode(const JsonView &data,
+                            const torch::ScalarType type) {{
+  const auto bytes = data.Bytes();
+  const auto element_size = c10::elementSize(type);
+  /* Explicit cast as PyTorch has long int for some reason */
+  const auto length = static_cast<long>(bytes.size() / element_size);
+#if !defined(__BYTE_ORDER__) || __BYTE_ORDER__ != __ORDER_BIG_ENDIAN__
+  if (length > 0 &&
+      reinterpret_cast<std::uintptr_t>(bytes.data()) % element_size == 0)
+    return torch::from_blob(const_cast<char *>(bytes.data()), {{length}}, type);
+#endif
+  auto tensor = torch::empty({{length}}, type);
+  decode_into(data, tensor);
+  return tensor;
+}}
+#else
+/* Length of base64 sample after decoding, calculated without decoding */
+static std::size_t decoded_length(const JsonView &data) {{
+  return decoded_length(base64_text(data));
+}}
+
+/* Decode base64 sample of little-endian elements straight into buffer */
+static void decode_into(const JsonView &data, const torch::Tensor &buffer) {{
+  decode_into(base64_text(data), buffer);
+}}
+
+/*!
+ * Decode base64 sample of little-endian elements into flat tensor of type.
+ *
+ * Bytes are written straight into storage owned by tensor, instead of
+ * decoded ByteBuffer of AWS SDK wrapped by from_blob (one allocation less,
+ * no ownership juggling via custom deleter).
+ *
+ */
+static torch::Tensor decode(const JsonView &data,
+                            const torch::ScalarType type) {{
+  const auto text = base64_text(data);
+  auto tensor = torch::empty(
+      {{
+          /* Explicit cast as PyTorch has long int for some reason */
+          static_cast<long>(decoded_length(text) / c10::elementSize(type)),
+      }},
+      type);
+  decode_into(text, tensor);
+  return tensor;
+}}
+#endif
+
+#if defined(REQUEST_COMPRESSION) || defined(IMAGE)
+/*!
+ * Call function with decoded bytes of sample (pointer and length).
+ *
+ * Binary strings of non-JSON formats are used in place, base64 text
+ * is decoded into temporary storage first.
+ *
+ */
+template <typename Function>
+static auto with_bytes(const JsonView &data, Function function) {{
+#ifdef FORMAT
+  const auto bytes = data.Bytes();
+  return function(reinterpret_cast<const unsigned char *>(bytes.data()),
+                  bytes.size());
+#else
+  const auto text = base64_text(data);
+  std::vector<unsigned char> bytes;
+  bytes.reserve(decoded_length(text));
+  for_each_byte(text, [&bytes](const unsigned char byte) {{
+    bytes.push_back(byte);
+  }});
+  return function(bytes.data(), bytes.size());
+#endif
+}}
+#endif
+
+#if defined(KINESIS) || defined(FORMAT)
+/* Decode base64 text (Kinesis data or binary proxy body) into bytes */
+static Aws::String decode_text(const stream::JsonView &data) {{
+  const auto text = base64_text(data);
+  Aws::String decoded;
+  decoded.reserve(decoded_length(text));
+  for_each_byte(text, [&decoded](const unsigned char byte) {{
+    decoded.push_back(static_cast<char>(byte));
+  }});
+  return decoded;
+}}
+#endif
+#endif
+
+#ifdef REQUEST_COMPRESSION
+/*!
+ * Decompress bytes straight into target of known length.
+ *
+ * Codec is detected from header of data: zstd frame (if enabled)
+ * or gzip/zlib stream (zlib detects it's wrapper itself).
+ * False is returned if data is corrupted or it's decompressed length
+ * differs from length of target.
+ *
+ */
+static bool decompress_bytes(const unsigned char *source, const std::size_t length,
+                             unsigned char *target, const std::size_t capacity) {{
+#ifdef ZSTD
+  if (length >= 4 && source[0] == 0x28 && source[1] == 0xB5 &&
+      source[2] == 0x2F && source[3] == 0xFD) {{
+    const auto written = ZSTD_decompress(target, capacity, source, length);
+    return !ZSTD_isError(written) && written == capacity;
+  }}
+#endif
+  z_stream stream{{}};
+  /* 15 bits window, +32 enables automatic gzip and zlib header detection */
+  if (inflateInit2(&stream, 15 + 32) != Z_OK)
+    return false;
+  stream.next_in = const_cast<Bytef *>(source);
+  stream.avail_in = static_cast<uInt>(length);
+  stream.next_out = target;
+  stream.avail_out = static_cast<uInt>(capacity);
+  /* Stream has to end exactly when target is filled */
+  const auto status = inflate(&stream, Z_FINISH);
+  inflateEnd(&stream);
+  return status == Z_STREAM_END && stream.avail_out == 0;
+}}
+
+/*!
+ * Decompress base64 encoded compressed sample straight into buffer.
+ *
+ * Only compressed bytes are decoded into temporary storage (usually
+ * much smaller than tensor), decompressed little-endian elements
+ * are written into storage of buffer directly.
+ *
+ */
+static bool decompress_into(const JsonView &data, const torch::Tensor &buffer) {{
+  const auto decompressed = with_bytes(
+      data, [&buffer](const unsigned char *compressed, const std::size_t length) {{
+        return decompress_bytes(compressed, length,
+                                static_cast<unsigned char *>(buffer.data_ptr()),
+                                static_cast<std::size_t>(buffer.nbytes()));
+      }});
+  if (!decompressed)
+    return false;
+  to_host_order(buffer);
+  return true;
+}}
+
+/* Decompress sample into new tensor of shape, undefined if it does not fit */
+static torch::Tensor decompress(const JsonView &data,
+                                const std::vector<int64_t> &shape,
+                                const torch::ScalarType type) {{
+  auto tensor = torch::empty(shape, type);
+  return decompress_into(data, tensor) ? tensor : torch::Tensor{{}};
+}}
+
+/*!
+ * Decompress each sample straight into it's part of batch tensor.
+ *
+ * Samples of shape are concatenated along first dimension, no per sample
+ * tensors are created. Undefined tensor is returned if any sample
+ * does not fit it's shape.
+ *
+ */
+static torch::Tensor decompress_batch(const JsonView &data,
+                                      std::vector<int64_t> shape,
+                                      const torch::ScalarType type) {{
+  const auto samples = data.AsArray();
+  const auto sample_size = shape.front();
+  shape.front() *= static_cast<int64_t>(samples.GetLength());
+  auto tensor = torch::empty(shape, type);
+  for (size_t sample = 0; sample < samples.GetLength(); ++sample)
+    if (!decompress_into(samples[sample],
+                         tensor.narrow(0, static_cast<int64_t>(sample) * sample_size,
+                                     sample_size)))
+      return {{}};
+  return tensor;
+}}
+#endif
+
+#ifdef IMAGE
+/*!
+ *
+ *                      JPEG & PNG IMAGE DECODING
+ *
+ */
+
+enum class Interpolation {{ nearest, bilinear }};
+
+/* Pair of source pixels (and weight of second one) for output coordinate */
+struct Neighbours {{
+  int64_t first, second;
+  float weight;
+}};
+
+/*!
+ * Source pixels of each of count output coordinates along single axis.
+ *
+ * Output coordinates are shifted by offset (of center crop) within image
+ * resized by scale, pixel centers are aligned (as in PIL and torchvision)
+ * and coordinates outside of source image are clamped to it's edge.
+ *
+ */
+static std::vector<Neighbours> neighbours(const int64_t count,
+                                          const int64_t offset,
+                                          const double scale, const int64_t size,
+                                          const Interpolation interpolation) {{
+  std::vector<Neighbours> result(count);
+  for (int64_t i = 0; i < count; ++i) {{
+    auto &pixel = result[i];
+    if (interpolation == Interpolation::nearest) {{
+      pixel.first = pixel.second = std::min<int64_t>(
+          static_cast<int64_t>((i + offset + 0.5) / scale), size - 1);
+      pixel.weight = 0;
+      continue;
+    }}
+    const auto source = std::clamp((i + offset + 0.5) / scale - 0.5, 0.0,
+                                   static_cast<double>(size - 1));
+    pixel.first = static_cast<int64_t>(source);
+    pixel.second = std::min<int64_t>(pixel.first + 1, size - 1);
+    pixel.weight = static_cast<float>(source - pixel.first);
+  }}
+  return result;
+}}
+
+/*!
+ * Decode base64 encoded JPEG or PNG image straight into buffer.
+ *
+ * Buffer is uint8 tensor of shape (1, channels, height, width), image
+ * is converted to it's channels (grayscale or RGB) during decoding.
+ * Shorter side of image is resized to resize (if 0 image is resized
+ * just enough to cover buffer) and center crop of buffer's size is taken.
+ * Resizing, cropping and HWC to CHW layout change happen in single pass
+ * over output pixels, no intermediate images are created.
+ * False is returned if data is not valid JPEG or PNG image.
+ *
+ */
+static bool decode_image_into(const JsonView &data, const torch::Tensor &buffer,
+                              const int64_t resize,
+                              const Interpolation interpolation) {{
+  const auto channels = buffer.size(1), height = buffer.size(2),
+             width = buffer.size(3);
+  int source_width = 0, source_height = 0, source_channels = 0;
+  const std::unique_ptr<stbi_uc, void (*)(void *)> pixels{{
+      with_bytes(data,
+                 [&](const unsigned char *encoded, const std::size_t length) {{
+                   return stbi_load_from_memory(
+                       encoded, static_cast<int>(length), &source_width,
+                       &source_height, &source_channels,
+                       static_cast<int>(channels));
+                 }}),
+      stbi_image_free}};
+  if (!pixels)
+    return false;
+
+  /* Size of resized image, aspect ratio is kept */
+  const auto shorter = std::min(source_width, source_height);
+  const auto scale =
+      resize > 0 ? static_cast<double>(resize) / shorter
+                 : std::max(static_cast<double>(height) / source_height,
+                            static_cast<double>(width) / source_width);
+  const auto resized_height =
+      std::max<int64_t>(std::lround(source_height * scale), 1);
+  const auto resized_width =
+      std::max<int64_t>(std::lround(source_width * scale), 1);
+
+  const auto rows = neighbours(
+      height, std::lround((resized_height - height) / 2.0),
+      static_cast<double>(resized_height) / source_height, source_height,
+      interpolation);
+  const auto columns = neighbours(
+      width, std::lround((resized_width - width) / 2.0),
+      static_cast<double>(resized_width) / source_width, source_width,
+      interpolation);
+
+  const auto *source = pixels.get();
+  auto *output = buffer.data_ptr<uint8_t>();
+  const auto stride = static_cast<int64_t>(source_width) * channels;
+  const auto plane = height * width;
+  for (int64_t y = 0; y < height; ++y) {{
+    const auto *upper = source + rows[y].first * stride;
+    const auto *lower = source + rows[y].second * stride;
+    for (int64_t x = 0; x < width; ++x) {{
+      const auto left = columns[x].first * channels;
+      const auto right = columns[x].second * channels;
+      for (int64_t channel = 0; channel < channels; ++channel) {{
+        const float top =
+            upper[left + channel] +
+            (upper[right + channel] - upper[left + channel]) * columns[x].weight;
+        const float bottom =
+            lower[left + channel] +
+            (lower[right + channel] - lower[left + channel]) * columns[x].weight;
+        output[channel * plane + y * width + x] =
+            static_cast<uint8_t>(top + (bottom - top) * rows[y].weight + 0.5f);
+      }}
+    }}
+  }}
+  return true;
+}}
+
+/* Decode image into new tensor of shape, undefined if it is not valid */
+static torch::Tensor decode_image(const JsonView &data,
+                                  const std::vector<int64_t> &shape,
+                                  const int64_t resize,
+                                  const Interpolation interpolation) {{
+  auto tensor = torch::empty(shape, torch::kUInt8);
+  return decode_image_into(data, tensor, resize, interpolation) ? tensor
+                                                                : torch::Tensor{{}};
+}}
+
+/*!
+ * Decode each image straight into it's part of batch tensor.
+ *
+ * Undefined tensor is returned if any sample is not valid image.
+ *
+ */
+static torch::Tensor decode_image_batch(const JsonView &data,
+                                        std::vector<int64_t> shape,
+                                        const int64_t resize,
+                                        const Interpolation interpolation) {{
+  const auto samples = data.AsArray();
+  shape.front() = static_cast<int64_t>(samples.GetLength());
+  auto tensor = torch::empty(shape, torch::kUInt8);
+  for (size_t sample = 0; sample < samples.GetLength(); ++sample)
+    if (!decode_image_into(samples[sample],
+                           tensor.narrow(0, static_cast<int64_t>(sample), 1),
+                           resize, interpolation))
+      return {{}};
+  return tensor;
+}}
+#endif
+
+#ifdef STREAMING
+/* Parse array sample straight into preallocated tensor, no intermediate DOM */
+template <typename T, typename Value>
+static torch::Tensor decode(const JsonView &data, const torch::ScalarType type,
+                            Value (JsonView::*)() const) {{
+  auto tensor = torch::empty(
+      {{
+          /* Explicit cast as PyTorch has long int for some reason */
+          static_cast<long>(data.Count()),
+      }},
+      type);
+  data.ParseInto(tensor.data_ptr<T>(), tensor.numel());
+  return tensor;
+}}
+#else
+/* Decode array sample into flat tensor of specified type */
+template <typename T, typename Value>
+static torch::Tensor
+decode(const JsonView &data, const torch::ScalarType type,
+       Value (JsonView::*getter)() const) {{
+  const auto nested_json = data.AsArray();
+  auto tensor = torch::empty(
+      {{
+          /* Explicit cast as PyTorch has long int for some reason */
+          static_cast<long>(nested_json.GetLength()),
+      }},
+      type);
+
+  auto *data_pointer = tensor.data_ptr<T>();
+  for (size_t i = 0; i < nested_json.GetLength(); ++i)
+    data_pointer[i] = static_cast<T>((nested_json[i].*getter)());
+
+  return tensor;
+}}
+#endif
+
+#ifdef BATCH
+/* Decode each sample separately and concatenate them along batch dimension */
+template <typename Decoder>
+static torch::Tensor decode_batch(const JsonView &data,
+                                  Decoder decoder) {{
+  const auto samples = data.AsArray();
+  std::vector<torch::Tensor> tensors;
+  tensors.reserve(samples.GetLength());
+  for (size_t sample = 0; sample < samples.GetLength(); ++sample)
+    tensors.push_back(decoder(samples[sample]));
+  return torch::cat(tensors);
+}}
+#endif
+
+/*!
+ * Per channel (dimension 1) affine transformation `x * scale + shift`.
+ *
+ * Division and normalization known during code generation are folded into
+ * single scale and shift per channel, hence input is casted, divided and
+ * normalized in single pass without temporary tensors.
+ * Unsigned 8 bit inputs (e.g. images) are mapped via precomputed per channel
+ * lookup table instead.
+ *
+ */
+template <typename T> class Affine {{
+  /* Half precision values are computed in single precision */
+  using Compute = typename std::conditional<std::is_same<T, double>::value,
+                                            double, float>::type;
+
+public:
+  Affine(const std::vector<double> &scale, const std::vector<double> &shift,
+         const torch::ScalarType type)
+      : scale_(scale.begin(), scale.end()), shift_(shift.begin(), shift.end()),
+        table_(scale.size() * 256), type_{{type}} {{
+    for (std::size_t channel = 0; channel < scale.size(); ++channel)
+      for (std::size_t value = 0; value < 256; ++value)
+        table_[channel * 256 + value] =
+            static_cast<T>(value * scale[channel] + shift[channel]);
+  }}
+
+  template <typename Input>
+  torch::Tensor Apply(const torch::Tensor &input) const {{
+    auto output = torch::empty(input.sizes(), type_);
+    ApplyInto<Input>(input, output);
+    return output;
+  }}
+
+  /* Transform input into preallocated output of the same shape */
+  template <typename Input>
+  void ApplyInto(const torch::Tensor &input, const torch::Tensor &output) const {{
+    const auto contiguous = input.contiguous();
+    const auto *source = contiguous.data_ptr<Input>();
+    auto *target = output.data_ptr<T>();
+
+    const auto channels = static_cast<int64_t>(scale_.size());
+    const auto numel = contiguous.numel();
+    /* Single channel is broadcasted over whole tensor */
+    const auto inner =
+        channels == 1 ? numel : numel / (contiguous.size(0) * channels);
+    for (int64_t offset = 0, channel = 0; offset < numel;
+         offset += inner, channel = (channel + 1) % channels) {{
+      if constexpr (std::is_same<Input, uint8_t>::value) {{
+        const auto *table = table_.data() + channel * 256;
+        for (int64_t i = offset; i < offset + inner; ++i)
+          target[i] = table[source[i]];
+      }} else {{
+        const auto scale = scale_[channel], shift = shift_[channel];
+        for (int64_t i = offset; i < offset + inner; ++i)
+          target[i] = static_cast<T>(static_cast<Compute>(source[i]) * scale + shift);
+      }}
+    }}
+  }}
+
+private:
+  std::vector<Compute> scale_;
+  std::vector<Compute> shift_;
+  std::vector<T> table_;
+  torch::ScalarType type_;
+}};
+
+#ifdef PREALLOCATE
+/*!
+ * Tensors allocated once in main() and reused by every request.
+ *
+ * Inputs (of static shape) are decoded and converted straight into their
+ * storage. Returned tensors encoded in base64 are converted (if their type
+ * differs) into storage which is reallocated only if shape returned by
+ * the network changes. Forward pass, result operations and division or
+ * normalization which cannot be fused still allocate their outputs.
+ *
+ */
+struct Buffers {{
+  std::vector<torch::Tensor> inputs;
+  std::vector<torch::Tensor> returns;
+}};
+
+/* Convert tensor into buffer of type, reallocate buffer only if needed */
+static torch::Tensor convert(const torch::Tensor &tensor, torch::Tensor &buffer,
+                             const torch::ScalarType type) {{
+  /* No copy if network already returned type */
+  if (tensor.scalar_type() == type)
+    return tensor;
+  if (!buffer.defined() || buffer.sizes() != tensor.sizes())
+    buffer = torch::empty(tensor.sizes(), type);
+  buffer.copy_(tensor);
+  return buffer;
+}}
+
+/* Parse array sample straight into buffer, missing elements become 0 */
+template <typename T, typename Value>
+static void decode_into(const JsonView &data, const torch::Tensor &buffer,
+                        [[maybe_unused]] Value (JsonView::*getter)() const) {{
+  auto *pointer = buffer.data_ptr<T>();
+  const auto numel = static_cast<std::size_t>(buffer.numel());
+#ifdef STREAMING
+  data.ParseInto(pointer, numel);
+#else
+  const auto nested_json = data.AsArray();
+  const auto length = std::min<std::size_t>(nested_json.GetLength(), numel);
+  for (size_t i = 0; i < length; ++i)
+    pointer[i] = static_cast<T>((nested_json[i].*getter)());
+  std::fill(pointer + length, pointer + numel, T{{}});
+#endif
+}}
+#endif
+
+#ifdef CACHE
+/*!
+ *
+ *                     LRU CACHE OF RESPONSES
+ *
+ */
+
+/*!
+ * Unparsed values of fields (input data and shape fields) as key of request.
+ *
+ * Each value is preceded by it's length, so values of different fields
+ * cannot be shifted (missing fields have maximal length).
+ *
+ */
+static std::string cache_key(const JsonView &json_view,
+                             std::initializer_list<const char *> fields) {{
+  std::string key;
+  const auto append_length = [&key](const std::uint64_t length) {{
+    key.append(reinterpret_cast<const char *>(&length), sizeof(length));
+  }};
+  for (const auto *field : fields) {{
+    if (!json_view.KeyExists(field)) {{
+      append_length(std::numeric_limits<std::uint64_t>::max());
+      continue;
+    }}
+#ifdef STREAMING
+    const auto raw = json_view.GetObject(field).Raw();
+#else
+    const auto raw = json_view.GetObject(field).WriteCompact();
+#endif
+    append_length(raw.size());
+    key.append(raw.data(), raw.size());
+  }}
+  return key;
+}}
+
+/*!
+ * Serialized responses of most recently seen requests.
+ *
+ * Bounded by number of entries and total bytes of keys and responses,
+ * least recently used entries are evicted first.
+ * Entries are indexed by FNV-1a hash of key, whole key is compared on lookup,
+ * so request with colliding hash is a miss, not response of the other one.
+ * Number of hits and misses is logged every CACHE_REPORT lookups
+ * (if positive).
+ *
+ */
+class Cache {{
+public:
+  Cache(const std::size_t entries, const std::size_t bytes)
+      : entries_{{entries}}, bytes_{{bytes}} {{}}
+
+  /* Cached response (marked as most recently used), nullptr if absent */
+  const std::string *Find(const std::string &key) {{
+    const auto found = index_.find(Hash(key));
+    const auto hit = found != index_.end() && found->second->key == key;
+    if (hit)
+      order_.splice(order_.begin(), order_, found->second);
+    Count(hit);
+    return hit ? &found->second->response : nullptr;
+  }}
+
+  void Insert(const std::string &key, const std::string &response) {{
+    const auto size = key.size() + response.size();
+    const auto hash = Hash(key);
+    if (entries_ == 0 || size > bytes_ || index_.count(hash) != 0)
+      return;
+    while (!order_.empty() &&
+           (order_.size() >= entries_ || used_ + size > bytes_)) {{
+      used_ -= order_.back().key.size() + order_.back().response.size();
+      index_.erase(Hash(order_.back().key));
+      order_.pop_back();
+    }}
+    order_.push_front({{key, response}});
+    index_.emplace(hash, order_.begin());
+    used_ += size;
+  }}
+
+private:
+  static std::uint64_t Hash(const std::string &key) {{
+    std::uint64_t hash = 14695981039346656037ULL;
+    for (const auto byte : key) {{
+      hash ^= static_cast<unsigned char>(byte);
+      hash *= 1099511628211ULL;
+    }}
+    return hash;
+  }}
+
+  void Count([[maybe_unused]] const bool hit) {{
+#if CACHE_REPORT > 0
+    hit ? ++hits_ : ++misses_;
+    if ((hits_ + misses_) % CACHE_REPORT == 0) {{
+      std::printf("torchlambda:: Cache hits: %zu, misses: %zu, entries: %zu, "
+                  "bytes: %zu\n",
+                  hits_, misses_, order_.size(), used_);
+      std::fflush(stdout);
+    }}
+#endif
+  }}
+
+  struct Entry {{
+    std::string key;
+    std::string response;
+  }};
+
+  std::size_t entries_;
+  std::size_t bytes_;
+  std::size_t used_ = 0;
+  std::size_t hits_ = 0;
+  std::size_t misses_ = 0;
+  std::list<Entry> order_;
+  std::unordered_map<std::uint64_t, std::list<Entry>::iterator> index_;
+}};
+#endif
+
+#ifdef INSTRUMENTATION
+/*!
+ *
+ *                  PER STAGE LATENCY INSTRUMENTATION
+ *
+ */
+
+/*!
+ * Elapsed time of each stage of the handler measured by monotonic clock.
+ *
+ * Time since previous mark is added to the marked stage, hence stages
+ * occurring multiple times (e.g. decoding of each input) are summed.
+ * Emitted as single CloudWatch Embedded Metric Format log line.
+ *
+ */
+class Timings {{
+public:
+  enum Stage {{ parse, decode, preprocess, forward, serialize, count }};
+
+  static constexpr const char *names[count]{{"parse", "decode", "preprocess",
+                                            "forward", "serialize"}};
+
+  void Mark(const Stage stage) {{
+    const auto now = std::chrono::steady_clock::now();
+    elapsed_[stage] +=
+        std::chrono::duration<double, std::milli>(now - last_).count();
+    last_ = now;
+  }}
+
+  const double *Milliseconds() const {{ return elapsed_; }}
+
+  /* Print EMF line, metrics are extracted by CloudWatch Logs */
+  void Emit() const {{
+    static const char *function = std::getenv("AWS_LAMBDA_FUNCTION_NAME");
+    const auto timestamp =
+        std::chrono::duration_cast<std::chrono::milliseconds>(
+            std::chrono::system_clock::now().time_since_epoch())
+            .count();
+    std::string line{{"{{\"_aws\":{{\"Timestamp\":"}};
+    line.reserve(512);
+    line.append(std::to_string(timestamp));
+    line.append(",\"CloudWatchMetrics\":[{{\"Namespace\":\"" INSTRUMENTATION
+                "\",\"Dimensions\":[[\"FunctionName\"]],\"Metrics\":[");
+    for (int stage = 0; stage < count; ++stage) {{
+      if (stage != 0)
+        line.push_back(',');
+      line.append("{{\"Name\":\"");
+      line.append(names[stage]);
+      line.append("\",\"Unit\":\"Milliseconds\"}}");
+    }}
+    line.append("]}}]}},\"FunctionName\":\"");
+    line.append(function == nullptr ? "torchlambda" : function);
+    line.push_back('"');
+    char value[32];
+    for (int stage = 0; stage < count; ++stage) {{
+      std::snprintf(value, sizeof(value), "%.3f", elapsed_[stage]);
+      line.append(",\"");
+      line.append(names[stage]);
+      line.append("\":");
+      line.append(value);
+    }}
+    line.append("}}\n");
+    std::fwrite(line.data(), 1, line.size(), stdout);
+    std::fflush(stdout);
+  }}
+
+private:
+  std::chrono::steady_clock::time_point last_ =
+      std::chrono::steady_clock::now();
+  double elapsed_[count]{{}};
+}};
+
+/* Add time elapsed since previous mark to stage */
+#define TIMING(stage) timings.Mark(Timings::stage)
+#else
+/* No-op, hot path has no overhead without instrumentation */
+#define TIMING(stage)
+#endif
+
+#ifdef PROFILING
+/*!
+ *
+ *                    OPERATOR LEVEL PROFILING
+ *
+ */
+
+/* Whether this invocation is among PROFILING fraction of profiled ones */
+static bool sampled() {{
+  static std::minstd_rand generator{{std::random_device{{}}()}};
+  static std::uniform_real_distribution<double> distribution{{0.0, 1.0}};
+  return distribution(generator) < PROFILING;
+}}
+
+#ifndef PROFILING_TRACE
+/* Log operators taking most time (inclusive) aggregated from Chrome trace */
+static void log_operators(const std::string &trace) {{
+  const Aws::Utils::Json::JsonValue json{{Aws::String{{trace.data(), trace.size()}}}};
+  if (!json.WasParseSuccessful()) {{
+    std::fprintf(stderr, "torchlambda:: Failed to parse profiler trace\n");
+    return;
+  }}
+  struct Operator {{
+    std::string name;
+    std::size_t calls;
+    double total;
+  }};
+  std::vector<Operator> operators;
+  std::unordered_map<std::string, std::size_t> index;
+  double total = 0.0;
+  const auto events = json.View().AsArray();
+  for (std::size_t i = 0; i < events.GetLength(); ++i) {{
+    if (!events[i].KeyExists("dur"))
+      continue;
+    const auto name = events[i].GetString("name");
+    const auto duration = events[i].GetDouble("dur") / 1000.0;
+    const auto inserted =
+        index.emplace(std::string{{name.c_str(), name.size()}}, operators.size());
+    if (inserted.second)
+      operators.push_back({{inserted.first->first, 0, 0.0}});
+    auto &element = operators[inserted.first->second];
+    ++element.calls;
+    element.total += duration;
+    total += duration;
+  }}
+  const auto top = std::min<std::size_t>(operators.size(), PROFILING_TOP);
+  std::partial_sort(operators.begin(), operators.begin() + top, operators.end(),
+                    [](const Operator &first, const Operator &second) {{
+                      return first.total > second.total;
+                    }});
+  std::string table{{"torchlambda:: Profiled operators (inclusive time):\n"}};
+  char line[256];
+  for (std::size_t i = 0; i < top; ++i) {{
+    std::snprintf(line, sizeof(line), "  %-40s %8zu calls %10.3f ms %6.2f%%\n",
+                  operators[i].name.c_str(), operators[i].calls,
+                  operators[i].total,
+                  total > 0.0 ? 100.0 * operators[i].total / total : 0.0);
+    table.append(line);
+  }}
+  std::fwrite(table.data(), 1, table.size(), stdout);
+  std::fflush(stdout);
+}}
+#endif
+
+/* Run forward under libtorch profiler if invocation is sampled */
+template <typename Forward> static c10::IValue profiled(Forward forward) {{
+  if (!sampled())
+    return forward();
+  c10::IValue result;
+#ifdef PROFILING_TRACE
+  static std::size_t traces = 0;
+  const auto path = std::string{{PROFILING_TRACE}} + "/torchlambda_" +
+                    std::to_string(getpid()) + "_" + std::to_string(traces++) +
+                    ".json";
+  {{
+    torch::autograd::profiler::RecordProfile guard{{path}};
+    result = forward();
+  }}
+  std::printf("torchlambda:: Profiler trace written to %s\n", path.c_str());
+  std::fflush(stdout);
+#else
+  std::stringstream trace;
+  {{
+    torch::autograd::profiler::RecordProfile guard{{trace}};
+    result = forward();
+  }}
+  log_operators(trace.str());
+#endif
+  return result;
+}}
+#endif
+
+#ifdef RESPONSE_COMPRESSION
+/*!
+ *
+ *                        COMPRESSED RESPONSES
+ *
+ */
+
+/*!
+ * Compress bytes with RESPONSE_COMPRESSION codec.
+ *
+ * Fastest compression level is used as it runs on every invocation,
+ * output is reserved up to it's bound so compression cannot run out of space.
+ *
+ */
+static std::string compress(const std::string &body) {{
+  std::string compressed;
+#ifdef ZSTD
+  if constexpr (std::string_view{{RESPONSE_COMPRESSION}} == "zstd") {{
+    compressed.resize(ZSTD_compressBound(body.size()));
+    const auto written = ZSTD_compress(&compressed[0], compressed.size(),
+                                       body.data(), body.size(), 1);
+    compressed.resize(ZSTD_isError(written) ? 0 : written);
+    return compressed;
+  }}
+#endif
+  /* 15 bits window, +16 writes gzip wrapper instead of zlib (deflate) one */
+  const auto window = std::string_view{{RESPONSE_COMPRESSION}} == "gzip" ? 15 + 16 : 15;
+  z_stream stream{{}};
+  if (deflateInit2(&stream, Z_BEST_SPEED, Z_DEFLATED, window, 8,
+                   Z_DEFAULT_STRATEGY) != Z_OK)
+    return compressed;
+  compressed.resize(deflateBound(&stream, body.size()));
+  stream.next_in = reinterpret_cast<Bytef *>(const_cast<char *>(body.data()));
+  stream.avail_in = static_cast<uInt>(body.size());
+  stream.next_out = reinterpret_cast<Bytef *>(&compressed[0]);
+  stream.avail_out = static_cast<uInt>(compressed.size());
+  const auto status = deflate(&stream, Z_FINISH);
+  compressed.resize(status == Z_STREAM_END ? stream.total_out : 0);
+  deflateEnd(&stream);
+  return compressed;
+}}
+
+/*!
+ * Compress serialized response and encode it in base64.
+ *
+ * Proxy responses carry it as binary body with Content-Encoding header
+ * (see `proxy`), so HTTP clients decompress it transparently.
+ * Otherwise JSON object of `encoding` and base64 `data` is returned.
+ *
+ */
+static std::string compress_response(const std::string &body) {{
+  const auto compressed = compress(body);
+  std::string encoded;
+  encoded.reserve((compressed.size() + 2) / 3 * 4 + 48);
+#ifndef APIGATEWAY
+  encoded.append("{{\"encoding\":\"" RESPONSE_COMPRESSION "\",\"data\":\"");
+#endif
+  append_base64(encoded,
+                reinterpret_cast<const unsigned char *>(compressed.data()),
+                compressed.size());
+#ifndef APIGATEWAY
+  encoded.append("\"}}");
+#endif
+  return encoded;
+}}
+#endif
+
+#ifdef APIGATEWAY
+/*!
+ *
+ *                  API GATEWAY & FUNCTION URL EVENTS
+ *
+ */
+
+#ifdef APIGATEWAY_BINARY
+/*!
+ * Request fields of proxy event with binary body.
+ *
+ * Body (base64 encoded by API Gateway) becomes value of APIGATEWAY_BINARY
+ * input field, values of query string parameters and headers (in this order
+ * of precedence) become other fields (e.g. shape fields).
+ * Fields are views into the event, nothing is copied or decoded.
+ *
+ */
+static JsonView binary_request(const JsonView &event) {{
+  /* Empty object, fields of event are added to it */
+  JsonView request{{std::string_view{{"{{}}"}}}};
+  request.Insert(APIGATEWAY_BINARY, event.GetObject("body"));
+  request.Merge(event.GetObject("queryStringParameters").AsObject());
+  request.Merge(event.GetObject("headers").AsObject());
+  return request;
+}}
 
-{CAST}
+#endif
+/*!
+ * Wrap response of handler into proxy response.
+ *
+ * Serialized response (or error for failures, returned with status 400)
+ * becomes escaped JSON body, so HTTP clients receive it as it is.
+ * Compressed response becomes binary body with Content-Encoding header.
+ *
+ */
+static aws::lambda_runtime::invocation_response
+proxy(const aws::lambda_runtime::invocation_response &response) {{
+  const auto &body = response.get_payload();
+#ifdef RESPONSE_COMPRESSION
+  /* Successful body is already compressed and base64 encoded */
+  if (response.is_success())
+    return aws::lambda_runtime::invocation_response::success(
+        "{{\"statusCode\":200,\"headers\":{{\"Content-Type\":\"application/json\","
+        "\"Content-Encoding\":\"" RESPONSE_COMPRESSION "\"}},"
+        "\"isBase64Encoded\":true,\"body\":\"" +
+            body + "\"}}",
+        "application/json");
+#endif
+  std::string proxied;
+  proxied.reserve(body.size() + body.size() / 4 + 128);
+  proxied.append(response.is_success() ? "{{\"statusCode\":200"
+                                       : "{{\"statusCode\":400");
+  proxied.append(",\"headers\":{{\"Content-Type\":\"application/json\"}},"
+                 "\"isBase64Encoded\":false,\"body\":\"");
+  for (const char c : body) {{
+    if (c == '"' || c == '\\')
+      proxied.push_back('\\');
+    proxied.push_back(c);
+  }}
+  proxied.append("\"}}");
+  return aws::lambda_runtime::invocation_response::success(std::move(proxied),
+                                                           "application/json");
+}}
 
-{DIVIDE}
+#endif
 
-{RETURN_OUTPUT}
+/*!
+ *
+ *                        REQUEST HANDLER
+ *
+ */
 
-{RETURN_OUTPUT_ITEM}
+{MODEL_CODE}
+#ifdef MODELS
+/*!
+ *
+ *                MULTIPLE MODELS WITH LRU RESIDENCY
+ *
+ */
 
-{RETURN_RESULT}
+/* Model served by function with code generated for it's inputs and returns */
+struct Route {{
+  const char *name;
+  const char *path;
+  decltype(&model_0::create_inputs) create_inputs;
+  decltype(&model_0::create_response) create_response;
+}};
 
-{RETURN_RESULT_ITEM}
+static const Route routes[]{{{ROUTES}}};
 
-#include <string> /* To use for InvalidJson return if any of shape fields not provided */
+/* Size of parameters and buffers of module (weights dominate it's memory) */
+static std::size_t module_bytes(const torch::jit::script::Module &module) {{
+  std::size_t bytes = 0;
+  for (const auto &parameter : module.parameters())
+    bytes += parameter.nbytes();
+  for (const auto &buffer : module.buffers())
+    bytes += buffer.nbytes();
+  return bytes;
+}}
 
-#include <algorithm>
-#include <iterator>
+/* Size of serialized model, estimate of memory it takes once loaded */
+static std::size_t file_bytes(const char *path) {{
+  struct stat status;
+  if (stat(path, &status) != 0)
+    return 0;
+  return static_cast<std::size_t>(status.st_size);
+}}
 
-#include <aws/core/Aws.h>
-#include <aws/core/utils/base64/Base64.h>
-#include <aws/core/utils/json/JsonSerializer.h>
-#include <aws/core/utils/memory/stl/AWSString.h>
+/*!
+ * Models loaded on first use and kept within memory budget (MODELS_BYTES).
+ *
+ * Model is loaded on first request routed to it. Least recently used
+ * models are evicted before loading until the new one (estimated by size
+ * of it's file) fits into the budget, so peak memory stays within it.
+ * Size of loaded parameters and buffers is accounted afterwards
+ * (model larger than the budget is still served, as the only resident one).
+ *
+ */
+class Models {{
+public:
+  /* Route named by MODELS field of request, nullptr if there is none */
+  const Route *Find(const JsonView &json_view) const {{
+    if (!json_view.KeyExists(MODELS))
+      return nullptr;
+    const auto field = json_view.GetObject(MODELS);
+    if (!field.IsString())
+      return nullptr;
+    const auto name = field.AsString();
+    for (const auto &route : routes)
+      if (name == route.name)
+        return &route;
+    return nullptr;
+  }}
 
-#include <aws/lambda-runtime/runtime.h>
+  /* Module of route, loaded (evicting others if needed) if not resident */
+  std::shared_ptr<torch::jit::script::Module> Load(const Route &route) {{
+    const auto resident =
+        std::find_if(residents_.begin(), residents_.end(),
+                     [&route](const Resident &other) {{ return other.route == &route; }});
+    if (resident != residents_.end()) {{
+      /* Residents are ordered from the most recently used one */
+      residents_.splice(residents_.begin(), residents_, resident);
+      return resident->module;
+    }}
 
-#include <torch/script.h>
-#include <torch/torch.h>
+    Evict(file_bytes(route.path));
+    auto module = Aws::MakeShared<torch::jit::script::Module>(
+        "TORCHSCRIPT_MODEL", torch::jit::load(route.path, torch::kCPU));
+#ifndef GRAD
+    module->eval();
+#endif
+    const auto bytes = module_bytes(*module);
+    Evict(bytes);
+    residents_.push_front({{&route, module, bytes}});
+    bytes_ += bytes;
+    std::printf("torchlambda:: Loaded model %s (%zu bytes), %zu bytes resident\n",
+                route.name, bytes, bytes_);
+    std::fflush(stdout);
+    return module;
+  }}
+
+private:
+  /* Evict least recently used models until bytes fit next to residents */
+  void Evict(const std::size_t bytes) {{
+    while (!residents_.empty() && bytes_ + bytes > MODELS_BYTES) {{
+      std::printf("torchlambda:: Evicting model %s\n", residents_.back().route->name);
+      bytes_ -= residents_.back().bytes;
+      residents_.pop_back();
+    }}
+  }}
+
+  struct Resident {{
+    const Route *route;
+    std::shared_ptr<torch::jit::script::Module> module;
+    std::size_t bytes;
+  }};
 
+  std::list<Resident> residents_;
+  std::size_t bytes_ = 0;
+}};
+
+#endif
+#ifdef CASCADE
 /*!
  *
- *            UTILITY MACROS FOR OUTPUT & RESULT PROCESSING
+ *                         CASCADED INFERENCE
  *
  */
 
-#define CREATE_JSON_ARRAY(decoded, data, ptr_name, func, torch_type, cpp_type) \
-  const auto *ptr_name = data.data_ptr<torch_type>();                          \
-  for (int64_t i = 0; i < data.numel(); ++i)                                   \
-    decoded[i] = Aws::Utils::Json::JsonValue{{}}.func(                         \
-        (static_cast<cpp_type>(*(ptr_name + i))));
+/* Criterion judging confidence of stage in it's logits */
+enum class Confidence {{ probability, margin }};
 
-#define ADD_ITEM(value, func, name, torch_type, cpp_type)                      \
-  func(name, static_cast<cpp_type>(value.flatten().item<torch_type>()))
+struct Stage {{
+  const char *path;
+  Confidence confidence;
+  double threshold;
+}};
+
+/* Stages in order of forwarding, cheapest first */
+static const Stage stages[]{{{CASCADE_STAGES}}};
 
 /*!
+ * Confidence of stage in forwarded logits (classes in last dimension).
  *
- *                        REQUEST HANDLER
+ * Probability criterion is the highest softmax probability, margin is
+ * difference between two highest ones. The least confident sample
+ * decides for batched inputs.
+ *
+ */
+static double confidence(const c10::IValue &forwarded,
+                         const Confidence criterion) {{
+  const auto logits = {CASCADE_LOGITS};
+  const auto probabilities = torch::softmax(
+      logits.reshape({{-1, logits.size(-1)}}).to(torch::kFloat32), 1);
+  if (criterion == Confidence::margin && probabilities.size(1) > 1) {{
+    const auto top = std::get<0>(probabilities.topk(2, 1));
+    return (top.select(1, 0) - top.select(1, 1)).min().item<double>();
+  }}
+  return std::get<0>(probabilities.max(1)).min().item<double>();
+}}
+
+/*!
+ * Cheaper models forwarded before the model.
+ *
+ * Stages are loaded during initialization, so the ones which rarely answer
+ * do not add loading latency to requests.
+ *
+ */
+class Cascade {{
+public:
+  Cascade() {{
+    for (const auto &stage : stages) {{
+      modules_.push_back(torch::jit::load(stage.path, torch::kCPU));
+#ifndef GRAD
+      modules_.back().eval();
+#endif
+    }}
+  }}
+
+  /* Output of the first confident stage (module if none), stage is it's index */
+  c10::IValue Forward(torch::jit::script::Module &module,
+                      std::vector<c10::IValue> inputs, int64_t &stage) {{
+    for (stage = 0; stage < CASCADE; ++stage) {{
+      /* Tensors of inputs are shared, not copied, by each stage */
+      auto forwarded = modules_[stage].forward(inputs);
+      if (confidence(forwarded, stages[stage].confidence) >=
+          stages[stage].threshold)
+        return forwarded;
+    }}
+    return module.forward(std::move(inputs));
+  }}
+
+private:
+  std::vector<torch::jit::script::Module> modules_;
+}};
+
+#endif
+#ifdef SESSION
+/*!
+ *
+ *                  SESSION STATE OF RECURRENT MODELS
  *
  */
 
+/*!
+ * State returned by the model for each session.
+ *
+ * State is passed as last argument of forward with the next request
+ * of the same session (None if session has no state yet).
+ * State of session without request for SESSION_TTL seconds is dropped,
+ * least recently used sessions are evicted above SESSION entries.
+ *
+ */
+class Sessions {{
+public:
+  /* State of session (None if absent or expired), marked as used now */
+  c10::IValue Find(const std::string &session) {{
+    const auto now = Clock::now();
+    Expire(now);
+    const auto found = index_.find(session);
+    if (found == index_.end())
+      return {{}};
+    found->second->used = now;
+    order_.splice(order_.begin(), order_, found->second);
+    return found->second->state;
+  }}
+
+  /* Replace state of session (found before forward) with returned one */
+  void Insert(const std::string &session, c10::IValue state) {{
+    const auto found = index_.find(session);
+    if (found != index_.end()) {{
+      found->second->state = std::move(state);
+      return;
+    }}
+    while (!order_.empty() && order_.size() >= SESSION) {{
+      index_.erase(order_.back().session);
+      order_.pop_back();
+    }}
+    order_.push_front({{session, std::move(state), Clock::now()}});
+    index_.emplace(session, order_.begin());
+  }}
+
+private:
+  using Clock = std::chrono::steady_clock;
+
+  struct Entry {{
+    std::string session;
+    c10::IValue state;
+    Clock::time_point used;
+  }};
+
+  /* Sessions are ordered by last use, so expired ones are at the back */
+  void Expire(const Clock::time_point now) {{
+    const auto deadline = now - std::chrono::seconds{{SESSION_TTL}};
+    while (!order_.empty() && order_.back().used < deadline) {{
+      index_.erase(order_.back().session);
+      order_.pop_back();
+    }}
+  }}
+
+  std::list<Entry> order_;
+  std::unordered_map<std::string, std::list<Entry>::iterator> index_;
+}};
+
+#endif
+
+#ifndef RECORDS
 static aws::lambda_runtime::invocation_response
+#ifdef MODELS
+handler(Models &models,
+#else
 handler(std::shared_ptr<torch::jit::script::Module> &module,
+#endif
         const aws::lambda_runtime::invocation_request &request
-#ifdef BASE64
+#ifdef PREALLOCATE
+        ,
+        Buffers &buffers
+#endif
+#ifdef CACHE
+        ,
+        Cache &cache
+#endif
+#ifdef CASCADE
+        ,
+        Cascade &cascade
+#endif
+#ifdef SESSION
         ,
-        const Aws::Utils::Base64::Base64 &transformer
+        Sessions &sessions
 #endif
 ) {{
-    const Aws::String data_field{{ {DATA} }};
-
     /*!
      *
      *               PARSE AND VALIDATE REQUEST
      *
      */
 
+#ifdef INSTRUMENTATION
+    Timings timings{{}};
+#endif
+
+#ifdef STREAMING
+#ifdef APIGATEWAY
+    /* Envelope of proxy event, body is either binary input or JSON request */
+    const stream::JsonView event{{request.payload}};
+    const auto event_body = event.GetObject("body");
+    if (!event.WasParseSuccessful() || !event_body.IsString())
+      return aws::lambda_runtime::invocation_response::failure(
+          "Request body was not provided.", "InvalidJSON");
+#ifdef APIGATEWAY_BINARY
+    const auto binary = event.GetObject("isBase64Encoded").Raw() == "true";
+    const auto payload = binary ? Aws::String{{}} : event_body.AsString();
+    const auto json_view = binary ? binary_request(event) : JsonView{{payload}};
+#elif defined(FORMAT)
+    /* Binary request is base64 encoded by API Gateway */
+    const auto payload = event.GetObject("isBase64Encoded").Raw() == "true"
+                             ? decode_text(event_body)
+                             : event_body.AsString();
+    const JsonView json_view{{payload}};
+#else
+    const auto payload = event_body.AsString();
+    const JsonView json_view{{payload}};
+#endif
+#else
+    /* Top level fields are indexed in single pass, values parsed on demand */
+    const JsonView json_view{{request.payload}};
+#endif
+
+#ifdef VALIDATE_JSON
+    if (!json_view.WasParseSuccessful())
+      return aws::lambda_runtime::invocation_response::failure(
+#ifdef FORMAT
+          "Failed to parse request " FORMAT " payload.", "InvalidJSON");
+#else
+          "Failed to parse request JSON file.", "InvalidJSON");
+#endif
+#endif
+#else
     const auto json = Aws::Utils::Json::JsonValue{{request.payload}};
 
 #ifdef VALIDATE_JSON
@@ -87,150 +2817,455 @@ handler(std::shared_ptr<torch::jit::script::Module> &module,
 #endif
 
     const auto json_view = json.View();
+#endif
 
-#ifdef VALIDATE_FIELD
-    if (!json_view.KeyExists(data_field))
-      return aws::lambda_runtime::invocation_response::failure(
-          "Required field: \"" {DATA} "\" was not provided.", "InvalidJSON");
-#ifdef BASE64
-    if (!json_view.GetObject(data_field).IsString())
-      return aws::lambda_runtime::invocation_response::failure(
-          "Required field: \"" {DATA} "\" is not string.", "InvalidJSON");
-#else
-    if (!json_view.GetObject(data_field).IsListType())
+#ifdef MODELS
+    /* Request is handled by code generated for model it names */
+    const auto *route = models.Find(json_view);
+    if (route == nullptr)
       return aws::lambda_runtime::invocation_response::failure(
-          "Required field: \"" {DATA} "\" is not list type.", "InvalidJSON");
-#endif
+          "Field: \"" MODELS "\" does not name any of served models.",
+          "InvalidJSON");
+    const auto create_inputs = route->create_inputs;
+    const auto create_response = route->create_response;
 #endif
 
-#if not defined(STATIC) && defined(VALIDATE_SHAPE)
-    /* Check whether all necessary fields are passed */
-
-    const Aws::String fields[]{{{FIELDS}}};
-    for (const auto &field : fields) {{
-        if (!json_view.KeyExists(field))
-          return aws::lambda_runtime::invocation_response::failure(
-              "Required input shape field: '" +
-                  std::string{{field.c_str(), field.size()}} +
-                  "' was not provided.",
-              "InvalidJSON");
+#ifdef SESSION
+    /* State of session is forwarded with inputs and replaced by returned one */
+    if (!json_view.KeyExists(SESSION_FIELD) ||
+        !json_view.GetObject(SESSION_FIELD).IsString())
+      return aws::lambda_runtime::invocation_response::failure(
+          "Required session field: \"" SESSION_FIELD
+          "\" was not provided as string.",
+          "InvalidJSON");
+    const auto session_field = json_view.GetObject(SESSION_FIELD).AsString();
+    const std::string session{{session_field.c_str(), session_field.size()}};
+#endif
 
-        if (!json_view.GetObject(field).IsIntegerType())
-          return aws::lambda_runtime::invocation_response::failure(
-              "Required shape field: '" +
-                  std::string{{field.c_str(), field.size()}} +
-                  "' is not of integer type.",
-              "InvalidJSON");
+#ifdef CACHE
+    /* Repeated request is answered without decoding and inference */
+    const auto key = cache_key(json_view, {{{CACHE_FIELDS}}});
+    if (const auto *cached = cache.Find(key)) {{
+#ifdef INSTRUMENTATION
+      TIMING(parse);
+      timings.Emit();
+#endif
+      return aws::lambda_runtime::invocation_response::success(
+          *cached, "application/json");
     }}
+#endif
 
+    std::vector<c10::IValue> inputs;
+    const auto created = create_inputs(json_view, inputs
+#ifdef PREALLOCATE
+                                       ,
+                                       buffers
+#endif
+#ifdef INSTRUMENTATION
+                                       ,
+                                       timings
 #endif
+    );
+    if (!created.is_success())
+      return created;
 
     /*!
      *
-     *            LOAD DATA, TRANSFORM TO TENSOR, NORMALIZE
+     *              MAKE INFERENCE AND RETURN JSON RESPONSE
      *
      */
 
-#ifdef BASE64
-    const auto base64_string = json_view.GetString(data_field);
-    auto data = transformer.Decode(base64_string);
-    auto *data_pointer = data.GetUnderlyingData();
-    const std::size_t data_length = data.GetLength();
+#ifdef MODELS
+    /* Loaded only after request was validated */
+    const auto module = models.Load(*route);
+#endif
+#ifdef SESSION
+    inputs.push_back(sessions.Find(session));
+#endif
+#ifdef CASCADE
+    /* Index of stage which answered request (CASCADE if module did) */
+    int64_t stage = 0;
+#endif
+#if defined(PROFILING) && defined(CASCADE)
+    const auto forwarded = profiled(
+        [&] {{ return cascade.Forward(*module, std::move(inputs), stage); }});
+#elif defined(PROFILING)
+    const auto forwarded =
+        profiled([&] {{ return module->forward(std::move(inputs)); }});
+#elif defined(CASCADE)
+    const auto forwarded = cascade.Forward(*module, std::move(inputs), stage);
 #else
-    const auto nested_json = json_view.GetArray(data_field);
-    Aws::Vector<{DATA_TYPE}> data;
-    data.reserve(nested_json.GetLength());
-
-    for (size_t i = 0; i < nested_json.GetLength(); ++i) {{
-        data.push_back(static_cast<{DATA_TYPE}>(nested_json[i].{DATA_FUNC}()));
-    }}
+    const auto forwarded = module->forward(std::move(inputs));
+#endif
+#ifdef SESSION
+    sessions.Insert(session, {SESSION_STATE});
+#endif
+    TIMING(forward);
 
-    auto *data_pointer = data.data();
-    const std::size_t data_length = nested_json.GetLength();
+    auto body = create_response(forwarded
+#ifdef CASCADE_FIELD
+                                ,
+                                stage
 #endif
-    const torch::Tensor tensor =
-#ifdef NORMALIZE
-        torch::data::transforms::Normalize<>{{
-          {{{NORMALIZE_MEANS}}}, {{{NORMALIZE_STDDEVS}}}
-        }}(
+#ifdef PREALLOCATE
+                                ,
+                                buffers
 #endif
-            torch::from_blob(
-                data_pointer,
-                {{
-                    /* Explicit cast as PyTorch has long int for some reason */
-                    static_cast<long>(data_length),
-                }},
-                {TORCH_DATA_TYPE})
-                .reshape({{{INPUTS}}})
-#ifdef CAST
-                .toType(CAST)
+#ifdef INSTRUMENTATION
+                                ,
+                                timings
+#endif
+    );
+#ifdef RESPONSE_COMPRESSION
+    body = compress_response(body);
+    TIMING(serialize);
 #endif
-#ifdef DIVIDE
-            / DIVIDE
+#ifdef INSTRUMENTATION
+    timings.Emit();
 #endif
-#ifdef NORMALIZE
-        )
+#ifdef CACHE
+    cache.Insert(key, body);
 #endif
-        ;
+    return aws::lambda_runtime::invocation_response::success(
+        body, "application/json");
+}}
 
-    /*!
-     *
-     *              MAKE INFERENCE AND RETURN JSON RESPONSE
-     *
-     */
+#endif
 
-    /* Support for multi-output/multi-input? */
+#ifdef RECORDS
+/*!
+ *
+ *                     SQS & KINESIS RECORDS EVENTS
+ *
+ */
 
-    const auto output = module->forward({{tensor}})
-                      .toTensor()
-#ifdef RETURN_OUTPUT
-                      .toType({OUTPUT_CAST})
+/* Whether inputs of records have equal shapes (except first dimension) */
+static bool stackable(const std::vector<c10::IValue> &first,
+                      const std::vector<c10::IValue> &second) {{
+  for (std::size_t input = 0; input < first.size(); ++input) {{
+    const auto first_sizes = first[input].toTensor().sizes();
+    const auto second_sizes = second[input].toTensor().sizes();
+    if (first_sizes.size() != second_sizes.size() ||
+        !std::equal(first_sizes.begin() + 1, first_sizes.end(),
+                    second_sizes.begin() + 1))
+      return false;
+  }}
+  return true;
+}}
+
+/*!
+ * Handle SQS or Kinesis event containing multiple records.
+ *
+ * Request of each record (body of SQS message or base64 decoded data
+ * of Kinesis record) is validated and decoded separately.
+ * Consecutive records with equal input shapes are concatenated along first
+ * dimension and forwarded together (up to RECORDS records at once),
+ * after which outputs are split back per record.
+ *
+ * Response contains identifiers of records with invalid requests as
+ * `batchItemFailures` (partial batch response, only those records are
+ * retried) and `results` (response or error) of each record in order.
+ *
+ */
+static aws::lambda_runtime::invocation_response
+records_handler(std::shared_ptr<torch::jit::script::Module> &module,
+                const aws::lambda_runtime::invocation_request &request) {{
+#ifdef INSTRUMENTATION
+    Timings timings{{}};
 #endif
-        ;
 
-    /* Perform operation to create result */
-#if defined(RETURN_RESULT) || defined(RETURN_RESULT_ITEM)
-    const auto result = ({OPERATIONS_AND_ARGUMENTS}).toType({RESULT_CAST});
+    const stream::JsonView event{{request.payload}};
+    if (!event.WasParseSuccessful() || !event.GetObject("Records").IsListType())
+      return aws::lambda_runtime::invocation_response::failure(
+          "Records of event were not provided.", "InvalidJSON");
+    const auto records = event.GetObject("Records").AsArray();
+
+    std::vector<std::string_view> identifiers(records.GetLength());
+    std::vector<std::string> results(records.GetLength());
+    std::vector<bool> failed(records.GetLength(), false);
+#ifdef FORMAT
+    /* Binary inputs view payloads of records until they are forwarded */
+    std::vector<Aws::String> payloads(records.GetLength());
 #endif
 
-    /* If array of outputs to be returned gather values as JSON */
-#ifdef RETURN_OUTPUT
-    Aws::Utils::Array<Aws::Utils::Json::JsonValue> output_array{{ 
-        static_cast<std::size_t>(output.numel())
-    }};
-    CREATE_JSON_ARRAY(output_array, output, output_ptr, {AWS_OUTPUT_FUNCTION},
-                      {TORCH_OUTPUT_TYPE}, {OUTPUT_TYPE})
+    /* Decoded inputs of records waiting to be forwarded together */
+    std::vector<std::pair<std::size_t, std::vector<c10::IValue>>> batch;
+    const auto forward = [&] {{
+      std::vector<c10::IValue> stacked;
+      for (std::size_t input = 0; input < batch.front().second.size(); ++input) {{
+        if (batch.size() == 1) {{
+          stacked.push_back(batch.front().second[input]);
+          continue;
+        }}
+        std::vector<torch::Tensor> tensors;
+        tensors.reserve(batch.size());
+        for (const auto &record : batch)
+          tensors.push_back(record.second[input].toTensor());
+        stacked.push_back(torch::cat(tensors));
+      }}
+      TIMING(preprocess);
+
+#ifdef PROFILING
+      const auto forwarded =
+          profiled([&] {{ return module->forward(std::move(stacked)); }});
+#else
+      const auto forwarded = module->forward(std::move(stacked));
 #endif
+      TIMING(forward);
 
-    /* If array of results to be returned gather values as JSON */
-#ifdef RETURN_RESULT
-    Aws::Utils::Array<Aws::Utils::Json::JsonValue> result_array{{
-        static_cast<std::size_t>(result.numel())
+      int64_t first = 0;
+      for (const auto &record : batch) {{
+        const auto samples = record.second.front().toTensor().size(0);
+        results[record.first] = create_response(forwarded, first, samples
+#ifdef INSTRUMENTATION
+                                                ,
+                                                timings
+#endif
+        );
+        first += samples;
+      }}
+      batch.clear();
     }};
-    CREATE_JSON_ARRAY(result_array, result, result_ptr, {AWS_RESULT_FUNCTION},
-                      {TORCH_RESULT_TYPE}, {RESULT_TYPE})
+
+    for (std::size_t index = 0; index < records.GetLength(); ++index) {{
+#ifdef KINESIS
+      const auto record = records[index].AsObject().GetObject("kinesis").AsObject();
+      identifiers[index] = record.GetObject("sequenceNumber").Raw();
+#ifdef FORMAT
+      const auto &payload = payloads[index] = decode_text(record.GetObject("data"));
+#else
+      const auto payload = decode_text(record.GetObject("data"));
+#endif
+#else
+      const auto record = records[index].AsObject();
+      identifiers[index] = record.GetObject("messageId").Raw();
+      const auto payload = record.GetObject("body").AsString();
+#endif
+      const JsonView json_view{{payload}};
+
+#ifdef VALIDATE_JSON
+      if (!json_view.WasParseSuccessful()) {{
+        failed[index] = true;
+        results[index] = aws::lambda_runtime::invocation_response::failure(
+#ifdef FORMAT
+                             "Failed to parse request " FORMAT " payload.",
+#else
+                             "Failed to parse request JSON file.",
+#endif
+                             "InvalidJSON")
+                             .get_payload();
+        continue;
+      }}
+#endif
+
+      std::vector<c10::IValue> inputs;
+      const auto created = create_inputs(json_view, inputs
+#ifdef INSTRUMENTATION
+                                         ,
+                                         timings
 #endif
+      );
+      if (!created.is_success()) {{
+        failed[index] = true;
+        results[index] = created.get_payload();
+        continue;
+      }}
+      if (!batch.empty() &&
+          (batch.size() == RECORDS || !stackable(batch.front().second, inputs)))
+        forward();
+      batch.emplace_back(index, std::move(inputs));
+    }}
+    if (!batch.empty())
+      forward();
 
-    /* Return JSON with response */
+    std::size_t length = 64;
+    for (std::size_t index = 0; index < results.size(); ++index)
+      length += results[index].size() + identifiers[index].size() + 24;
+    std::string body;
+    body.reserve(length);
+    body.append("{{\"batchItemFailures\":[");
+    bool first = true;
+    for (std::size_t index = 0; index < results.size(); ++index) {{
+      if (!failed[index])
+        continue;
+      if (!first)
+        body.push_back(',');
+      first = false;
+      body.append("{{\"itemIdentifier\":");
+      body.append(identifiers[index].empty() ? "null" : identifiers[index]);
+      body.push_back('}}');
+    }}
+    body.append("],\"results\":[");
+    for (std::size_t index = 0; index < results.size(); ++index) {{
+      if (index != 0)
+        body.push_back(',');
+      body.append(results[index]);
+    }}
+    body.append("]}}");
+#ifdef INSTRUMENTATION
+    timings.Emit();
+#endif
     return aws::lambda_runtime::invocation_response::success(
-        Aws::Utils::Json::JsonValue{{}}
-#ifdef RETURN_OUTPUT
-            .WithArray("{OUTPUT_NAME}", output_array)
-#elif defined(RETURN_OUTPUT_ITEM)
-            .ADD_ITEM(output, {AWS_OUTPUT_ITEM_FUNCTION}, "{OUTPUT_NAME}",
-                      {TORCH_OUTPUT_TYPE}, {OUTPUT_TYPE})
-#endif
-#ifdef RETURN_RESULT
-            .WithArray("{RESULT_NAME}", result_array)
-#elif defined(RETURN_RESULT_ITEM)
-            .ADD_ITEM(result, {AWS_RESULT_ITEM_FUNCTION}, "{RESULT_NAME}",
-                      {TORCH_RESULT_TYPE}, {RESULT_TYPE})
-#endif
-            .View()
-            .WriteCompact(),
-        "application/json"
-    );
+        body, "application/json");
+}}
+
+#endif
+
+#if defined(INTRA_OP_THREADS) || defined(INTER_OP_THREADS)
+/*!
+ *
+ *                       AVAILABLE VCPUS DETECTION
+ *
+ */
+
+/* Number of vCPUs from cgroup CPU quota (v2 or v1), -1 if unlimited/unknown */
+static int cgroup_cpus() {{
+  long quota = -1, period = 0;
+  if (auto *file = std::fopen("/sys/fs/cgroup/cpu.max", "r")) {{
+    char limit[32];
+    if (std::fscanf(file, "%31s %ld", limit, &period) == 2 &&
+        std::strcmp(limit, "max") != 0)
+      quota = std::atol(limit);
+    std::fclose(file);
+  }} else {{
+    if (auto *file = std::fopen("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "r")) {{
+      if (std::fscanf(file, "%ld", &quota) != 1)
+        quota = -1;
+      std::fclose(file);
+    }}
+    if (auto *file = std::fopen("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "r")) {{
+      if (std::fscanf(file, "%ld", &period) != 1)
+        period = 0;
+      std::fclose(file);
+    }}
+  }}
+  if (quota <= 0 || period <= 0)
+    return -1;
+  return static_cast<int>((quota + period - 1) / period);
+}}
+
+/* vCPUs of Lambda, allocated proportionally to memory (1769 MB per vCPU) */
+static int available_cpus() {{
+  const auto hardware = static_cast<int>(std::thread::hardware_concurrency());
+  auto cpus = cgroup_cpus();
+  if (cpus <= 0)
+    if (const char *memory = std::getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE"))
+      cpus = (std::atoi(memory) + 1768) / 1769;
+  if (cpus <= 0 || (hardware > 0 && cpus > hardware))
+    cpus = hardware;
+  return std::max(cpus, 1);
 }}
+#endif
+
+#ifdef INSTRUMENTATION
+/*!
+ *
+ *                COLD START BREAKDOWN INSTRUMENTATION
+ *
+ */
+
+/*!
+ * Milliseconds taken by each initialization step in main().
+ *
+ * Time before main() (loader and static initializers, e.g. of whole-archive
+ * linked libtorch) is the difference between process start time
+ * (/proc/self/stat, clock ticks resolution) and entering main().
+ *
+ */
+class InitTimings {{
+public:
+  InitTimings() {{ Add("static_initialization", BeforeMain()); }}
+
+  void Mark(const char *step) {{
+    const auto now = std::chrono::steady_clock::now();
+    Add(step, std::chrono::duration<double, std::milli>(now - last_).count());
+    last_ = now;
+  }}
+
+  /* Add sum of all steps, called once after last mark */
+  void Finish() {{ steps_.emplace_back("total", total_); }}
+
+  /* Print EMF line with init_ prefixed metric of each step */
+  void Emit() const {{
+    static const char *function = std::getenv("AWS_LAMBDA_FUNCTION_NAME");
+    const auto timestamp =
+        std::chrono::duration_cast<std::chrono::milliseconds>(
+            std::chrono::system_clock::now().time_since_epoch())
+            .count();
+    std::string line{{"{{\"_aws\":{{\"Timestamp\":"}};
+    line.reserve(1024);
+    line.append(std::to_string(timestamp));
+    line.append(",\"CloudWatchMetrics\":[{{\"Namespace\":\"" INSTRUMENTATION
+                "\",\"Dimensions\":[[\"FunctionName\"]],\"Metrics\":[");
+    for (std::size_t i = 0; i < steps_.size(); ++i) {{
+      if (i != 0)
+        line.push_back(',');
+      line.append("{{\"Name\":\"init_");
+      line.append(steps_[i].first);
+      line.append("\",\"Unit\":\"Milliseconds\"}}");
+    }}
+    line.append("]}}]}},\"FunctionName\":\"");
+    line.append(function == nullptr ? "torchlambda" : function);
+    line.push_back('"');
+    char value[32];
+    for (const auto &step : steps_) {{
+      std::snprintf(value, sizeof(value), "%.3f", step.second);
+      line.append(",\"init_");
+      line.append(step.first);
+      line.append("\":");
+      line.append(value);
+    }}
+    line.append("}}\n");
+    std::fwrite(line.data(), 1, line.size(), stdout);
+    std::fflush(stdout);
+  }}
+
+  /* Print human readable breakdown (local mode) */
+  void Print() const {{
+    std::printf("torchlambda:: Initialization breakdown:\n");
+    for (const auto &step : steps_)
+      std::printf("  %-24s %10.3f ms\n", step.first, step.second);
+    std::fflush(stdout);
+  }}
+
+private:
+  void Add(const char *step, const double milliseconds) {{
+    steps_.emplace_back(step, milliseconds);
+    total_ += milliseconds;
+  }}
+
+  static double BeforeMain() {{
+    unsigned long long start = 0;
+    if (auto *file = std::fopen("/proc/self/stat", "r")) {{
+      char stat[1024];
+      const auto length = std::fread(stat, 1, sizeof(stat) - 1, file);
+      std::fclose(file);
+      stat[length] = '\0';
+      /* Process name may contain spaces, fields are counted after it */
+      const char *field = std::strrchr(stat, ')');
+      for (int index = 2; field != nullptr && index < 22; ++index)
+        field = std::strchr(field + 1, ' ');
+      if (field != nullptr)
+        start = std::strtoull(field + 1, nullptr, 10);
+    }}
+    timespec now{{}};
+    if (start == 0 || clock_gettime(CLOCK_BOOTTIME, &now) != 0)
+      return 0.0;
+    const auto since_boot = now.tv_sec * 1000.0 + now.tv_nsec / 1e6;
+    return std::max(since_boot - start * 1000.0 / sysconf(_SC_CLK_TCK), 0.0);
+  }}
+
+  std::chrono::steady_clock::time_point last_ =
+      std::chrono::steady_clock::now();
+  std::vector<std::pair<const char *, double>> steps_;
+  double total_ = 0.0;
+}};
+
+/* Add time elapsed since previous mark as initialization step */
+#define INIT_TIMING(step) init_timings.Mark(#step)
+#else
+#define INIT_TIMING(step)
+#endif
 
 int main() {{
     /*!
@@ -239,16 +3274,42 @@ int main() {{
      *
      */
 
+#ifdef INSTRUMENTATION
+    InitTimings init_timings{{}};
+#endif
+#ifdef WARMUP
+    const auto initialization_start = std::chrono::steady_clock::now();
+#endif
+
     Aws::SDKOptions options;
     Aws::InitAPI(options);
+    INIT_TIMING(aws_init);
     {{
+#ifdef INTRA_OP_THREADS
+        /* Threads used within single operation (e.g. convolution) */
+        at::set_num_threads(INTRA_OP_THREADS);
+#endif
+#ifdef INTER_OP_THREADS
+        /* Threads used to run independent operations of graph in parallel */
+        at::set_num_interop_threads(INTER_OP_THREADS);
+#endif
+#if defined(INTRA_OP_THREADS) || defined(INTER_OP_THREADS)
+        std::printf("torchlambda:: Using %d intra-op and %d inter-op threads\n",
+                    at::get_num_threads(), at::get_num_interop_threads());
+        INIT_TIMING(threads);
+#endif
 #ifndef GRAD
         torch::NoGradGuard no_grad_guard{{}};
 #endif
 #ifndef OPTIMIZE
         torch::jit::setGraphExecutorOptimize(false);
 #endif
+        INIT_TIMING(graph_executor);
 
+#ifdef MODELS
+        /* Served models are loaded by requests routed to them */
+        Models models{{}};
+#else
         /* Change name/path to your model if you so desire */
         /* Layers are unpacked to /opt, so you are better off keeping it */
         constexpr auto model_path = {MODEL_PATH};
@@ -258,25 +3319,137 @@ int main() {{
             "TORCHSCRIPT_MODEL", torch::jit::load(model_path, torch::kCPU));
         if (module == nullptr)
             return -1;
+        INIT_TIMING(load);
 #ifndef GRAD
         module->eval();
+        INIT_TIMING(eval);
+#endif
+#endif
+#ifdef CASCADE
+        /* Cheaper models forwarded before the model */
+        Cascade cascade{{}};
+        INIT_TIMING(cascade);
+#endif
+#ifdef SESSION
+        Sessions sessions{{}};
 #endif
 
-        const Aws::Utils::Base64::Base64 transformer{{}};
-        const auto handler_fn = [&module
-#ifdef BASE64
+#ifdef PREALLOCATE
+        /* Storage of inputs and returned tensors reused by every request */
+        Buffers buffers{ALLOCATE_BUFFERS};
+        INIT_TIMING(buffers);
+#endif
+#ifdef CACHE
+        /* Warm-up (if any) runs with empty cache, so each request is inferred */
+#ifdef WARMUP
+        Cache cache{{0, 0}};
+#else
+        Cache cache{{CACHE, CACHE_BYTES}};
+#endif
+#endif
+        const auto handler_fn = [
+#ifdef MODELS
+                                 &models
+#else
+                                 &module
+#endif
+#ifdef PREALLOCATE
                                  ,
-                                 &transformer
+                                 &buffers
+#endif
+#ifdef CACHE
+                                 ,
+                                 &cache
+#endif
+#ifdef CASCADE
+                                 ,
+                                 &cascade
+#endif
+#ifdef SESSION
+                                 ,
+                                 &sessions
 #endif
         ](const aws::lambda_runtime::invocation_request &request){{
+#ifdef RECORDS
+            return records_handler(module, request);
+#else
+#ifdef MODELS
+            return handler(models, request
+#else
             return handler(module, request
-#ifdef BASE64
+#endif
+#ifdef PREALLOCATE
+                           ,
+                           buffers
+#endif
+#ifdef CACHE
+                           ,
+                           cache
+#endif
+#ifdef CASCADE
+                           ,
+                           cascade
+#endif
+#ifdef SESSION
                            ,
-                           transformer
+                           sessions
 #endif
             );
+#endif
         }};
-        aws::lambda_runtime::run_handler(handler_fn);
+
+#ifdef WARMUP
+        /* Run embedded requests through whole handler before first real one */
+        {{
+          const std::string payloads[]{{{WARMUP_PAYLOADS}}};
+          const auto warmup_start = std::chrono::steady_clock::now();
+          for (const auto &payload : payloads)
+            for (int iteration = 0; iteration < WARMUP; ++iteration) {{
+              aws::lambda_runtime::invocation_request request{{}};
+              request.payload = payload;
+              const auto response = handler_fn(request);
+              if (!response.is_success())
+                std::fprintf(stderr, "torchlambda:: Warm-up request failed: %s\n",
+                             response.get_payload().c_str());
+            }}
+          const auto warmup_end = std::chrono::steady_clock::now();
+          std::printf(
+              "torchlambda:: Warm-up of %d request(s) took %.3f ms, "
+              "initialization took %.3f ms in total\n",
+              static_cast<int>(std::size(payloads)) * WARMUP,
+              std::chrono::duration<double, std::milli>(warmup_end - warmup_start)
+                  .count(),
+              std::chrono::duration<double, std::milli>(warmup_end -
+                                                        initialization_start)
+                  .count());
+          std::fflush(stdout);
+        }}
+        INIT_TIMING(warmup);
+#ifdef CACHE
+        cache = Cache{{CACHE, CACHE_BYTES}};
+#endif
+#endif
+#ifdef APIGATEWAY
+        /* Responses (and failures) are returned to HTTP clients */
+        const auto invoke =
+            [&handler_fn](const aws::lambda_runtime::invocation_request &request) {{
+              return proxy(handler_fn(request));
+            }};
+#else
+        const auto &invoke = handler_fn;
+#endif
+#ifdef INSTRUMENTATION
+        init_timings.Finish();
+        /* Local mode (no Lambda Runtime API), breakdown is only printed */
+        if (std::getenv("AWS_LAMBDA_RUNTIME_API") == nullptr)
+          init_timings.Print();
+        else {{
+          init_timings.Emit();
+          aws::lambda_runtime::run_handler(invoke);
+        }}
+#else
+        aws::lambda_runtime::run_handler(invoke);
+#endif
     }}
 
     Aws::ShutdownAPI(options);
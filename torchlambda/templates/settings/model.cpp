@@ -0,0 +1,96 @@
+{PREPROCESSING}
+{POSTPROCESSING}
+/*!
+ * Validate request and create tensors of it's inputs (in order of forward).
+ *
+ * Failure is returned if request is invalid, empty success otherwise.
+ *
+ */
+static aws::lambda_runtime::invocation_response
+create_inputs(const JsonView &json_view, std::vector<c10::IValue> &inputs
+#ifdef PREALLOCATE
+              ,
+              Buffers &buffers
+#endif
+#ifdef INSTRUMENTATION
+              ,
+              Timings &timings
+#endif
+) {{
+{VALIDATE_INPUTS}
+#if not defined(STATIC) && defined(VALIDATE_SHAPE)
+    /* Check whether all necessary fields are passed */
+
+    const std::initializer_list<Aws::String> fields{{{FIELDS}}};
+    for (const auto &field : fields) {{
+        if (!json_view.KeyExists(field))
+          return aws::lambda_runtime::invocation_response::failure(
+              "Required input shape field: '" +
+                  std::string{{field.c_str(), field.size()}} +
+                  "' was not provided.",
+              "InvalidJSON");
+
+        if (!json_view.GetObject(field).IsIntegerType())
+          return aws::lambda_runtime::invocation_response::failure(
+              "Required shape field: '" +
+                  std::string{{field.c_str(), field.size()}} +
+                  "' is not of integer type.",
+              "InvalidJSON");
+    }}
+
+#endif
+
+{VALIDATE_BYTES}
+    TIMING(parse);
+
+    /*!
+     *
+     *            LOAD DATA, TRANSFORM TO TENSOR, NORMALIZE
+     *
+     */
+
+{CREATE_INPUTS}
+    inputs = {{{FORWARD_INPUTS}}};
+    return aws::lambda_runtime::invocation_response::success("",
+                                                             "application/json");
+}}
+
+/*!
+ * Serialize returned outputs, results and predictions into JSON response.
+ *
+ * For records events samples [first, first + samples) of forwarded
+ * belong to single record.
+ *
+ */
+static std::string create_response(const c10::IValue &forwarded
+#ifdef RECORDS
+                                   ,
+                                   const int64_t first, const int64_t samples
+#endif
+#ifdef CASCADE_FIELD
+                                   ,
+                                   const int64_t stage
+#endif
+#ifdef PREALLOCATE
+                                   ,
+                                   Buffers &buffers
+#endif
+#ifdef INSTRUMENTATION
+                                   ,
+                                   Timings &timings
+#endif
+) {{
+    Response response{{}};
+
+{CREATE_RETURNS}
+#ifdef CASCADE_FIELD
+    response.Integer(CASCADE_FIELD, stage);
+#endif
+    TIMING(serialize);
+
+#ifdef INSTRUMENTATION_RESPONSE
+    response.Object("timings", Timings::names, timings.Milliseconds(),
+                    Timings::count, 3);
+#endif
+    return response.Finish();
+}}